@@ -0,0 +1,294 @@
+# admission.py
+"""
+Admission control between interactive and bulk work.
+
+Every /api request falls into one of three classes, each with its own
+concurrency limit and wait queue:
+
+    read    GET / HEAD                      FMS_ADMIT_READ   (24), queue 200
+    write   other interactive methods        FMS_ADMIT_WRITE  (8),  queue 100
+    bulk    exports, imports, restores,     FMS_ADMIT_BULK   (2),  queue 4
+            batch loads, order receipts,
+            admin jobs (BULK_ROUTES)
+
+A request over its class's limit waits in that class's queue (FIFO) for
+up to FMS_ADMIT_WAIT_SECONDS (read 5, write 10, bulk 2). If the queue is
+full, or the wait runs out, it gets 429 with a Retry-After estimated from
+the class's recent service time. The limits add up to less than the
+threadpool (40 threads), so one admin's export/import/restore can no longer
+take every thread.
+
+The writer side: SQLite has one writer, so bulk work also gives way to
+interactive writes. While any interactive write is in flight, a bulk
+request that opens a new connection (db._connect, through
+db.add_connect_hook) waits for it to finish, for at most
+FMS_ADMIT_BULK_YIELD_MS (250) each time. Bulk code opens a connection per
+statement or per transaction, so a checkout that arrives during a restore
+waits for one bulk transaction, not for the whole restore.
+
+GET /api/admin/admission shows per class: limit, in flight, queued,
+admitted / rejected counts, and queue wait (avg, p50, p95, max over the
+last 1024 admissions).
+"""
+import asyncio
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import APIRouter, Depends
+
+import db
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/admission", tags=["admin"])
+
+# (method, path pattern) of the bulk endpoints; a pattern matches from the start of the path
+BULK_ROUTES = (
+    ("GET", r"/api/export"),
+    ("POST", r"/api/import_file"),
+    ("POST", r"/api/restore_catalog"),
+    ("POST", r"/api/items/bulk"),
+    ("POST", r"/api/movements/batch"),
+    ("POST", r"/api/orders/\d+/receive$"),
+    ("POST", r"/api/locations/occupancy/rebuild"),
+    ("POST", r"/api/analytics/refresh"),
+    ("POST", r"/api/analytics/checkouts/refresh"),
+    ("POST", r"/api/admin/"),
+)
+_BULK = [(m, re.compile(p)) for m, p in BULK_ROUTES]
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+BULK_YIELD_SECONDS = float(os.getenv("FMS_ADMIT_BULK_YIELD_MS", "250")) / 1000.0
+WAIT_SAMPLES = 1024
+
+_class: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("fms_admission_class", default=None)
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Gate:
+    """A FIFO counting gate. Thread-safe, and a waiter is woken on its own event loop."""
+
+    def __init__(self, name: str, limit: int, max_queue: int, wait_seconds: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.service_ewma = 0.05   # seconds, seeds Retry-After before anything finished
+
+    def retry_after(self) -> int:
+        backlog = len(self._waiters) + 1
+        return max(1, min(60, math.ceil(self.service_ewma * backlog / self.limit)))
+
+    async def enter(self) -> float:
+        """Take a slot; returns seconds spent queued. Raises Rejected."""
+        started = time.perf_counter()
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                self.waits.append(0.0)
+                return 0.0
+            if len(self._waiters) >= self.max_queue:
+                self.rejected_full += 1
+                raise Rejected(self.retry_after(), f"Too many {self.name} requests queued.")
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.wait_seconds)
+        except BaseException as e:   # timed out, or the client went away
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            with self._lock:
+                # still queued means nobody handed us a slot. _pass_on dequeues before the
+                # wake-up lands, so fut.done() can't tell us that
+                queued = fut in self._waiters
+                if queued:
+                    self._waiters.remove(fut)
+                    fut.cancel()
+                    if timed_out:
+                        self.rejected_timeout += 1
+                        retry_after = self.retry_after()
+            if queued:
+                if timed_out:
+                    raise Rejected(retry_after, f"Timed out waiting for a {self.name} slot.")
+                raise
+            # the slot was handed over just as we gave up: keep it, or pass it on
+            if not timed_out:
+                self._pass_on()
+                raise
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.admitted += 1
+            self.waits.append(waited)
+        return waited
+
+    def leave(self, service_seconds: float) -> None:
+        with self._lock:
+            self.service_ewma = 0.8 * self.service_ewma + 0.2 * service_seconds
+        self._pass_on()
+
+    def _pass_on(self) -> None:
+        with self._lock:
+            while self._waiters:
+                fut = self._waiters.popleft()
+                if not fut.done():
+                    # the slot passes straight to the next waiter; in_flight stays the same
+                    fut.get_loop().call_soon_threadsafe(_wake, fut)
+                    return
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self.waits)
+            out = {"limit": self.limit, "max_queue": self.max_queue, "wait_seconds": self.wait_seconds,
+                   "in_flight": self.in_flight, "queued": len(self._waiters), "admitted": self.admitted,
+                   "rejected_full": self.rejected_full, "rejected_timeout": self.rejected_timeout,
+                   "avg_service_ms": round(self.service_ewma * 1000.0, 1)}
+        if waits:
+            out["wait_ms"] = {"avg": round(sum(waits) / len(waits) * 1000.0, 2),
+                              "p50": round(waits[len(waits) // 2] * 1000.0, 2),
+                              "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000.0, 2),
+                              "max": round(waits[-1] * 1000.0, 2)}
+        return out
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _env(name: str, default: str) -> float:
+    return float(os.getenv(name, default))
+
+
+GATES: Dict[str, Gate] = {
+    "read": Gate("read", int(_env("FMS_ADMIT_READ", "24")), int(_env("FMS_ADMIT_READ_QUEUE", "200")),
+                 _env("FMS_ADMIT_READ_WAIT_SECONDS", "5")),
+    "write": Gate("write", int(_env("FMS_ADMIT_WRITE", "8")), int(_env("FMS_ADMIT_WRITE_QUEUE", "100")),
+                  _env("FMS_ADMIT_WRITE_WAIT_SECONDS", "10")),
+    "bulk": Gate("bulk", int(_env("FMS_ADMIT_BULK", "2")), int(_env("FMS_ADMIT_BULK_QUEUE", "4")),
+                 _env("FMS_ADMIT_BULK_WAIT_SECONDS", "2")),
+}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Workload class of a request, or None for what isn't admission-controlled (pages, static)."""
+    if not path.startswith("/api/"):
+        return None
+    for m, pattern in _BULK:
+        if method == m and pattern.match(path):
+            return "bulk"
+    return "read" if method in READ_METHODS else "write"
+
+
+# --------------------------------------------------------------------------
+# the writer: bulk gives way to interactive writes
+# --------------------------------------------------------------------------
+
+_writers = threading.Condition()
+_interactive_writes = 0
+_yield_stats = {"count": 0, "seconds": 0.0}
+
+
+def _write_started() -> None:
+    global _interactive_writes
+    with _writers:
+        _interactive_writes += 1
+
+
+def _write_finished() -> None:
+    global _interactive_writes
+    with _writers:
+        _interactive_writes -= 1
+        if not _interactive_writes:
+            _writers.notify_all()
+
+
+def _yield_to_interactive() -> None:
+    """db connect hook: a bulk request waits (briefly) while interactive writes are in flight."""
+    if _class.get() != "bulk" or not _interactive_writes:
+        return
+    try:
+        asyncio.get_running_loop()
+        return   # never block the event loop itself
+    except RuntimeError:
+        pass
+    started = time.monotonic()
+    deadline = started + BULK_YIELD_SECONDS
+    with _writers:
+        while _interactive_writes:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            _writers.wait(left)
+        _yield_stats["count"] += 1
+        _yield_stats["seconds"] += time.monotonic() - started
+
+
+db.add_connect_hook(_yield_to_interactive)
+
+
+# --------------------------------------------------------------------------
+# middleware
+# --------------------------------------------------------------------------
+
+async def _too_busy(send, err: Rejected) -> None:
+    await send({"type": "http.response.start", "status": 429,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"retry-after", str(err.retry_after).encode())]})
+    await send({"type": "http.response.body", "body": json.dumps({"detail": err.reason}).encode()})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI: the slot is held until the last byte of the response is sent (streamed exports too)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        kind = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if kind is None:
+            return await self.app(scope, receive, send)
+
+        gate = GATES[kind]
+        try:
+            await gate.enter()
+        except Rejected as err:
+            return await _too_busy(send, err)
+
+        token = _class.set(kind)
+        if kind == "write":
+            _write_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if kind == "write":
+                _write_finished()
+            _class.reset(token)
+            gate.leave(time.perf_counter() - started)
+
+
+@router.get("")
+def get_admission(user=Depends(require_admin)):
+    return {"classes": {name: gate.stats() for name, gate in GATES.items()},
+            "interactive_writes_in_flight": _interactive_writes,
+            "bulk_yields": {"count": _yield_stats["count"],
+                            "seconds": round(_yield_stats["seconds"], 3)}}
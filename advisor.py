@@ -0,0 +1,570 @@
+# advisor.py
+"""
+Index advisor.
+
+Every query the app runs on its connections (db._connect / db.get_conn,
+timed in storage.py) is folded into a "shape" (the SQL text with comments and whitespace squashed; values are
+already ? placeholders). For each shape we keep a count, timings and the last
+parameters seen (text redacted once it leaves the process, see
+redact_params), so we can later:
+
+  1. run EXPLAIN QUERY PLAN and spot full table scans and temp B-tree sorts
+  2. propose expression / composite / covering indexes for them
+  3. try the proposals on a throwaway copy of the database and time the
+     recorded shapes before and after
+
+Admin endpoints live under /api/admin/indexes. The same thing from a shell:
+
+    python advisor.py report
+    python advisor.py benchmark            # proposals vs. a copy of the db
+    python advisor.py apply                # create the proposals on the live db
+
+Shapes are kept in memory per worker and merged into SHAPES_PATH on
+snapshot / shutdown so the CLI can see what the app has been running.
+"""
+import argparse
+import atexit
+import json
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, Body, Depends, HTTPException
+
+import db
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/indexes", tags=["admin"])
+
+SHAPES_PATH = os.getenv("FMS_SHAPES_PATH", "Database/query_shapes.json")
+MAX_SHAPES = 500
+
+_lock = threading.Lock()
+_shapes: Dict[str, Dict[str, Any]] = {}
+
+_COMMENT_RE = re.compile(r"--[^\n]*")
+_WS_RE = re.compile(r"\s+")
+_SQL_KEYWORDS = {
+    "where", "left", "right", "inner", "outer", "cross", "join", "on", "order", "group",
+    "limit", "offset", "having", "union", "select", "set", "values", "as", "using",
+}
+
+
+def normalize_sql(sql: str) -> str:
+    sql = _COMMENT_RE.sub(" ", sql)
+    return _WS_RE.sub(" ", sql).strip().rstrip(";").strip()
+
+
+def _jsonable(params: Sequence[Any]) -> List[Any]:
+    out = []
+    for p in params:
+        out.append(p if isinstance(p, (int, float, str)) or p is None else str(p))
+    return out
+
+
+REDACTED = "<redacted>"
+
+
+def redact_params(params: Sequence[Any]) -> List[Any]:
+    """
+    Parameters fit to write to disk: numbers (ids, limits, offsets) and NULLs
+    stay, so plans and timings replayed from them stay realistic; text and
+    anything else becomes REDACTED, so no name, email or search term does.
+    """
+    return [p if p is None or isinstance(p, (int, float)) else REDACTED for p in params]
+
+
+_PLANNABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def record_statement(sql: str, params: Sequence[Any], elapsed: float) -> None:
+    shape = normalize_sql(sql)
+    if not shape[:6].upper().startswith(_PLANNABLE):
+        return   # PRAGMA, BEGIN/COMMIT, scripts: nothing to index
+    ms = elapsed * 1000.0
+    with _lock:
+        s = _shapes.get(shape)
+        if s is None:
+            if len(_shapes) >= MAX_SHAPES:
+                return
+            s = _shapes[shape] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "params": []}
+        s["count"] += 1
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+        if params or "?" not in shape:   # executemany reports none; keep the last real ones
+            s["params"] = _jsonable(params)
+
+
+db.add_statement_hook(record_statement)
+
+
+def snapshot_shapes(path: str = SHAPES_PATH) -> int:
+    """Merge this worker's shapes into `path` (other workers do the same)."""
+    with _lock:
+        mine = {k: dict(v, params=redact_params(v["params"])) for k, v in _shapes.items()}
+
+    merged = load_shapes(path)
+    for shape, s in mine.items():
+        m = merged.get(shape)
+        if m is None:
+            merged[shape] = s
+        else:
+            m["count"] += s["count"]
+            m["total_ms"] += s["total_ms"]
+            m["max_ms"] = max(m["max_ms"], s["max_ms"])
+            m["params"] = s["params"]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(merged, fh, indent=1)
+    os.replace(tmp, path)
+
+    with _lock:
+        for shape in mine:
+            _shapes.pop(shape, None)
+    return len(merged)
+
+
+def load_shapes(path: str = SHAPES_PATH) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+@atexit.register
+def _flush_on_exit():
+    if _shapes:
+        try:
+            snapshot_shapes()
+        except Exception as e:
+            print("[advisor] could not save query shapes:", e)
+
+
+def _all_shapes() -> Dict[str, Dict[str, Any]]:
+    merged = load_shapes()
+    with _lock:
+        for shape, s in _shapes.items():
+            m = merged.setdefault(shape, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "params": s["params"]})
+            m["count"] += s["count"]
+            m["total_ms"] += s["total_ms"]
+            m["max_ms"] = max(m["max_ms"], s["max_ms"])
+            m["params"] = s["params"]
+    return merged
+
+
+# --------------------------------------------------------------------------
+# SQL picking-apart (just enough for the statements this app issues)
+# --------------------------------------------------------------------------
+
+def _aliases(sql: str) -> Dict[str, str]:
+    """alias -> table, for every FROM/JOIN/UPDATE target (tables map to themselves)."""
+    out: Dict[str, str] = {}
+    for m in re.finditer(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.I):
+        table, alias = m.group(1), m.group(2)
+        out[table] = table
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            out[alias] = table
+    return out
+
+
+def _order_by_clauses(sql: str) -> List[List[Tuple[str, str]]]:
+    """Every ORDER BY list in `sql` as [(expression, 'ASC'|'DESC'), ...]."""
+    clauses = []
+    for m in re.finditer(r"\bORDER\s+BY\b", sql, re.I):
+        i, depth, start = m.end(), 0, m.end()
+        terms, buf_start = [], start
+        while i < len(sql):
+            ch = sql[i]
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                if depth == 0:
+                    break
+                depth -= 1
+            elif ch == "," and depth == 0:
+                terms.append(sql[buf_start:i])
+                buf_start = i + 1
+            elif depth == 0 and re.match(r"\s(LIMIT|OFFSET|ROWS|RANGE)\b|;", sql[i:i + 8], re.I):
+                break
+            i += 1
+        terms.append(sql[buf_start:i])
+
+        parsed = []
+        for t in terms:
+            t = t.strip()
+            if not t:
+                continue
+            direction = "ASC"
+            dm = re.search(r"\s+(ASC|DESC)\s*$", t, re.I)
+            if dm:
+                direction = dm.group(1).upper()
+                t = t[:dm.start()].strip()
+            parsed.append((t, direction))
+        if parsed:
+            clauses.append(parsed)
+    return clauses
+
+
+def _term_alias(term: str) -> Optional[str]:
+    """The single alias a term references, '' for unqualified, None if it mixes aliases."""
+    refs = set(re.findall(r"\b(\w+)\.\w+", term))
+    if len(refs) > 1:
+        return None
+    return refs.pop() if refs else ""
+
+
+def _strip_alias(term: str) -> str:
+    return re.sub(r"\b\w+\.(\w+)", r"\1", term)
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _is_indexable(term: str, columns: List[str]) -> bool:
+    # every bare identifier in the term (outside function names) must be a real column
+    idents = [w for w in re.findall(r"\b([A-Za-z_]\w*)\b(?!\s*\()", _strip_alias(term))
+              if not re.fullmatch(r"\d+", w)]
+    return bool(idents) and all(w in columns for w in idents)
+
+
+def _index_name(table: str, cols: List[str]) -> str:
+    slug = "_".join(re.sub(r"\W+", "_", c.lower()).strip("_") for c in cols)
+    return f"idx_adv_{table}_{slug}"[:60]
+
+
+# --------------------------------------------------------------------------
+# analysis
+# --------------------------------------------------------------------------
+
+def explain(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, list(params)).fetchall()
+    return [{"id": r[0], "parent": r[1], "detail": r[3]} for r in rows]
+
+
+def _view_bodies(conn: sqlite3.Connection, sql: str) -> str:
+    # file_status et al. are expanded by the planner, so their ORDER BYs matter too
+    bodies = []
+    for name, body in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'"):
+        if body and re.search(rf"\b{re.escape(name)}\b", sql):
+            bodies.append(normalize_sql(body))
+    return " ".join(bodies)
+
+
+def analyze_shape(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> Dict[str, Any]:
+    """
+    Findings + index proposals for one statement.
+
+    - "SCAN x" with no index          -> full table scan
+    - "USE TEMP B-TREE FOR ORDER BY"  -> sort that an index could have delivered
+    """
+    plan = explain(conn, sql, params)
+    full_text = sql + " " + _view_bodies(conn, sql)
+    aliases = _aliases(full_text)
+    order_clauses = _order_by_clauses(full_text)
+
+    findings: List[Dict[str, Any]] = []
+    proposals: Dict[str, Dict[str, Any]] = {}
+
+    def _propose(table: str, cols: List[str], reason: str):
+        if not cols:
+            return
+        name = _index_name(table, cols)
+        proposals.setdefault(name, {
+            "name": name,
+            "table": table,
+            "columns": cols,
+            "sql": f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(cols)})",
+            "reason": reason,
+        })
+
+    for row in plan:
+        detail = row["detail"]
+
+        m = re.match(r"SCAN (\w+)$", detail)
+        if m:
+            alias = m.group(1)
+            table = aliases.get(alias, alias)
+            cols = _table_columns(conn, table)
+            eq = []
+            for em in re.finditer(rf"\b(?:{re.escape(alias)}\.)?(\w+)\s*(?:=|IS)\s*(?:\?|NULL|-?\d+)", full_text):
+                if em.group(1) in cols and em.group(1) not in eq:
+                    eq.append(em.group(1))
+            like = re.findall(rf"LOWER\(\s*{re.escape(alias)}\.(\w+)\s*\)\s+LIKE", full_text, re.I)
+            findings.append({"kind": "full_scan", "table": table, "detail": detail})
+            if eq:
+                _propose(table, eq, f"full scan of {table} filtered on {', '.join(eq)}")
+            if like:
+                findings.append({
+                    "kind": "unindexable_like",
+                    "table": table,
+                    "detail": f"LOWER({', '.join(like)}) LIKE '%...%' cannot use a b-tree index; "
+                              f"a casefolded column or FTS5 table would be needed",
+                })
+            continue
+
+        m = re.match(r"USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)", detail)
+        if m:
+            findings.append({"kind": "temp_btree", "detail": detail, "parent": row["parent"]})
+            if m.group(1) != "ORDER BY":
+                continue
+            # the loop this sort belongs to is the first SCAN/SEARCH sibling
+            sibling = next((r for r in plan if r["parent"] == row["parent"]
+                            and re.match(r"(SCAN|SEARCH) \w+", r["detail"])), None)
+            if not sibling:
+                continue
+            sm = re.match(r"(?:SCAN|SEARCH) (\w+)(?:.*\((.*)\))?", sibling["detail"])
+            alias = sm.group(1)
+            table = aliases.get(alias, alias)
+            cols = _table_columns(conn, table)
+            eq = [c for c in re.findall(r"(\w+)=\?", sm.group(2) or "") if c in cols]
+
+            for clause in order_clauses:
+                terms = []
+                ok = True
+                for term, direction in clause:
+                    a = _term_alias(term)
+                    if a not in (alias, "") or not _is_indexable(term, cols):
+                        ok = False
+                        break
+                    expr = _strip_alias(term)
+                    terms.append(expr if direction == "ASC" else f"{expr} DESC")
+                if not ok:
+                    if any(_term_alias(t) == alias for t, _ in clause):
+                        findings.append({
+                            "kind": "unindexable_sort",
+                            "table": table,
+                            "detail": "ORDER BY " + ", ".join(f"{t} {d}" for t, d in clause)
+                                      + " mixes tables or computed values",
+                        })
+                    continue
+                if terms:
+                    _propose(table, eq + [t for t in terms if t.split()[0] not in eq],
+                             f"sort on {table} by {', '.join(t for t, _ in clause)}")
+            continue
+
+        m = re.match(r"SEARCH (\w+) USING INDEX (\w+) \((.*)\)", detail)
+        if m and sql.lstrip().upper().startswith("SELECT"):
+            # non-covering lookup: a covering index saves the table hop when few columns are read
+            alias, table = m.group(1), aliases.get(m.group(1), m.group(1))
+            cols = _table_columns(conn, table)
+            used = []
+            for c in re.findall(rf"\b{re.escape(alias)}\.(\w+)", full_text):
+                if c in cols and c not in used:
+                    used.append(c)
+            eq = [c for c in re.findall(r"(\w+)[=<>]", m.group(3)) if c in cols]
+            extra = [c for c in used if c not in eq]
+            if eq and 0 < len(extra) <= 3:
+                _propose(table, eq + extra, f"covering index for lookups on {table}({', '.join(eq)})")
+
+    return {"plan": plan, "findings": findings, "proposals": list(proposals.values())}
+
+
+def report(db_path: Optional[str] = None, shapes: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    shapes = shapes if shapes is not None else _all_shapes()
+    conn = sqlite3.connect(db_path or db.DB_PATH)
+    try:
+        existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        out_shapes = []
+        proposals: Dict[str, Dict[str, Any]] = {}
+        for sql, s in sorted(shapes.items(), key=lambda kv: -kv[1]["total_ms"]):
+            try:
+                a = analyze_shape(conn, sql, s.get("params") or [])
+            except sqlite3.Error as e:
+                out_shapes.append({"sql": sql, "count": s["count"], "error": str(e)})
+                continue
+            if not a["findings"] and not a["proposals"]:
+                continue
+            for p in a["proposals"]:
+                if p["name"] in existing:
+                    continue
+                agg = proposals.setdefault(p["name"], dict(p, shapes=0, weight_ms=0.0))
+                agg["shapes"] += 1
+                agg["weight_ms"] = round(agg["weight_ms"] + s["total_ms"], 3)
+            out_shapes.append({
+                "sql": sql,
+                "count": s["count"],
+                "total_ms": round(s["total_ms"], 3),
+                "avg_ms": round(s["total_ms"] / max(1, s["count"]), 3),
+                "plan": [r["detail"] for r in a["plan"]],
+                "findings": a["findings"],
+                "proposals": [p["name"] for p in a["proposals"]],
+            })
+    finally:
+        conn.close()
+
+    # an index whose columns are a leading prefix of another proposal is redundant
+    def _redundant(p):
+        return any(
+            o is not p and o["table"] == p["table"]
+            and len(o["columns"]) > len(p["columns"])
+            and o["columns"][:len(p["columns"])] == p["columns"]
+            for o in proposals.values()
+        )
+    kept = [p for p in proposals.values() if not _redundant(p)]
+
+    return {
+        "shapes_seen": len(shapes),
+        "flagged": out_shapes,
+        "proposals": sorted(kept, key=lambda p: -p["weight_ms"]),
+    }
+
+
+def _time_shape(conn: sqlite3.Connection, sql: str, params: Sequence[Any], runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        conn.execute(sql, list(params)).fetchall()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(samples)
+
+
+def benchmark(index_sql: List[str], db_path: Optional[str] = None,
+              shapes: Optional[Dict[str, Dict[str, Any]]] = None, runs: int = 5) -> Dict[str, Any]:
+    """
+    Copy the database, time every recorded SELECT shape, create `index_sql`,
+    ANALYZE, time again. The live database is never touched.
+    """
+    shapes = shapes if shapes is not None else _all_shapes()
+    selects = {k: v for k, v in shapes.items() if k.upper().startswith(("SELECT", "WITH"))}
+
+    workdir = tempfile.mkdtemp(prefix="fms_advisor_")
+    copy_path = os.path.join(workdir, "copy.db")
+    src = sqlite3.connect(db_path or db.DB_PATH)
+    dst = sqlite3.connect(copy_path)
+    try:
+        src.backup(dst)
+        src.close()
+
+        before = {}
+        plans_before = {}
+        for sql, s in selects.items():
+            try:
+                before[sql] = _time_shape(dst, sql, s.get("params") or [], runs)
+                plans_before[sql] = [r["detail"] for r in explain(dst, sql, s.get("params") or [])]
+            except sqlite3.Error:
+                continue
+
+        created, failed = [], []
+        for stmt in index_sql:
+            t0 = time.perf_counter()
+            try:
+                dst.execute(stmt)
+                created.append({"sql": stmt, "build_ms": round((time.perf_counter() - t0) * 1000.0, 3)})
+            except sqlite3.Error as e:
+                failed.append({"sql": stmt, "error": str(e)})
+        dst.commit()
+        dst.execute("ANALYZE")
+        dst.commit()
+
+        results = []
+        for sql, b in before.items():
+            params = shapes[sql].get("params") or []
+            a = _time_shape(dst, sql, params, runs)
+            plan_after = [r["detail"] for r in explain(dst, sql, params)]
+            results.append({
+                "sql": sql,
+                "before_ms": round(b, 3),
+                "after_ms": round(a, 3),
+                "speedup": round(b / a, 2) if a else None,
+                "plan_changed": plan_after != plans_before[sql],
+                "plan_after": plan_after,
+            })
+        results.sort(key=lambda r: r["after_ms"] - r["before_ms"])
+    finally:
+        dst.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {"indexes": created, "failed": failed, "shapes": results}
+
+
+def apply(index_sql: List[str], db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    out = []
+    conn = sqlite3.connect(db_path or db.DB_PATH)
+    try:
+        for stmt in index_sql:
+            if not re.match(r"\s*CREATE\s+INDEX\s", stmt, re.I):
+                out.append({"sql": stmt, "error": "only CREATE INDEX statements can be applied"})
+                continue
+            t0 = time.perf_counter()
+            try:
+                conn.execute(stmt)
+                conn.commit()
+                out.append({"sql": stmt, "build_ms": round((time.perf_counter() - t0) * 1000.0, 3)})
+            except sqlite3.Error as e:
+                out.append({"sql": stmt, "error": str(e)})
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return out
+
+
+# --------------------------------------------------------------------------
+# admin endpoints
+# --------------------------------------------------------------------------
+
+@router.get("")
+def index_report(user=Depends(require_admin)):
+    return report()
+
+
+@router.post("/snapshot")
+def index_snapshot(user=Depends(require_admin)):
+    return {"shapes_saved": snapshot_shapes()}
+
+
+@router.post("/benchmark")
+def index_benchmark(
+    indexes: Optional[List[str]] = Body(None, embed=True),
+    runs: int = Body(5, embed=True, ge=1, le=50),
+    user=Depends(require_admin),
+):
+    """Try `indexes` (default: the current proposals) on a copy of the database."""
+    if indexes is None:
+        indexes = [p["sql"] for p in report()["proposals"]]
+    if not indexes:
+        raise HTTPException(status_code=400, detail="No indexes to benchmark.")
+    return benchmark(indexes, runs=runs)
+
+
+@router.post("/apply")
+def index_apply(
+    indexes: List[str] = Body(..., embed=True),
+    user=Depends(require_admin),
+):
+    return {"applied": apply(indexes)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Suggest indexes from recorded query shapes.")
+    p.add_argument("command", choices=["report", "benchmark", "apply"])
+    p.add_argument("--db", default=db.DB_PATH)
+    p.add_argument("--shapes", default=SHAPES_PATH)
+    p.add_argument("--runs", type=int, default=5)
+    args = p.parse_args(argv)
+
+    shapes = load_shapes(args.shapes)
+    rep = report(args.db, shapes)
+    if args.command == "report":
+        print(json.dumps(rep, indent=2))
+        return
+    index_sql = [x["sql"] for x in rep["proposals"]]
+    if not index_sql:
+        print("[advisor] nothing to propose")
+        return
+    if args.command == "benchmark":
+        print(json.dumps(benchmark(index_sql, args.db, shapes, args.runs), indent=2))
+    else:
+        print(json.dumps(apply(index_sql, args.db), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,726 @@
+# analytics.py
+"""
+Movement rollups for consumption and dead-stock reporting.
+
+"Units issued per category per week" or "items that haven't moved in 180
+days" are full scans of movements joined to items. Instead, refresh() folds
+new movements into small rollup tables (migration 14) and the endpoints
+read only those:
+
+    movement_rollup_items       (bucket, movement_type, period, item_id)
+    movement_rollup_categories  (bucket, movement_type, category, period)
+        lines     how many movement rows
+        quantity  signed sum, as in movements (out is negative)
+        units     sum of absolute quantities: units issued, received, moved
+    item_last_movement          item_id -> newest movement timestamp
+
+bucket is day, week or month and period is the bucket's first day
+('YYYY-MM-DD'; weeks start on Monday). A movement counts toward the period
+of its own timestamp, so back-dated lines land where they belong, and
+toward the category its item has when the rollup picks it up.
+
+Progress is the `movement_rollups` high-water mark in job_watermarks:
+each refresh step takes movements with id above it (at most
+FMS_ROLLUP_STEP per write transaction), groups them per item and day in
+SQL, folds days into weeks and months in Python, upserts the three tables
+and moves the mark, all in one transaction, so a crash can't count a
+movement twice. The worker refreshes every FMS_ROLLUP_MINUTES (default 5);
+the endpoints read through the replica, so they trail by a minute or so
+on top of that.
+
+Checkout utilisation works the same way off checkout_returns (migration
+15), a queue the checkouts triggers fill with every returned checkout (and
+a sign -1 copy of one that gets corrected). refresh_checkouts() folds the
+queue above the `checkout_rollups` watermark into per-file, per-holder,
+per-system and per-day-and-hour totals (count, holding time, overdue
+returns) and drops what it folded. Only returned checkouts count: holding
+time and overdue aren't known before the return. Checkouts archived before
+migration 15 aren't in the queue; `rebuild-checkouts` starts the rollups
+over from the hot and archive tables.
+
+    python analytics.py refresh
+    python analytics.py refresh-checkouts
+    python analytics.py rebuild-checkouts
+"""
+import argparse
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+import archive
+import db
+import ledger
+import replica
+from auth import require_admin
+from migrations import CHECKOUT_RETURN_COLUMNS
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+WATERMARK = "movement_rollups"
+STEP = int(os.getenv("FMS_ROLLUP_STEP", "200000"))
+INTERVAL_MINUTES = int(os.getenv("FMS_ROLLUP_MINUTES", "5"))
+BUCKETS = ("day", "week", "month")
+CHECKOUT_WATERMARK = "checkout_rollups"
+CHECKOUT_STEP = int(os.getenv("FMS_CHECKOUT_ROLLUP_STEP", "50000"))
+MOVEMENT_TYPES = ("in", "out", "adjust", "transfer")
+
+_NEW_MOVEMENTS_SQL = """
+    SELECT m.item_id, COALESCE(i.category, '') AS category, m.movement_type,
+           substr(m.timestamp, 1, 10) AS day,
+           COUNT(*) AS lines, SUM(m.quantity) AS quantity, SUM(ABS(m.quantity)) AS units,
+           MAX(m.timestamp) AS last_at
+    FROM movements m
+    JOIN items i ON i.id = m.item_id
+    WHERE m.id > ? AND m.id <= ?
+    GROUP BY m.item_id, COALESCE(i.category, ''), m.movement_type, substr(m.timestamp, 1, 10)
+"""
+
+_UPSERT_SQL = """
+    INSERT INTO {table} (bucket, period, {key}, movement_type, lines, quantity, units)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, movement_type, {conflict}) DO UPDATE SET
+      lines = {table}.lines + excluded.lines,
+      quantity = {table}.quantity + excluded.quantity,
+      units = {table}.units + excluded.units
+"""
+
+
+def period_start(day: str, bucket: str) -> str:
+    """First day of the day/week/month bucket that 'YYYY-MM-DD' falls in."""
+    if bucket == "day":
+        return day
+    if bucket == "month":
+        return day[:8] + "01"
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+def _fold(rows) -> Tuple[Dict[tuple, List[int]], Dict[tuple, List[int]], Dict[int, str]]:
+    items: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0, 0])
+    categories: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0, 0])
+    last: Dict[int, str] = {}
+    starts: Dict[Tuple[str, str], str] = {}
+    for r in rows:
+        for bucket in BUCKETS:
+            key = (r["day"], bucket)
+            period = starts.get(key)
+            if period is None:
+                period = starts[key] = period_start(r["day"], bucket)
+            for acc in (items[(bucket, period, r["item_id"], r["movement_type"])],
+                        categories[(bucket, period, r["category"], r["movement_type"])]):
+                acc[0] += r["lines"]
+                acc[1] += r["quantity"]
+                acc[2] += r["units"]
+        if r["last_at"] > last.get(r["item_id"], ""):
+            last[r["item_id"]] = r["last_at"]
+    return items, categories, last
+
+
+def _watermark(conn) -> int:
+    r = conn.execute("SELECT last_id FROM job_watermarks WHERE name = ?", (WATERMARK,)).fetchone()
+    return r["last_id"] if r else 0
+
+
+def _step(conn, step: int) -> Tuple[int, int, int]:
+    """Fold the next `step` movement ids in. Returns (from_id, to_id, grouped rows)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = _watermark(conn)
+        high = conn.execute("SELECT COALESCE(MAX(id), 0) AS m FROM movements").fetchone()["m"]
+        upto = min(high, last_id + step)
+        if upto <= last_id:
+            conn.execute("ROLLBACK")
+            return last_id, last_id, 0
+        rows = conn.execute(_NEW_MOVEMENTS_SQL, (last_id, upto)).fetchall()
+        items, categories, last = _fold(rows)
+        conn.executemany(_UPSERT_SQL.format(table="movement_rollup_items", key="item_id",
+                                            conflict="period, item_id"),
+                         # in primary-key order: the upserts walk the b-tree instead of jumping around
+                         sorted((k + tuple(v) for k, v in items.items()), key=lambda r: (r[0], r[3], r[1], r[2])))
+        conn.executemany(_UPSERT_SQL.format(table="movement_rollup_categories", key="category",
+                                            conflict="category, period"),
+                         [k + tuple(v) for k, v in categories.items()])
+        conn.executemany(
+            """
+            INSERT INTO item_last_movement (item_id, last_movement_at) VALUES (?, ?)
+            ON CONFLICT (item_id) DO UPDATE SET last_movement_at =
+              CASE WHEN excluded.last_movement_at > item_last_movement.last_movement_at
+                   THEN excluded.last_movement_at ELSE item_last_movement.last_movement_at END
+            """,
+            list(last.items()),
+        )
+        conn.execute(
+            """
+            INSERT INTO job_watermarks (name, last_id, updated_at) VALUES (?, ?, datetime('now'))
+            ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+            """,
+            (WATERMARK, upto),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return last_id, upto, len(rows)
+
+
+def refresh(step: int = STEP, max_steps: Optional[int] = None) -> Dict[str, Any]:
+    """Fold every movement above the watermark into the rollups, `step` ids per transaction."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        first = to_id = _watermark(conn)
+        steps = grouped = 0
+        while max_steps is None or steps < max_steps:
+            lo, to_id, n = _step(conn, step)
+            if to_id == lo:
+                break
+            steps += 1
+            grouped += n
+    finally:
+        conn.close()
+    return {"from_movement_id": first, "to_movement_id": to_id, "steps": steps,
+            "grouped_rows": grouped, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def refresh_job():
+    try:
+        summary = refresh()
+        if summary["steps"]:
+            print(f"[analytics] rollups to movement {summary['to_movement_id']} "
+                  f"in {summary['seconds']}s")
+    except Exception as e:
+        print("[analytics] rollup refresh failed:", e)
+
+
+# --------------------------------------------------------------------------
+# checkout rollups
+# --------------------------------------------------------------------------
+
+_CHECKOUT_UPSERT_SQL = """
+    INSERT INTO {table} ({key}, checkouts, hold_seconds, with_due, overdue, overdue_seconds)
+    VALUES ({marks}, ?, ?, ?, ?, ?)
+    ON CONFLICT ({key}) DO UPDATE SET
+      checkouts = {table}.checkouts + excluded.checkouts,
+      hold_seconds = {table}.hold_seconds + excluded.hold_seconds,
+      with_due = {table}.with_due + excluded.with_due,
+      overdue = {table}.overdue + excluded.overdue,
+      overdue_seconds = {table}.overdue_seconds + excluded.overdue_seconds
+"""
+
+# table -> its key columns
+CHECKOUT_ROLLUPS = {
+    "checkout_rollup_files": ("file_id",),
+    "checkout_rollup_holders": ("holder_name",),
+    "checkout_rollup_systems": ("system_number",),
+    "checkout_rollup_hours": ("day", "hour"),
+}
+
+
+def _when(value: Optional[str]) -> Optional[datetime]:
+    """Naive UTC datetime of a stored timestamp, or None if there isn't a readable one."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)   # the usual 'YYYY-MM-DD HH:MM:SS'
+    except ValueError:
+        try:
+            dt = datetime.strptime(ledger.normalize_ts(value), ledger.TS_FORMAT)
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _fold_checkouts(rows) -> Tuple[Dict[str, Dict[tuple, List[int]]], int]:
+    """Per-table totals for queued returns. Rows whose timestamps don't parse are skipped."""
+    out = {table: defaultdict(lambda: [0, 0, 0, 0, 0]) for table in CHECKOUT_ROLLUPS}
+    skipped = 0
+    for r in rows:
+        out_at, back_at = _when(r["checkout_at"]), _when(r["return_at"])
+        if out_at is None or back_at is None:
+            skipped += 1
+            continue
+        due = _when(r["due_at"])
+        late = max(int((back_at - due).total_seconds()), 0) if due else 0
+        sign = r["sign"]
+        stats = (sign, sign * max(int((back_at - out_at).total_seconds()), 0),
+                 sign if due else 0, sign if late else 0, sign * late)
+        for table, key in (("checkout_rollup_files", (r["file_id"],)),
+                           ("checkout_rollup_holders", (r["holder_name"],)),
+                           ("checkout_rollup_systems", (r["system_number"] or "",)),
+                           ("checkout_rollup_hours", (out_at.date().isoformat(), out_at.hour))):
+            acc = out[table][key]
+            for n, v in enumerate(stats):
+                acc[n] += v
+    return out, skipped
+
+
+def _checkout_watermark(conn) -> int:
+    r = conn.execute("SELECT last_id FROM job_watermarks WHERE name = ?", (CHECKOUT_WATERMARK,)).fetchone()
+    return r["last_id"] if r else 0
+
+
+def _set_checkout_watermark(conn, last_id: int) -> None:
+    conn.execute(
+        """
+        INSERT INTO job_watermarks (name, last_id, updated_at) VALUES (?, ?, datetime('now'))
+        ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+        """,
+        (CHECKOUT_WATERMARK, last_id),
+    )
+
+
+def _checkout_step(conn, step: int) -> Tuple[int, int, int, int]:
+    """Fold the next `step` queued returns in. Returns (from_id, to_id, returns, skipped)."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = _checkout_watermark(conn)
+        rows = conn.execute(
+            f"SELECT id, {CHECKOUT_RETURN_COLUMNS} FROM checkout_returns WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, step),
+        ).fetchall()
+        if not rows:
+            conn.execute("ROLLBACK")
+            return last_id, last_id, 0, 0
+        upto = rows[-1]["id"]
+        totals, skipped = _fold_checkouts(rows)
+        for table, key in CHECKOUT_ROLLUPS.items():
+            conn.executemany(
+                _CHECKOUT_UPSERT_SQL.format(table=table, key=", ".join(key), marks=", ".join("?" * len(key))),
+                sorted(k + tuple(v) for k, v in totals[table].items()),
+            )
+        _set_checkout_watermark(conn, upto)
+        # folded returns are done with; the watermark still guards against a replay
+        conn.execute("DELETE FROM checkout_returns WHERE id <= ?", (upto,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return last_id, upto, len(rows), skipped
+
+
+def refresh_checkouts(step: int = CHECKOUT_STEP, max_steps: Optional[int] = None) -> Dict[str, Any]:
+    """Fold every queued return into the checkout rollups, `step` returns per transaction."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        first = to_id = _checkout_watermark(conn)
+        steps = returns = skipped = 0
+        while max_steps is None or steps < max_steps:
+            lo, to_id, n, bad = _checkout_step(conn, step)
+            if to_id == lo:
+                break
+            steps += 1
+            returns += n
+            skipped += bad
+    finally:
+        conn.close()
+    return {"from_return_id": first, "to_return_id": to_id, "steps": steps, "returns": returns,
+            "skipped": skipped, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def rebuild_checkouts() -> Dict[str, Any]:
+    """Empty the checkout rollups and queue every returned checkout, archived ones included, again."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None
+    try:
+        sources = ["checkouts"]
+        if db.is_sqlite():
+            archive.attach(conn)   # ATTACH can't run inside the transaction
+            sources.append(archive.archive_table())
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM checkout_returns")
+            for table in CHECKOUT_ROLLUPS:
+                conn.execute(f"DELETE FROM {table}")
+            _set_checkout_watermark(conn, 0)
+            for source in sources:
+                conn.execute(
+                    f"""
+                    INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+                    SELECT 1, c.id, c.file_id, c.holder_name, f.system_number, c.checkout_at, c.return_at, c.due_at
+                    FROM {source} c
+                    LEFT JOIN files f ON f.id = c.file_id
+                    WHERE c.return_at IS NOT NULL
+                    ORDER BY c.id
+                    """
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    summary = refresh_checkouts()
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def refresh_checkouts_job():
+    try:
+        summary = refresh_checkouts()
+        if summary["steps"]:
+            print(f"[analytics] checkout rollups: {summary['returns']} returns folded "
+                  f"in {summary['seconds']}s")
+    except Exception as e:
+        print("[analytics] checkout rollup refresh failed:", e)
+
+
+# --------------------------------------------------------------------------
+# queries (all answered from the rollups, through the replica)
+# --------------------------------------------------------------------------
+
+def _check(bucket: str, movement_type: str) -> None:
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}.")
+    if movement_type not in MOVEMENT_TYPES:
+        raise ValueError(f"movement_type must be one of {', '.join(MOVEMENT_TYPES)}.")
+
+
+def _range(bucket: str, since: Optional[str], until: Optional[str], periods: int) -> Tuple[str, str]:
+    """Period bounds: explicit dates snapped to their bucket, or the last `periods` buckets."""
+    today = datetime.now(timezone.utc).date().isoformat()
+    hi = period_start((until or today)[:10], bucket)
+    if since:
+        return period_start(since[:10], bucket), hi
+    d = date.fromisoformat(hi)
+    if bucket == "day":
+        lo = d - timedelta(days=periods - 1)
+    elif bucket == "week":
+        lo = d - timedelta(weeks=periods - 1)
+    else:
+        months = d.year * 12 + d.month - 1 - (periods - 1)
+        lo = date(months // 12, months % 12 + 1, 1)
+    return lo.isoformat(), hi
+
+
+def consumption(bucket: str = "week", movement_type: str = "out", category: Optional[str] = None,
+                item_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                periods: int = 12) -> Dict[str, Any]:
+    """Lines / units per period for one item, one category, or everything."""
+    _check(bucket, movement_type)
+    lo, hi = _range(bucket, since, until, periods)
+    if item_id is not None:
+        table, where, params = "movement_rollup_items", "AND item_id = ?", [item_id]
+    elif category is not None:
+        table, where, params = "movement_rollup_categories", "AND category = ?", [category]
+    else:
+        table, where, params = "movement_rollup_categories", "", []
+    rows = replica.read(
+        f"""
+        SELECT period, SUM(lines) AS lines, SUM(units) AS units, SUM(quantity) AS quantity
+        FROM {table}
+        WHERE bucket = ? AND movement_type = ? AND period >= ? AND period <= ? {where}
+        GROUP BY period
+        ORDER BY period
+        """,
+        [bucket, movement_type, lo, hi] + params,
+    )
+    return {"bucket": bucket, "movement_type": movement_type, "from": lo, "to": hi,
+            "series": [dict(r) for r in rows], "as_of_movement_id": _as_of()}
+
+
+def top_movers(bucket: str = "month", movement_type: str = "out", since: Optional[str] = None,
+               until: Optional[str] = None, periods: int = 1, by: str = "units",
+               limit: int = 20, category: Optional[str] = None) -> Dict[str, Any]:
+    """Items with the most units (or lines) of `movement_type` over the periods."""
+    _check(bucket, movement_type)
+    if by not in ("units", "lines"):
+        raise ValueError("by must be units or lines.")
+    lo, hi = _range(bucket, since, until, periods)
+    rows = replica.read(
+        f"""
+        SELECT r.item_id, i.sku, i.name, i.category, i.quantity AS on_hand,
+               SUM(r.lines) AS lines, SUM(r.units) AS units
+        FROM movement_rollup_items r
+        JOIN items i ON i.id = r.item_id
+        WHERE r.bucket = ? AND r.movement_type = ? AND r.period >= ? AND r.period <= ?
+          {"AND i.category = ?" if category else ""}
+        GROUP BY r.item_id, i.sku, i.name, i.category, i.quantity
+        ORDER BY {by} DESC, r.item_id
+        LIMIT ?
+        """,
+        [bucket, movement_type, lo, hi] + ([category] if category else []) + [limit],
+    )
+    return {"bucket": bucket, "movement_type": movement_type, "from": lo, "to": hi, "by": by,
+            "items": [dict(r) for r in rows], "as_of_movement_id": _as_of()}
+
+
+def dead_stock(days: int = 180, limit: int = 100, category: Optional[str] = None) -> Dict[str, Any]:
+    """Items with stock on hand and no movement at all in the last `days` days, stalest first."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    rows = replica.read(
+        f"""
+        SELECT i.id AS item_id, i.sku, i.name, i.category, i.quantity, i.location_id,
+               lm.last_movement_at
+        FROM items i
+        LEFT JOIN item_last_movement lm ON lm.item_id = i.id
+        WHERE i.is_deleted = 0 AND i.quantity > 0
+          AND (lm.last_movement_at IS NULL OR lm.last_movement_at < ?)
+          {"AND i.category = ?" if category else ""}
+        ORDER BY lm.last_movement_at IS NOT NULL, lm.last_movement_at, i.id
+        LIMIT ?
+        """,
+        [cutoff] + ([category] if category else []) + [limit],
+    )
+    return {"days": days, "cutoff": cutoff, "items": [dict(r) for r in rows],
+            "as_of_movement_id": _as_of()}
+
+
+CHECKOUT_SORTS = {
+    "checkouts": "r.checkouts",
+    "avg_hold": "r.hold_seconds * 1.0 / r.checkouts",
+    "overdue": "r.overdue",
+    "overdue_rate": "CASE WHEN r.with_due > 0 THEN r.overdue * 1.0 / r.with_due ELSE 0 END",
+}
+
+
+def _utilisation(row) -> Dict[str, Any]:
+    """A rollup row's totals plus the averages and rates derived from them."""
+    out = dict(row)
+    n, due = out["checkouts"], out["with_due"]
+    out["avg_hold_hours"] = round(out["hold_seconds"] / n / 3600.0, 2) if n else None
+    out["overdue_rate"] = round(out["overdue"] / due, 4) if due else None
+    out["avg_overdue_hours"] = round(out["overdue_seconds"] / out["overdue"] / 3600.0, 2) if out["overdue"] else None
+    return out
+
+
+def _ranked(table: str, key: str, join: str, extra: str, where: List[str], params: List[Any],
+            sort: str, min_checkouts: int, limit: int) -> List[Dict[str, Any]]:
+    if sort not in CHECKOUT_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(CHECKOUT_SORTS)}.")
+    rows = replica.read(
+        f"""
+        SELECT r.{key}{extra}, r.checkouts, r.hold_seconds, r.with_due, r.overdue, r.overdue_seconds
+        FROM {table} r {join}
+        WHERE {" AND ".join(["r.checkouts >= ?"] + where)}
+        ORDER BY {CHECKOUT_SORTS[sort]} DESC, r.{key}
+        LIMIT ?
+        """,
+        [max(min_checkouts, 1)] + params + [limit],
+    )
+    return [_utilisation(r) for r in rows]
+
+
+def checkout_files(sort: str = "checkouts", limit: int = 50, system_number: Optional[str] = None,
+                   file_id: Optional[int] = None, min_checkouts: int = 1) -> Dict[str, Any]:
+    """Files ranked by checkout frequency, average holding time or overdue rate."""
+    where, params = [], []
+    if system_number is not None:
+        where.append("f.system_number = ?")
+        params.append(system_number)
+    if file_id is not None:
+        where.append("r.file_id = ?")
+        params.append(file_id)
+    files = _ranked("checkout_rollup_files", "file_id", "LEFT JOIN files f ON f.id = r.file_id",
+                    ", f.name, f.system_number, f.shelf", where, params, sort, min_checkouts, limit)
+    return {"sort": sort, "files": files, "as_of_return_id": _as_of(CHECKOUT_WATERMARK)}
+
+
+def checkout_holders(sort: str = "checkouts", limit: int = 50, holder_name: Optional[str] = None,
+                     min_checkouts: int = 1) -> Dict[str, Any]:
+    """Holders ranked the same way."""
+    where, params = ([], []) if holder_name is None else (["r.holder_name = ?"], [holder_name])
+    holders = _ranked("checkout_rollup_holders", "holder_name", "", "", where, params,
+                      sort, min_checkouts, limit)
+    return {"sort": sort, "holders": holders, "as_of_return_id": _as_of(CHECKOUT_WATERMARK)}
+
+
+def checkout_systems(sort: str = "checkouts") -> Dict[str, Any]:
+    systems = _ranked("checkout_rollup_systems", "system_number", "", "", [], [], sort, 1, 100000)
+    return {"sort": sort, "systems": systems, "as_of_return_id": _as_of(CHECKOUT_WATERMARK)}
+
+
+def _day_range(since: Optional[str], until: Optional[str], days: int) -> Tuple[str, str]:
+    hi = date.fromisoformat((until or datetime.now(timezone.utc).date().isoformat())[:10])
+    lo = date.fromisoformat(since[:10]) if since else hi - timedelta(days=days - 1)
+    return lo.isoformat(), hi.isoformat()
+
+
+def checkout_daily(since: Optional[str] = None, until: Optional[str] = None, days: int = 30) -> Dict[str, Any]:
+    """Returned checkouts per day they started."""
+    lo, hi = _day_range(since, until, days)
+    rows = replica.read(
+        """
+        SELECT day, SUM(checkouts) AS checkouts, SUM(hold_seconds) AS hold_seconds,
+               SUM(with_due) AS with_due, SUM(overdue) AS overdue, SUM(overdue_seconds) AS overdue_seconds
+        FROM checkout_rollup_hours
+        WHERE day >= ? AND day <= ?
+        GROUP BY day
+        ORDER BY day
+        """,
+        (lo, hi),
+    )
+    return {"from": lo, "to": hi, "series": [_utilisation(r) for r in rows],
+            "as_of_return_id": _as_of(CHECKOUT_WATERMARK)}
+
+
+def checkout_hours(since: Optional[str] = None, until: Optional[str] = None, days: int = 90) -> Dict[str, Any]:
+    """Checkouts per hour of day (UTC) over the range, all 24 hours, plus the busiest ones."""
+    lo, hi = _day_range(since, until, days)
+    rows = replica.read(
+        """
+        SELECT hour, SUM(checkouts) AS checkouts, SUM(hold_seconds) AS hold_seconds,
+               SUM(with_due) AS with_due, SUM(overdue) AS overdue, SUM(overdue_seconds) AS overdue_seconds
+        FROM checkout_rollup_hours
+        WHERE day >= ? AND day <= ?
+        GROUP BY hour
+        """,
+        (lo, hi),
+    )
+    by_hour = {r["hour"]: _utilisation(r) for r in rows}
+    hours = [by_hour.get(h) or _utilisation({"hour": h, "checkouts": 0, "hold_seconds": 0, "with_due": 0,
+                                             "overdue": 0, "overdue_seconds": 0})
+             for h in range(24)]
+    busiest = sorted((h for h in hours if h["checkouts"]), key=lambda h: (-h["checkouts"], h["hour"]))[:3]
+    return {"from": lo, "to": hi, "hours": hours, "busiest": [h["hour"] for h in busiest],
+            "as_of_return_id": _as_of(CHECKOUT_WATERMARK)}
+
+
+def _as_of(name: str = WATERMARK) -> int:
+    rows = replica.read("SELECT last_id FROM job_watermarks WHERE name = ?", (name,))
+    return rows[0]["last_id"] if rows else 0
+
+
+@router.get("/consumption")
+def get_consumption(
+    bucket: str = "week",
+    movement_type: str = "out",
+    category: Optional[str] = None,
+    item_id: Optional[int] = None,
+    since: Optional[str] = Query(None, description="YYYY-MM-DD; default: the last `periods` buckets"),
+    until: Optional[str] = None,
+    periods: int = Query(12, ge=1, le=1000),
+):
+    try:
+        return consumption(bucket, movement_type, category, item_id, since, until, periods)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/top_movers")
+def get_top_movers(
+    bucket: str = "month",
+    movement_type: str = "out",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    periods: int = Query(1, ge=1, le=1000),
+    by: str = "units",
+    limit: int = Query(20, ge=1, le=500),
+    category: Optional[str] = None,
+):
+    try:
+        return top_movers(bucket, movement_type, since, until, periods, by, limit, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/dead_stock")
+def get_dead_stock(
+    days: int = Query(180, ge=1),
+    limit: int = Query(100, ge=1, le=1000),
+    category: Optional[str] = None,
+):
+    return dead_stock(days, limit, category)
+
+
+@router.post("/refresh")
+def post_refresh(user=Depends(require_admin)):
+    return refresh()
+
+
+@router.get("/checkouts/files")
+def get_checkout_files(
+    sort: str = "checkouts",
+    limit: int = Query(50, ge=1, le=1000),
+    system_number: Optional[str] = None,
+    file_id: Optional[int] = None,
+    min_checkouts: int = Query(1, ge=1),
+    user=Depends(require_admin),
+):
+    try:
+        return checkout_files(sort, limit, system_number, file_id, min_checkouts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/checkouts/holders")
+def get_checkout_holders(
+    sort: str = "checkouts",
+    limit: int = Query(50, ge=1, le=1000),
+    holder_name: Optional[str] = None,
+    min_checkouts: int = Query(1, ge=1),
+    user=Depends(require_admin),
+):
+    try:
+        return checkout_holders(sort, limit, holder_name, min_checkouts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/checkouts/systems")
+def get_checkout_systems(sort: str = "checkouts", user=Depends(require_admin)):
+    try:
+        return checkout_systems(sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/checkouts/daily")
+def get_checkout_daily(
+    since: Optional[str] = Query(None, description="YYYY-MM-DD; default: the last `days` days"),
+    until: Optional[str] = None,
+    days: int = Query(30, ge=1, le=3660),
+    user=Depends(require_admin),
+):
+    try:
+        return checkout_daily(since, until, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/checkouts/hours")
+def get_checkout_hours(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    days: int = Query(90, ge=1, le=3660),
+    user=Depends(require_admin),
+):
+    try:
+        return checkout_hours(since, until, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/checkouts/refresh")
+def post_checkout_refresh(user=Depends(require_admin)):
+    return refresh_checkouts()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Movement rollups for analytics.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("refresh")
+    r.add_argument("--step", type=int, default=STEP)
+    c = sub.add_parser("refresh-checkouts")
+    c.add_argument("--step", type=int, default=CHECKOUT_STEP)
+    sub.add_parser("rebuild-checkouts", help="start the checkout rollups over, archive included")
+    args = p.parse_args(argv)
+    if args.cmd == "refresh":
+        print(refresh(args.step))
+    elif args.cmd == "refresh-checkouts":
+        print(refresh_checkouts(args.step))
+    else:
+        print(rebuild_checkouts())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# archive.py
+"""
+Hot/cold split for checkout history.
+
+Returned checkouts older than ARCHIVE_AFTER_DAYS are moved from `checkouts`
+into `checkouts_archive`, which lives in its own database file (ATTACHed as
+`arch`) unless FMS_ARCHIVE_PATH is set to an empty string, in which case it
+sits next to `checkouts` in the main database.
+
+The move runs in small batches with a pause in between, so desk traffic
+never waits long for the write lock. Open checkouts are never archived.
+SQLite doesn't commit a transaction over two WAL files atomically, so each
+batch is two short BEGIN IMMEDIATE transactions, each writing one file:
+the rows are copied into the archive and committed, then deleted from
+`checkouts` only where the archive holds an identical copy. A crash between
+the two leaves the rows in both places, and the next run copies them again
+(INSERT OR REPLACE) and deletes them.
+
+Readers only touch the archive when they have to: file_details falls back to
+it when the hot table has fewer than 10 rows for a file, and the checkouts
+export unions it in when it has rows at all.
+
+    python archive.py                 # run with the configured policy
+    python archive.py --days 180 --batch 1000
+"""
+import argparse
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import APIRouter, Body, Depends
+
+import db
+import housekeeping
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/archive", tags=["admin"])
+
+# next to the main database unless FMS_ARCHIVE_PATH says otherwise
+ARCHIVE_PATH = os.getenv("FMS_ARCHIVE_PATH", os.path.join(os.path.dirname(db.DB_PATH), "Archive.db"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("FMS_ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH = int(os.getenv("FMS_ARCHIVE_BATCH", "500"))
+ARCHIVE_PAUSE_SECONDS = 0.05
+
+# "is there anything in the archive?" is asked on hot paths, so cache it briefly
+_NONEMPTY_TTL = 60.0
+_nonempty_cache: Dict[str, Any] = {"value": None, "at": 0.0}
+
+
+def _schema() -> str:
+    return "arch" if ARCHIVE_PATH else "main"
+
+
+def archive_table() -> str:
+    """Qualified name to use in SQL run through read_with_archive()."""
+    return f"{_schema()}.checkouts_archive"
+
+
+def attach(conn: sqlite3.Connection) -> str:
+    """Attach the archive file to `conn` (if configured) and make sure the table exists."""
+    schema = _schema()
+    if schema == "arch":
+        attached = {r[1] for r in conn.execute("PRAGMA database_list")}
+        if "arch" not in attached:
+            conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_PATH,))
+            conn.execute("PRAGMA arch.journal_mode = WAL")
+
+    hot_cols = [r for r in conn.execute("PRAGMA main.table_info(checkouts)")]
+    have = {r[1] for r in conn.execute(f"PRAGMA {schema}.table_info(checkouts_archive)")}
+    if not have:
+        cols = ",\n  ".join(
+            f"{r[1]} {r[2] or 'TEXT'}" + (" PRIMARY KEY" if r[1] == "id" else "")
+            for r in hot_cols
+        )
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.checkouts_archive (
+              {cols},
+              archived_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+            );
+            CREATE INDEX IF NOT EXISTS {schema}.idx_checkouts_archive_file_checkout_at
+              ON checkouts_archive(file_id, checkout_at DESC);
+            CREATE INDEX IF NOT EXISTS {schema}.idx_checkouts_archive_checkout_at
+              ON checkouts_archive(checkout_at);
+        """)
+    else:
+        # checkouts grew a column since the archive was created
+        for r in hot_cols:
+            if r[1] not in have:
+                conn.execute(f"ALTER TABLE {schema}.checkouts_archive ADD COLUMN {r[1]} {r[2] or 'TEXT'}")
+    return schema
+
+
+def _connect_with_archive() -> sqlite3.Connection:
+    conn = db._connect()
+    attach(conn)
+    return conn
+
+
+def archive_has_rows(refresh: bool = False) -> bool:
+    if not db.is_sqlite():
+        return False   # no hot/cold split on Postgres
+    now = time.monotonic()
+    if not refresh and _nonempty_cache["value"] is not None and now - _nonempty_cache["at"] < _NONEMPTY_TTL:
+        return _nonempty_cache["value"]
+
+    if ARCHIVE_PATH and not os.path.exists(ARCHIVE_PATH):
+        value = False
+    else:
+        conn = _connect_with_archive()
+        try:
+            value = conn.execute(f"SELECT 1 FROM {archive_table()} LIMIT 1").fetchone() is not None
+        finally:
+            conn.close()
+    _nonempty_cache.update(value=value, at=now)
+    return value
+
+
+def read_with_archive(sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+    """db_read, but on a connection where `arch.checkouts_archive` (or main's) is visible."""
+    conn = _connect_with_archive()
+    try:
+        t0 = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        if db._statement_hooks:
+            db._notify(sql, params, time.perf_counter() - t0)
+        return rows
+    finally:
+        conn.close()
+
+
+def archived_history(file_id: int, limit: int) -> List[Dict[str, Any]]:
+    if limit <= 0 or not archive_has_rows():
+        return []
+    rows = read_with_archive(
+        f"""
+        SELECT holder_name, checkout_at, return_at, operator_name, note
+        FROM {archive_table()}
+        WHERE file_id = ?
+        ORDER BY checkout_at DESC
+        LIMIT ?
+        """,
+        (file_id, limit),
+    )
+    return [dict(r) for r in rows]
+
+
+def archive_batch(conn: sqlite3.Connection, cutoff_days: int, batch_size: int) -> int:
+    schema = attach(conn)
+    names = [r[1] for r in conn.execute("PRAGMA main.table_info(checkouts)")]
+    cols = ", ".join(names)
+    pick = """
+        SELECT id FROM main.checkouts
+        WHERE return_at IS NOT NULL
+          AND return_at < datetime('now', ?)
+        ORDER BY id
+        LIMIT ?
+    """
+    window = (f"-{int(cutoff_days)} days", batch_size)
+
+    # 1. copy, committed in the archive alone
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO {schema}.checkouts_archive ({cols})
+            SELECT {cols} FROM main.checkouts WHERE id IN ({pick})
+            """,
+            window,
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    # 2. delete, committed in main alone: only rows whose committed copy matches them
+    same = " AND ".join(f"a.{c} IS checkouts.{c}" for c in names)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        moved = conn.execute(
+            f"""
+            DELETE FROM main.checkouts
+            WHERE id IN ({pick})
+              AND EXISTS (SELECT 1 FROM {schema}.checkouts_archive a WHERE a.id = checkouts.id AND {same})
+            """,
+            window,
+        ).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def run_archiver(days: Optional[int] = None, batch_size: Optional[int] = None,
+                 max_batches: Optional[int] = None) -> Dict[str, Any]:
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or ARCHIVE_BATCH
+    if not db.is_sqlite():
+        return {"moved": 0, "skipped": "checkout archiving is SQLite-only"}
+
+    started = time.perf_counter()
+    moved = batches = 0
+    conn = db._connect()
+    conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves
+    try:
+        while max_batches is None or batches < max_batches:
+            n = archive_batch(conn, days, batch_size)
+            batches += 1
+            moved += n
+            if n < batch_size:
+                break
+            time.sleep(ARCHIVE_PAUSE_SECONDS)
+    finally:
+        conn.close()
+
+    archive_has_rows(refresh=True)
+    if moved:
+        # the deleted rows leave free pages behind in the main file
+        housekeeping.request("vacuum", f"archived {moved} checkouts")
+    return {
+        "moved": moved,
+        "batches": batches,
+        "older_than_days": days,
+        "batch_size": batch_size,
+        "archive": ARCHIVE_PATH or "main",
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def archive_status() -> Dict[str, Any]:
+    conn = _connect_with_archive()
+    try:
+        hot = conn.execute("SELECT COUNT(*) FROM main.checkouts").fetchone()[0]
+        cold = conn.execute(f"SELECT COUNT(*) FROM {archive_table()}").fetchone()[0]
+        eligible = conn.execute(
+            "SELECT COUNT(*) FROM main.checkouts WHERE return_at IS NOT NULL AND return_at < datetime('now', ?)",
+            (f"-{ARCHIVE_AFTER_DAYS} days",),
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "hot_rows": hot,
+        "archived_rows": cold,
+        "eligible_now": eligible,
+        "older_than_days": ARCHIVE_AFTER_DAYS,
+        "batch_size": ARCHIVE_BATCH,
+        "archive": ARCHIVE_PATH or "main",
+    }
+
+
+@router.get("")
+def get_archive_status(user=Depends(require_admin)):
+    return archive_status()
+
+
+@router.post("/run")
+def run_archive(
+    days: Optional[int] = Body(None, embed=True, ge=0),
+    batch_size: Optional[int] = Body(None, embed=True, ge=1, le=50000),
+    user=Depends(require_admin),
+):
+    return run_archiver(days=days, batch_size=batch_size)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Move old returned checkouts into checkouts_archive.")
+    p.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    p.add_argument("--batch", type=int, default=ARCHIVE_BATCH)
+    p.add_argument("--max-batches", type=int, default=None)
+    args = p.parse_args(argv)
+    print(run_archiver(args.days, args.batch, args.max_batches))
+
+
+if __name__ == "__main__":
+    main()
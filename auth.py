@@ -102,6 +102,20 @@ def require_admin(user: Optional[dict] = Depends(get_current_user)):
             detail="admin role required."
         )
 
+def require_operator(user: Optional[dict] = Depends(get_current_user)) -> dict:
+    # any signed-in account that can work the floor: admin or user
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated."
+        )
+    if user.get("role") not in ("admin", "user"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="operator or admin role required."
+        )
+    return user
+
 
 @router.post("/api/session/login")
 def login(
@@ -181,7 +195,7 @@ def create_user(payload: NewUser = Body(...)):
 
     pw_hash = bcrypt.hashpw(pw.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
     print(f"Creating user: {email_norm} with role: {role} and password hash: {pw_hash}")
-    from db import get_conn
+    from db import get_conn, IntegrityError
     try:
         with closing(get_conn()) as conn, conn:
             # Optional preflight to return a clearer message before hitting UNIQUE
@@ -194,6 +208,6 @@ def create_user(payload: NewUser = Body(...)):
                 VALUES (?, ?, ?)
             """, (email_norm, pw_hash, role))
         return {"ok": True}
-    except sqlite3.IntegrityError:
+    except IntegrityError:
         # Fallback if preflight missed something (e.g., NOCASE index)
         raise HTTPException(status_code=409, detail=f"email already exists: {email_norm}")
\ No newline at end of file
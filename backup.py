@@ -0,0 +1,313 @@
+# backup.py
+"""
+Binary backup / restore of the whole database.
+
+A backup is a page-level copy taken with the sqlite3 online backup API (one
+consistent snapshot, every table: files, checkouts, items, movements,
+locations, users, settings, ...), gzipped. Restore checks the uploaded copy
+(quick_check, and the tables that kind of file must have: files/checkouts,
+or checkouts_archive) and then writes it over the live database with the
+backup API again, which happens under a single write lock: other connections see
+either the old database or the new one, never a mix, and nobody has to be
+kicked off the file.
+
+    GET  /api/admin/backup              -> streams fms-<timestamp>.db.gz
+    GET  /api/admin/backup?db=archive   -> same for the checkout archive file
+    GET  /api/admin/backup/files        -> rotated backups in FMS_BACKUP_DIR
+    POST /api/admin/backup/rotate       -> take one into FMS_BACKUP_DIR now
+    POST /api/admin/backup/restore      -> upload a .db or .db.gz
+
+    python backup.py create out.db.gz
+    python backup.py rotate
+    python backup.py restore fms-20250101T000000Z.db.gz
+
+The notifier worker runs rotate() nightly and keeps FMS_BACKUP_KEEP copies.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+import archive
+import db
+import migrations
+import replica
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/backup", tags=["admin"])
+
+BACKUP_DIR = os.getenv("FMS_BACKUP_DIR", os.path.join(os.path.dirname(db.DB_PATH), "backups"))
+BACKUP_KEEP = int(os.getenv("FMS_BACKUP_KEEP", "14"))
+GZIP_LEVEL = int(os.getenv("FMS_BACKUP_GZIP_LEVEL", "3"))   # level 3 is ~4x faster than 9 for a few % size
+CHUNK = 1024 * 1024
+BUSY_TIMEOUT_MS = 10000
+GZIP_MAGIC = b"\x1f\x8b"
+# what any archive file has: checkouts as first archived, plus archived_at. Columns
+# checkouts gained since are added on attach (archive.attach), so they may be absent.
+ARCHIVE_COLUMNS = {"id", "file_id", "holder_name", "checkout_at", "return_at", "operator_name", "note",
+                   "archived_at"}
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _source_path(which: str) -> str:
+    if not db.is_sqlite():
+        raise ValueError("Binary backups are SQLite-only; use pg_dump for Postgres.")
+    if which not in ("main", "archive"):
+        raise ValueError("db must be main or archive.")
+    if which == "archive":
+        if not archive.ARCHIVE_PATH:
+            raise ValueError("The checkout archive lives in the main database.")
+        return archive.ARCHIVE_PATH
+    return db.DB_PATH
+
+
+def snapshot(dest: str, which: str = "main") -> Dict[str, Any]:
+    """Consistent uncompressed copy of the database at `dest`."""
+    started = time.perf_counter()
+    src = sqlite3.connect(_source_path(which))
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+        # a standalone file shouldn't need a -wal next to it
+        dst.execute("PRAGMA journal_mode = DELETE")
+        pages = dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return {"pages": pages, "bytes": os.path.getsize(dest),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _gzip_chunks(path: str) -> Iterator[bytes]:
+    comp = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)   # wbits=31 -> gzip container
+    with open(path, "rb") as fh:
+        while True:
+            block = fh.read(CHUNK)
+            if not block:
+                break
+            out = comp.compress(block)
+            if out:
+                yield out
+    yield comp.flush()
+
+
+def create(dest: str, which: str = "main") -> Dict[str, Any]:
+    """Write a gzipped snapshot to `dest` (via a temp file, so `dest` is never half-written)."""
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    fd, raw = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(dest)))
+    os.close(fd)
+    try:
+        info = snapshot(raw, which)
+        with open(dest + ".tmp", "wb") as out:
+            for chunk in _gzip_chunks(raw):
+                out.write(chunk)
+        os.replace(dest + ".tmp", dest)
+    finally:
+        if os.path.exists(raw):
+            os.remove(raw)
+    info.update(path=dest, compressed_bytes=os.path.getsize(dest),
+                seconds=round(time.perf_counter() - started, 3))
+    return info
+
+
+def list_backups() -> List[Dict[str, Any]]:
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    out = []
+    for name in os.listdir(BACKUP_DIR):
+        if name.startswith("fms-") and name.endswith(".db.gz"):
+            path = os.path.join(BACKUP_DIR, name)
+            out.append({"name": name, "bytes": os.path.getsize(path),
+                        "created_at": datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+                        .isoformat(timespec="seconds")})
+    out.sort(key=lambda b: b["name"], reverse=True)
+    return out
+
+
+def rotate(keep: Optional[int] = None) -> Dict[str, Any]:
+    """Take a backup into BACKUP_DIR and drop all but the newest `keep` of each kind."""
+    keep = BACKUP_KEEP if keep is None else keep
+    stamp = _timestamp()
+    made = [create(os.path.join(BACKUP_DIR, f"fms-{stamp}.db.gz"))]
+    if archive.ARCHIVE_PATH and os.path.exists(archive.ARCHIVE_PATH):
+        made.append(create(os.path.join(BACKUP_DIR, f"fms-{stamp}.archive.db.gz"), "archive"))
+
+    removed = []
+    for archived in (False, True):
+        names = [b["name"] for b in list_backups()
+                 if b["name"].endswith(".archive.db.gz") == archived]   # newest first
+        for name in names[keep:]:
+            os.remove(os.path.join(BACKUP_DIR, name))
+            removed.append(name)
+    return {"created": made, "removed": removed}
+
+
+def _unpack(fileobj: BinaryIO, dest: str) -> None:
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    # mode: an upload's spooled file is "w+b", which GzipFile would open for writing
+    src = gzip.GzipFile(fileobj=fileobj, mode="rb") if head == GZIP_MAGIC else fileobj
+    with open(dest, "wb") as out:
+        try:
+            shutil.copyfileobj(src, out, CHUNK)
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"Not a readable gzip file: {e}")
+
+
+def _check(path: str, which: str = "main") -> None:
+    try:
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        try:
+            result = [r[0] for r in conn.execute("PRAGMA quick_check(5)")]
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            archived = {r[1] for r in conn.execute("PRAGMA table_info(checkouts_archive)")}
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Not an SQLite database: {e}")
+    if result != ["ok"]:
+        raise ValueError(f"Backup failed quick_check: {result}")
+    if which == "archive":
+        if not archived:
+            raise ValueError("Backup is missing the checkouts_archive table.")
+        missing = sorted(ARCHIVE_COLUMNS - archived)
+        if missing:
+            raise ValueError(f"Backup's checkouts_archive is missing columns: {', '.join(missing)}.")
+    elif "files" not in tables or "checkouts" not in tables:
+        raise ValueError("Backup is missing the files/checkouts tables.")
+
+
+def restore(fileobj: BinaryIO, which: str = "main") -> Dict[str, Any]:
+    """Replace the live database with the contents of `fileobj` (.db or .db.gz)."""
+    started = time.perf_counter()
+    target = _source_path(which)
+    fd, raw = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(target)) or ".")
+    os.close(fd)
+    try:
+        _unpack(fileobj, raw)
+        _check(raw, which)
+
+        src = sqlite3.connect(raw)
+        dst = sqlite3.connect(target)
+        dst.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        try:
+            src_page = src.execute("PRAGMA page_size").fetchone()[0]
+            dst_page = dst.execute("PRAGMA page_size").fetchone()[0]
+            if src_page != dst_page and dst.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                raise ValueError(
+                    f"Backup page size {src_page} differs from the live database's {dst_page}; "
+                    "a WAL database can't change page size in place."
+                )
+            # one write transaction on the live file: readers see old or new, never half
+            src.backup(dst)
+            dst.execute("PRAGMA journal_mode = WAL")
+            pages = dst.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        if os.path.exists(raw):
+            os.remove(raw)
+
+    if which == "main":
+        # an older backup comes back at its own schema version
+        migrations.migrate()
+        # a backup of this same file has the token of when it was taken; locations
+        # added since are gone, so every worker must drop its cache
+        db.db_write("UPDATE cache_tokens SET token = random() WHERE name = 'locations'")
+    archive.archive_has_rows(refresh=True)
+    db.invalidate_location_cache()
+    if replica.enabled():
+        replica.refresh_in_background()
+    return {"restored": which, "pages": pages, "seconds": round(time.perf_counter() - started, 3)}
+
+
+@router.get("")
+def download_backup(which: str = Query("main", alias="db"),
+                    user=Depends(require_admin)):
+    try:
+        src = _source_path(which)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fd, raw = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(src)) or ".")
+    os.close(fd)
+    try:
+        snapshot(raw, which)
+    except Exception:
+        os.remove(raw)
+        raise
+    name = f"fms-{_timestamp()}{'.archive' if which == 'archive' else ''}.db.gz"
+    return StreamingResponse(
+        _gzip_chunks(raw),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+        background=BackgroundTask(os.remove, raw),
+    )
+
+
+@router.get("/files")
+def get_backup_files(user=Depends(require_admin)):
+    return list_backups()
+
+
+@router.post("/rotate")
+def post_rotate(user=Depends(require_admin)):
+    try:
+        return rotate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/restore")
+def post_restore(
+    file: UploadFile = File(...),
+    which: str = Query("main", alias="db"),
+    user=Depends(require_admin),
+):
+    try:
+        return restore(file.file, which)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except sqlite3.DatabaseError as e:
+        # passed _check but the copy itself failed (e.g. damage beyond what quick_check reads)
+        raise HTTPException(status_code=400, detail=f"Backup could not be restored: {e}")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Binary backup / restore of the FMS database.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create")
+    c.add_argument("out")
+    c.add_argument("--db", choices=("main", "archive"), default="main")
+    r = sub.add_parser("rotate")
+    r.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    s = sub.add_parser("restore")
+    s.add_argument("path")
+    s.add_argument("--db", choices=("main", "archive"), default="main")
+    args = p.parse_args(argv)
+
+    if args.cmd == "create":
+        print(create(args.out, args.db))
+    elif args.cmd == "rotate":
+        print(rotate(args.keep))
+    else:
+        with open(args.path, "rb") as fh:
+            print(restore(fh, args.db))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""
+Benchmark suite for the FMS API.
+
+generate.py builds a synthetic, deterministic catalog database.
+run.py times the real endpoints in-process through the ASGI app and can
+compare a run against a stored baseline.
+
+    python -m benchmarks.generate --out /tmp/fms_bench.db --files 20000 --checkouts 80000
+    python -m benchmarks.run --db /tmp/fms_bench.db --out bench_results.json
+    python -m benchmarks.run --db /tmp/fms_bench.db --compare benchmarks/baseline.json
+"""
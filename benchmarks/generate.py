@@ -0,0 +1,343 @@
+"""
+Deterministic synthetic catalog generator.
+
+Builds a fresh database with the real schema (migrations.migrate) and
+fills it with N files, M checkouts, K items, movements and locations.
+Popularity is Zipf-like: `skew` = 0 spreads everything evenly, higher values
+pile checkouts onto a few hot files and items onto a few busy shelves.
+
+Same arguments + same seed -> the same values in every column the generator
+writes, the admin's password hash included. Columns the schema stamps by
+itself (schema_version timings, the updated_at that movement triggers set,
+settings timestamps, cache tokens) differ run to run, and so do the file's
+bytes.
+
+    python -m benchmarks.generate --out /tmp/fms_bench.db --files 20000 --checkouts 80000 --skew 1.1
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+BENCH_ADMIN_EMAIL = "bench-admin@fms.local"
+BENCH_ADMIN_PASSWORD = "bench-password"
+# bcrypt of BENCH_ADMIN_PASSWORD at 4 rounds with a fixed salt; a fresh
+# gensalt() would give every run a different users row
+BENCH_ADMIN_PASSWORD_HASH = "$2b$04$FmsBenchFixedSaltOnly.bWLuzXzWn171YDKm8m1hbasiH4FH/V6"
+
+# fixed epoch so timestamps don't depend on when the generator runs; files are
+# created over the first year and every checkout ends before HORIZON
+EPOCH = datetime(2024, 1, 1, 8, 0, 0)
+HORIZON = EPOCH + timedelta(days=400)
+
+WORDS = [
+    "invoice", "contract", "payroll", "audit", "ledger", "memo", "report",
+    "tender", "permit", "blueprint", "minutes", "policy", "claim", "deed",
+    "survey", "license", "receipt", "budget", "roster", "manifest",
+]
+TAGS = [None, "finance", "legal", "hr", "ops", "archive", "urgent", "board"]
+HOLDERS = [
+    "Rushil", "Admin", "Priya", "Tomas", "Amara", "Jun", "Leila", "Marco",
+    "Sofia", "Kenji", "Noah", "Zara", "Ivan", "Mei", "Omar", "Elena",
+]
+CATEGORIES = ["stationery", "hardware", "archive-box", "binder", "media", "tools"]
+
+BENCH_SETTINGS_SQL = "UPDATE settings SET admin_email = 'bench-admin@fms.local' WHERE id = 1"
+
+
+def _ts(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _zipf_cum_weights(n: int, skew: float) -> List[float]:
+    # rank r gets weight 1 / (r+1)^skew; cumulative so random.choices is O(log n)
+    total = 0.0
+    cum = []
+    for r in range(n):
+        total += 1.0 / ((r + 1) ** skew) if skew > 0 else 1.0
+        cum.append(total)
+    return cum
+
+
+def _pick(rng: random.Random, cum: List[float]) -> int:
+    return bisect.bisect_left(cum, rng.random() * cum[-1])
+
+
+def _shelf_label(rng: random.Random) -> str:
+    # mix of the formats seen in production: "2b", "10a", "C03"
+    if rng.random() < 0.5:
+        return f"{rng.randint(1, 12)}{rng.choice('abcdef')}"
+    return f"{rng.choice('ABCDEF')}{rng.randint(1, 9):02d}"
+
+
+def _create_schema(path: str) -> None:
+    os.environ["FMS_DB_PATH"] = path
+
+    import migrations
+    migrations.migrate(path)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(BENCH_SETTINGS_SQL)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_catalog(
+    path: str,
+    files: int = 5000,
+    checkouts: int = 20000,
+    items: int = 5000,
+    movements: int = 20000,
+    locations: int = 400,
+    skew: float = 1.0,
+    seed: int = 1234,
+    deleted_ratio: float = 0.05,
+    open_ratio: float = 0.10,
+) -> Dict[str, Any]:
+    """
+    Create `path` from scratch and fill it. Returns the parameters and row
+    counts so run.py can stamp them into the results file.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    started = time.perf_counter()
+    _create_schema(path)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    try:
+        with conn:
+            # 1) locations
+            seen = set()
+            loc_rows = []
+            while len(loc_rows) < locations:
+                key = (f"{rng.choice('ABCDEFGH')}{rng.randint(1, 40):02d}", _shelf_label(rng))
+                if key in seen:
+                    continue
+                seen.add(key)
+                loc_rows.append(key)
+            conn.executemany(
+                "INSERT INTO locations (id, system_number, shelf) VALUES (?, ?, ?)",
+                [(i + 1, s, sh) for i, (s, sh) in enumerate(loc_rows)],
+            )
+            loc_cum = _zipf_cum_weights(len(loc_rows), skew)
+
+            # 2) files
+            file_rows = []
+            live_ids = []
+            for fid in range(1, files + 1):
+                system_number, shelf = loc_rows[_pick(rng, loc_cum)]
+                created = EPOCH + timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+                updated = created + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+                is_deleted = 1 if rng.random() < deleted_ratio else 0
+                file_rows.append((
+                    fid,
+                    f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {fid}",
+                    rng.choice([None, "A4", "A3", "Box"]),
+                    rng.choice([None, "Paper", "Binder", "Folder"]),
+                    rng.choice(TAGS),
+                    None if rng.random() < 0.7 else f"note {rng.randint(1, 999)}",
+                    system_number,
+                    shelf,
+                    rng.randint(1, 4),
+                    "admin",
+                    _ts(created),
+                    _ts(updated),
+                    is_deleted,
+                    _ts(updated) if is_deleted else None,
+                ))
+                if not is_deleted:
+                    live_ids.append(fid)
+            conn.executemany(
+                """
+                INSERT INTO files (
+                    id, name, size_label, type_label, tag, note, system_number, shelf,
+                    clearance_level, added_by, created_at, updated_at, is_deleted, deleted_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                file_rows,
+            )
+
+            # 3) checkouts: hot files get most of the traffic, one open row max per file
+            per_file: Dict[int, int] = {}
+            if live_ids:
+                file_cum = _zipf_cum_weights(len(live_ids), skew)
+                for _ in range(checkouts):
+                    fid = live_ids[_pick(rng, file_cum)]
+                    per_file[fid] = per_file.get(fid, 0) + 1
+
+            # each file's chain starts after the file was created and is spread
+            # over the time left until HORIZON: a loan takes at most 2/3 of a
+            # file's share of that time and the gap after it the rest
+            created_at = {r[0]: datetime.strptime(r[10], "%Y-%m-%d %H:%M:%S") for r in file_rows}
+            co_rows = []
+            for fid in sorted(per_file):
+                t = created_at[fid] + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+                n = per_file[fid]
+                slot = max(3, int((HORIZON - t).total_seconds() // 60) // n)
+                for k in range(n):
+                    out_at = t
+                    loan = rng.randint(1, min(60 * 24 * 5, slot * 2 // 3))
+                    back_at = out_at + timedelta(minutes=loan)
+                    if back_at > HORIZON:
+                        break
+                    is_open = k == n - 1 and rng.random() < open_ratio
+                    co_rows.append((
+                        fid,
+                        rng.choice(HOLDERS),
+                        _ts(out_at),
+                        None if is_open else _ts(back_at),
+                        "admin",
+                        None if rng.random() < 0.8 else "returned ok",
+                    ))
+                    t = back_at + timedelta(minutes=rng.randint(1, max(1, min(60 * 24 * 2, slot - loan))))
+            conn.executemany(
+                """
+                INSERT INTO checkouts (file_id, holder_name, checkout_at, return_at, operator_name, note)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                co_rows,
+            )
+
+            # 4) items
+            item_rows = []
+            for iid in range(1, items + 1):
+                loc_id = _pick(rng, loc_cum) + 1
+                item_rows.append((
+                    iid,
+                    f"SKU-{iid:07d}",
+                    f"{rng.choice(CATEGORIES)} {rng.choice(WORDS)} {iid}",
+                    rng.choice(CATEGORIES),
+                    round(rng.uniform(20, 400), 1),
+                    round(rng.uniform(20, 400), 1),
+                    round(rng.uniform(20, 400), 1),
+                    loc_id,
+                    rng.choice(TAGS),
+                    rng.randint(1, 4),
+                    "admin",
+                    _ts(EPOCH + timedelta(minutes=rng.randint(0, 60 * 24 * 365))),
+                ))
+            conn.executemany(
+                """
+                INSERT INTO items (
+                    id, sku, name, category, height_mm, width_mm, depth_mm,
+                    location_id, tag, clearance_level, added_by, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                item_rows,
+            )
+
+            # 5) movements (signed ledger; trg_movements_ai keeps items.quantity in sync),
+            #    in time order against a running balance per item, so stock never
+            #    goes negative: an out takes at most what is on hand, and an out
+            #    from an empty shelf becomes an in
+            drawn = []
+            if items:
+                item_cum = _zipf_cum_weights(items, skew)
+                for _ in range(movements):
+                    iid = _pick(rng, item_cum) + 1
+                    kind = rng.choices(["in", "out", "adjust"], weights=[5, 4, 1])[0]
+                    qty = rng.randint(-5, 5) if kind == "adjust" else rng.randint(1, 50)
+                    drawn.append((_ts(EPOCH + timedelta(minutes=rng.randint(0, 60 * 24 * 365))), iid, kind, qty))
+            drawn.sort()
+            on_hand: Dict[int, int] = {}
+            mv_rows = []
+            for ts, iid, kind, qty in drawn:
+                balance = on_hand.get(iid, 0)
+                if kind == "out":
+                    if balance:
+                        qty = -min(qty, balance)
+                    else:
+                        kind = "in"
+                elif kind == "adjust":
+                    qty = max(qty, -balance)
+                on_hand[iid] = balance + qty
+                mv_rows.append((iid, kind, qty, "admin", ts))
+            conn.executemany(
+                """
+                INSERT INTO movements (item_id, movement_type, quantity, operator_name, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                mv_rows,
+            )
+
+            # 6) the admin the runner logs in as
+            conn.execute(
+                "INSERT INTO users (email, password_hash, role, active, created_at) VALUES (?, ?, 'admin', 1, ?)",
+                (BENCH_ADMIN_EMAIL, BENCH_ADMIN_PASSWORD_HASH, _ts(EPOCH)),
+            )
+
+        conn.execute("ANALYZE")
+        counts = {
+            t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+            for t in ("files", "checkouts", "items", "movements", "locations")
+        }
+    finally:
+        conn.close()
+
+    return {
+        "params": {
+            "files": files,
+            "checkouts": checkouts,
+            "items": items,
+            "movements": movements,
+            "locations": locations,
+            "skew": skew,
+            "seed": seed,
+            "deleted_ratio": deleted_ratio,
+            "open_ratio": open_ratio,
+        },
+        "counts": counts,
+        "build_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Build a synthetic FMS database for benchmarking.")
+    p.add_argument("--out", required=True, help="database file to (re)create")
+    p.add_argument("--files", type=int, default=5000)
+    p.add_argument("--checkouts", type=int, default=20000)
+    p.add_argument("--items", type=int, default=5000)
+    p.add_argument("--movements", type=int, default=20000)
+    p.add_argument("--locations", type=int, default=400)
+    p.add_argument("--skew", type=float, default=1.0, help="Zipf exponent, 0 = uniform")
+    p.add_argument("--seed", type=int, default=1234)
+    p.add_argument("--deleted-ratio", type=float, default=0.05)
+    p.add_argument("--open-ratio", type=float, default=0.10)
+    return p
+
+
+def main(argv=None):
+    args = _arg_parser().parse_args(argv)
+    info = build_catalog(
+        args.out,
+        files=args.files,
+        checkouts=args.checkouts,
+        items=args.items,
+        movements=args.movements,
+        locations=args.locations,
+        skew=args.skew,
+        seed=args.seed,
+        deleted_ratio=args.deleted_ratio,
+        open_ratio=args.open_ratio,
+    )
+    with open(args.out + ".meta.json", "w", encoding="utf-8") as fh:
+        json.dump(info, fh, indent=2)
+    print(f"[bench] built {args.out} in {info['build_seconds']}s -> {info['counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Times the API in-process through the ASGI app (no network, no uvicorn).
+
+Every case runs against a private working copy of the generated database;
+cases that write (checkout/return, imports, restore) reset that copy from the
+pristine file before they start so runs stay comparable.
+
+    python -m benchmarks.run --db /tmp/fms_bench.db --out bench_results.json
+    python -m benchmarks.run --db /tmp/fms_bench.db --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --db /tmp/fms_bench.db --compare benchmarks/baseline.json --threshold 0.2
+
+--compare exits with status 1 when any case's median is slower than the
+baseline by more than --threshold (relative) AND --min-delta-ms (absolute).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.generate import BENCH_ADMIN_EMAIL, BENCH_ADMIN_PASSWORD, WORDS
+
+SORTS = ["name", "created_at", "updated_at", "clearance_level", "location", "prev_checkout"]
+STATUSES = [None, "available", "out"]
+SEARCHES = ["", "invoice", "zz-no-match"]
+EXPORT_TYPES = ["files", "checkouts", "all"]
+
+
+class Bench:
+    def __init__(self, pristine: str, work: str, repeat: int, seed: int):
+        self.pristine = pristine
+        self.work = work
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.archive = work + ".archive"
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.reset()
+
+        # env first: the app modules read their paths at import time. Everything
+        # the run writes (replica, archive, shape log, profiles, backups) goes
+        # next to the working copy, not into the repo's Database/
+        workdir = os.path.dirname(work)
+        os.environ["FMS_DB_PATH"] = work
+        os.environ["FMS_REPLICA_PATH"] = work + ".replica"
+        os.environ["FMS_ARCHIVE_PATH"] = self.archive
+        os.environ["FMS_SHAPES_PATH"] = os.path.join(workdir, "query_shapes.json")
+        os.environ["FMS_PROFILES_DIR"] = os.path.join(workdir, "profiles")
+        os.environ["FMS_BACKUP_DIR"] = os.path.join(workdir, "backups")
+        import db
+        db.DB_PATH = work
+        import maintest
+        from fastapi.testclient import TestClient
+
+        self.client = TestClient(maintest.app)
+        r = self.client.post(
+            "/api/session/login",
+            json={"email": BENCH_ADMIN_EMAIL, "password": BENCH_ADMIN_PASSWORD},
+        )
+        if r.status_code != 200:
+            raise SystemExit(f"[bench] login failed ({r.status_code}): {r.text}")
+
+    def reset(self) -> None:
+        """
+        Overwrite the working copy with the pristine database (page-level, WAL
+        safe) and delete the archive (the generated set has none), then drop
+        what the app still holds from the old copy: cached location ids (rows
+        the last case added are gone now), the archive's has-rows flag and the
+        replica.
+        """
+        src = sqlite3.connect(self.pristine)
+        dst = sqlite3.connect(self.work)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(self.archive + suffix):
+                os.remove(self.archive + suffix)
+
+        if "maintest" not in sys.modules:
+            return   # first reset, from __init__: the app isn't loaded yet
+        import archive
+        import db
+        import replica
+        db.invalidate_location_cache()
+        archive.archive_has_rows(refresh=True)
+        if replica.enabled():
+            replica.refresh()   # synchronous, so the next case reads the reset data
+
+    def query(self, sql: str, params=()) -> List[tuple]:
+        conn = sqlite3.connect(self.work)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def record(self, name: str, samples_ms: List[float]) -> None:
+        ordered = sorted(samples_ms)
+        p95_idx = max(0, int(round(0.95 * (len(ordered) - 1))))
+        self.results[name] = {
+            "runs": len(ordered),
+            "min_ms": round(ordered[0], 3),
+            "median_ms": round(statistics.median(ordered), 3),
+            "p95_ms": round(ordered[p95_idx], 3),
+            "mean_ms": round(statistics.fmean(ordered), 3),
+            "max_ms": round(ordered[-1], 3),
+        }
+        print(f"  {name:<60} median {self.results[name]['median_ms']:>9.3f} ms")
+
+    def time_call(self, name: str, call: Callable[[], Any], runs: Optional[int] = None) -> None:
+        samples = []
+        for _ in range(runs or self.repeat):
+            t0 = time.perf_counter()
+            r = call()
+            samples.append((time.perf_counter() - t0) * 1000.0)
+            if r.status_code >= 400:
+                raise SystemExit(f"[bench] {name} -> HTTP {r.status_code}: {r.text[:300]}")
+        self.record(name, samples)
+
+    # -- read paths ---------------------------------------------------------
+
+    def bench_list_files(self) -> None:
+        for sort in SORTS:
+            for st in STATUSES:
+                for q in SEARCHES:
+                    params = {"sort": sort, "dir": "asc" if sort in ("name", "location") else "desc", "q": q}
+                    if st:
+                        params["status"] = st
+                    name = f"list_files sort={sort} status={st or 'all'} q={q or '-'}"
+                    self.time_call(name, lambda p=params: self.client.get("/api/files", params=p))
+
+    def bench_file_details(self) -> None:
+        ids = [r[0] for r in self.query("SELECT id FROM files ORDER BY id")]
+        picks = [self.rng.choice(ids) for _ in range(self.repeat * 4)]
+        it = iter(picks)
+        self.time_call(
+            "file_details",
+            lambda: self.client.get(f"/api/files/{next(it)}/details"),
+            runs=len(picks),
+        )
+
+    def bench_stats(self) -> None:
+        self.time_call("files_stats", lambda: self.client.get("/api/files/stats"))
+
+    def bench_export(self) -> None:
+        for t in EXPORT_TYPES:
+            self.time_call(f"export_data type={t}", lambda t=t: self.client.get("/api/export", params={"type": t}))
+
+    # -- write paths --------------------------------------------------------
+
+    def bench_checkout_return(self) -> None:
+        self.reset()
+        free = [r[0] for r in self.query("""
+            SELECT f.id FROM files f
+            WHERE f.is_deleted = 0
+              AND NOT EXISTS (SELECT 1 FROM checkouts c WHERE c.file_id = f.id AND c.return_at IS NULL)
+            ORDER BY f.id
+        """)]
+        picks = self.rng.sample(free, min(len(free), self.repeat * 4))
+        out_ms, back_ms = [], []
+        for fid in picks:
+            t0 = time.perf_counter()
+            r = self.client.post(f"/api/files/{fid}/checkout", json={"holder_name": "Bench Holder", "note": ""})
+            out_ms.append((time.perf_counter() - t0) * 1000.0)
+            if r.status_code >= 400:
+                raise SystemExit(f"[bench] checkout {fid} -> HTTP {r.status_code}: {r.text[:300]}")
+            t0 = time.perf_counter()
+            r = self.client.patch(f"/api/files/{fid}/return", json="bench return")
+            back_ms.append((time.perf_counter() - t0) * 1000.0)
+            if r.status_code >= 400:
+                raise SystemExit(f"[bench] return {fid} -> HTTP {r.status_code}: {r.text[:300]}")
+        self.record("checkout", out_ms)
+        self.record("return", back_ms)
+
+    def _import_rows(self, n: int) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": f"Imported {self.rng.choice(WORDS)} {i}",
+                "size_label": "A4",
+                "type_label": "Folder",
+                "tag": "import",
+                "note": "",
+                "system_number": f"I{self.rng.randint(1, 20):02d}",
+                "shelf": f"{self.rng.randint(1, 12)}{self.rng.choice('abc')}",
+                "clearance_level": self.rng.randint(1, 4),
+                "added_by": "bench",
+            }
+            for i in range(n)
+        ]
+
+    def bench_import(self, rows: int) -> None:
+        data = self._import_rows(rows)
+        header = list(data[0].keys())
+
+        buf = io.StringIO()
+        w = csv.DictWriter(buf, fieldnames=header)
+        w.writeheader()
+        w.writerows(data)
+        csv_bytes = buf.getvalue().encode("utf-8")
+
+        import openpyxl
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(header)
+        for d in data:
+            ws.append([d[k] for k in header])
+        xbuf = io.BytesIO()
+        wb.save(xbuf)
+        xlsx_bytes = xbuf.getvalue()
+
+        for label, fname, payload, mime in (
+            ("csv", "bench.csv", csv_bytes, "text/csv"),
+            ("xlsx", "bench.xlsx", xlsx_bytes,
+             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+        ):
+            samples = []
+            for _ in range(self.repeat):
+                self.reset()
+                t0 = time.perf_counter()
+                r = self.client.post("/api/import_file", files={"file": (fname, payload, mime)})
+                samples.append((time.perf_counter() - t0) * 1000.0)
+                if r.status_code >= 400:
+                    raise SystemExit(f"[bench] import {label} -> HTTP {r.status_code}: {r.text[:300]}")
+            self.record(f"import_file {label} rows={rows}", samples)
+
+    def bench_restore(self) -> None:
+        self.reset()
+        export = self.client.get("/api/export", params={"type": "files"}).content
+        samples = []
+        for _ in range(self.repeat):
+            self.reset()
+            t0 = time.perf_counter()
+            r = self.client.post("/api/restore_catalog", files={"file": ("files_export.csv", export, "text/csv")})
+            samples.append((time.perf_counter() - t0) * 1000.0)
+            if r.status_code >= 400:
+                raise SystemExit(f"[bench] restore -> HTTP {r.status_code}: {r.text[:300]}")
+        self.record("restore_from_csv", samples)
+        self.reset()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[Dict[str, Any]]:
+    """
+    Returns one row per case present in both runs. A case is a regression
+    when its median grew by more than `threshold` (0.2 = 20%) AND by more
+    than `min_delta_ms`, so sub-millisecond noise never trips the gate.
+    """
+    rows = []
+    base_cases = baseline.get("cases", {})
+    for name, cur in current["cases"].items():
+        base = base_cases.get(name)
+        if not base:
+            continue
+        b, c = base["median_ms"], cur["median_ms"]
+        ratio = (c / b) if b else float("inf")
+        rows.append({
+            "case": name,
+            "baseline_ms": b,
+            "current_ms": c,
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1.0 + threshold and (c - b) > min_delta_ms,
+        })
+    return rows
+
+
+def _arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Run the FMS API benchmarks.")
+    p.add_argument("--db", required=True, help="database built by benchmarks.generate")
+    p.add_argument("--out", default=None, help="write results JSON here")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=99)
+    p.add_argument("--import-rows", type=int, default=500)
+    p.add_argument("--only", default=None, help="run only groups whose name contains this (e.g. list_files)")
+    p.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.20)
+    p.add_argument("--min-delta-ms", type=float, default=1.0)
+    p.add_argument("--save-baseline", default=None, help="also write results to this baseline path")
+    return p
+
+
+def main(argv=None) -> int:
+    args = _arg_parser().parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"[bench] {args.db} not found; build it with python -m benchmarks.generate")
+
+    workdir = tempfile.mkdtemp(prefix="fms_bench_")
+    bench = Bench(os.path.abspath(args.db), os.path.join(workdir, "work.db"), args.repeat, args.seed)
+
+    groups = [
+        ("list_files", bench.bench_list_files),
+        ("file_details", bench.bench_file_details),
+        ("files_stats", bench.bench_stats),
+        ("export_data", bench.bench_export),
+        ("checkout_return", bench.bench_checkout_return),
+        ("import_file", lambda: bench.bench_import(args.import_rows)),
+        ("restore_from_csv", bench.bench_restore),
+    ]
+    for name, fn in groups:
+        if args.only and args.only not in name:
+            continue
+        print(f"[bench] {name}")
+        fn()
+
+    meta_path = args.db + ".meta.json"
+    dataset = json.load(open(meta_path)) if os.path.exists(meta_path) else None
+    result = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "dataset": dataset,
+        },
+        "cases": bench.results,
+    }
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(result, fh, indent=2)
+            print(f"[bench] wrote {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        rows = compare(result, baseline, args.threshold, args.min_delta_ms)
+        regressions = [r for r in rows if r["regression"]]
+        print(f"\n[bench] compared {len(rows)} case(s) against {args.compare}")
+        for r in rows:
+            flag = "REGRESSION" if r["regression"] else ""
+            print(f"  {r['case']:<60} {r['baseline_ms']:>9.3f} -> {r['current_ms']:>9.3f} ms  x{r['ratio']:<6} {flag}")
+        if regressions:
+            print(f"[bench] {len(regressions)} regression(s) over {int(args.threshold * 100)}%")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
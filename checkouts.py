@@ -0,0 +1,190 @@
+# checkouts.py
+"""
+Batch checkout and return for desk carts.
+
+    POST /api/checkouts/batch  {"file_ids": [...], "holder_name": "...", "note": ..., "atomic": true}
+    POST /api/returns/batch    {"file_ids": [...], "note": ..., "atomic": true}
+
+One request, one auth check, one write transaction for the whole cart:
+
+  1. one query reads every file in the cart together with its open checkout
+     (files LEFT JOIN checkouts ... return_at IS NULL),
+  2. each file is checked against that: unknown, deleted, already out (for
+     checkouts) or not out (for returns), or listed twice,
+  3. the accepted files are checked out with one executemany INSERT, or
+     returned with one UPDATE over their checkout ids, all stamped with the
+     same timestamp.
+
+As with movement batches, atomic=true (the default) refuses the whole cart
+with 422 if any file is refused, and atomic=false applies the good ones.
+Every file gets a result: {"file_id", "ok", "checkout_id" | "error"}.
+The per-row triggers (last_movement_at, the analytics return queue) fire
+as they do for single checkouts.
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import APIRouter, Body, HTTPException, Request
+
+import db
+from auth import get_current_user, require_admin
+
+router = APIRouter(tags=["checkouts"])
+
+MAX_BATCH_FILES = 500   # one IN list
+
+_CART_SQL = """
+    SELECT f.id, f.is_deleted, c.id AS checkout_id, c.holder_name, c.checkout_at
+    FROM files f
+    LEFT JOIN checkouts c ON c.file_id = f.id AND c.return_at IS NULL
+    WHERE f.id IN ({marks})
+"""
+
+
+def _cart(conn, file_ids: Sequence[int]) -> Dict[int, Any]:
+    ids = sorted(set(file_ids))
+    return {r["id"]: r for r in conn.execute(_CART_SQL.format(marks=", ".join("?" * len(ids))), ids)}
+
+
+def _checkout_error(row) -> Optional[str]:
+    if row is None:
+        return "File not found."
+    if row["is_deleted"]:
+        return "Cannot check out a deleted file."
+    if row["checkout_id"] is not None:
+        return f"File is already checked out by {row['holder_name']} since {row['checkout_at']}."
+    return None
+
+
+def _return_error(row) -> Optional[str]:
+    if row is None:
+        return "File not found."
+    if row["checkout_id"] is None:
+        return "No active checkout to return."
+    return None
+
+
+def _apply(file_ids: Sequence[int], check, write, atomic: bool) -> Dict[str, Any]:
+    """Check `file_ids` against the cart, then write(conn, cart, accepted, now), in one transaction."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        # the write lock up front: nobody can check a file out between our check and our insert
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            db.lock_rows(conn, "files", file_ids)
+            cart = _cart(conn, file_ids)
+            results: List[Dict[str, Any]] = []
+            accepted: List[Dict[str, Any]] = []
+            seen = set()
+            for file_id in file_ids:
+                error = "File is listed twice." if file_id in seen else check(cart.get(file_id))
+                seen.add(file_id)
+                res = {"file_id": file_id, "ok": error is None}
+                if error:
+                    res["error"] = error
+                else:
+                    accepted.append(res)
+                results.append(res)
+
+            written = bool(accepted) and not (atomic and len(accepted) < len(results))
+            now = None
+            if written:
+                now = conn.execute("SELECT CURRENT_TIMESTAMP AS now").fetchone()["now"]
+                write(conn, cart, accepted, now)
+                conn.execute("COMMIT")
+            else:
+                conn.execute("ROLLBACK")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return {
+        "written": written,
+        "at": now,
+        "files": len(results),
+        "accepted": len(accepted) if written else 0,
+        "rejected": len(results) - len(accepted),
+        "duration_ms": round((time.perf_counter() - started) * 1000.0, 3),
+        "results": results,
+    }
+
+
+def checkout_batch(file_ids: Sequence[int], holder_name: str, operator: str,
+                   note: Optional[str] = None, atomic: bool = True) -> Dict[str, Any]:
+    """Check every file in `file_ids` out to `holder_name`. See the module docstring."""
+
+    def write(conn, cart, accepted, now):
+        conn.executemany(
+            "INSERT INTO checkouts (file_id, holder_name, checkout_at, operator_name, note) VALUES (?, ?, ?, ?, ?)",
+            [(r["file_id"], holder_name, now, operator, note) for r in accepted],
+        )
+        # oneCheckoutPerFile: each file now has exactly one open checkout, the one just made
+        opened = _cart(conn, [r["file_id"] for r in accepted])
+        for r in accepted:
+            r["checkout_id"] = opened[r["file_id"]]["checkout_id"]
+
+    return _apply(file_ids, _checkout_error, write, atomic)
+
+
+def return_batch(file_ids: Sequence[int], operator: str, note: Optional[str] = None,
+                 atomic: bool = True) -> Dict[str, Any]:
+    """Close the open checkout of every file in `file_ids`. A note replaces the checkout's own."""
+
+    def write(conn, cart, accepted, now):
+        for r in accepted:
+            r["checkout_id"] = cart[r["file_id"]]["checkout_id"]
+            r["holder_name"] = cart[r["file_id"]]["holder_name"]
+        ids = [r["checkout_id"] for r in accepted]
+        conn.execute(
+            f"""
+            UPDATE checkouts
+            SET return_at = ?, operator_name = ?, note = COALESCE(NULLIF(?, ''), note)
+            WHERE id IN ({", ".join("?" * len(ids))})
+            """,
+            [now, operator, note] + ids,
+        )
+
+    return _apply(file_ids, _return_error, write, atomic)
+
+
+def _operator(request: Request) -> str:
+    user = get_current_user(request)
+    require_admin(user)
+    return (user.get("email") or "admin").strip()
+
+
+@router.post("/api/checkouts/batch")
+def post_checkout_batch(
+    request: Request,
+    file_ids: List[int] = Body(..., embed=True, min_length=1, max_length=MAX_BATCH_FILES),
+    holder_name: str = Body(..., embed=True),
+    note: Optional[str] = Body(None, embed=True),
+    atomic: bool = Body(True, embed=True),
+):
+    operator_name = _operator(request)
+    clean_holder = holder_name.strip() if holder_name else ""
+    if not clean_holder:
+        raise HTTPException(status_code=400, detail="holder_name is required.")
+
+    result = checkout_batch(file_ids, clean_holder, operator_name, note, atomic)
+    if not result["written"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
+
+
+@router.post("/api/returns/batch")
+def post_return_batch(
+    request: Request,
+    file_ids: List[int] = Body(..., embed=True, min_length=1, max_length=MAX_BATCH_FILES),
+    note: Optional[str] = Body(None, embed=True),
+    atomic: bool = Body(True, embed=True),
+):
+    operator_name = _operator(request)
+    result = return_batch(file_ids, operator_name, note, atomic)
+    if not result["written"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
@@ -1,32 +1,112 @@
 from contextlib import closing
+import os
 import sqlite3
-from typing import Dict, List, Optional, Sequence, Tuple, Any
-DB_PATH = "Database/Database.db"
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Any
+import storage
+
+DB_PATH = os.getenv("FMS_DB_PATH", "Database/Database.db")
+
+# SQLite at DB_PATH unless FMS_DB_URL says otherwise (see storage.py)
+BACKEND = storage.from_env(DB_PATH)
+IntegrityError = BACKEND.IntegrityError
+
+
+def is_sqlite() -> bool:
+    return BACKEND.name == "sqlite"
+
+
+LOCK_CHUNK = 500
+
+
+def lock_rows(conn, table: str, ids: Iterable[int]) -> None:
+    """
+    Inside a write transaction: hold `ids` of `table` until it ends, so what
+    the caller validates against can't change before it writes. SQLite needs
+    nothing, BEGIN IMMEDIATE already took the database write lock; on Postgres
+    BEGIN locks nothing, so take row locks, in id order so that two writers
+    locking overlapping sets queue up instead of deadlocking. Read the rows
+    with a new statement afterwards: it sees what the last holder committed.
+    """
+    if is_sqlite():
+        return
+    ids = sorted(set(ids))
+    for i in range(0, len(ids), LOCK_CHUNK):
+        chunk = ids[i:i + LOCK_CHUNK]
+        conn.execute(f"SELECT id FROM {table} WHERE id IN ({', '.join('?' * len(chunk))}) ORDER BY id FOR UPDATE",
+                     chunk).fetchall()
+
+
+# callbacks fired after every statement on a connection from _connect() or
+# get_conn() (see storage.py), and once per db_stream: fn(sql, params, elapsed_seconds)
+_statement_hooks: List[Callable[[str, Sequence[Any], float], None]] = []
+
+
+def add_statement_hook(fn: Callable[[str, Sequence[Any], float], None]) -> None:
+    if fn not in _statement_hooks:
+        _statement_hooks.append(fn)
+
+
+def _notify(sql: str, params: Sequence[Any], elapsed: float) -> None:
+    for fn in _statement_hooks:
+        try:
+            fn(sql, params, elapsed)
+        except Exception as e:
+            # instrumentation must never break a request
+            print("[db] statement hook failed:", e)
+
+
+BACKEND.on_statement = _notify
+
+
+# callbacks run before a connection is handed out: fn(). admission.py uses one
+# to hold bulk requests back while interactive writes are waiting.
+_connect_hooks: List[Callable[[], None]] = []
+
+
+def add_connect_hook(fn: Callable[[], None]) -> None:
+    if fn not in _connect_hooks:
+        _connect_hooks.append(fn)
 
 
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    for fn in _connect_hooks:
+        fn()
+    return BACKEND.get_conn()
 
 def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys = ON")
-    conn.execute("PRAGMA journal_mode = WAL")
-    conn.execute("PRAGMA synchronous = NORMAL")
-    conn.row_factory = sqlite3.Row
-    return conn
+    for fn in _connect_hooks:
+        fn()
+    return BACKEND.connect()
 
 def db_read(sql: str, params: Sequence[Any] = ()) -> list[sqlite3.Row]:
-    with _connect() as conn:
-        cur = conn.execute(sql, params)
-        return cur.fetchall()
+    with closing(_connect()) as conn:
+        return conn.execute(sql, params).fetchall()
 
 
 def db_write(sql: str, params: Sequence[Any] = ()) -> int:
-    with _connect() as conn:
+    with closing(_connect()) as conn:
         cur = conn.execute(sql, params)
         conn.commit()
         return cur.lastrowid
 
+
+def db_write_returning(sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+    """One INSERT/UPDATE ... RETURNING, committed. The returned row, or None if it touched none."""
+    with closing(_connect()) as conn:
+        rows = conn.execute(sql, params).fetchall()   # drain before COMMIT
+        conn.commit()
+        return rows[0] if rows else None
+
+
+def db_stream(sql: str, params: Sequence[Any] = ()) -> Iterator[sqlite3.Row]:
+    """Like db_read, but yields rows as they come (server-side cursor on Postgres)."""
+    t0 = time.perf_counter()
+    yield from BACKEND.stream(sql, params)
+    if _statement_hooks:
+        _notify(sql, params, time.perf_counter() - t0)
+
 def get_settings():
     with closing(get_conn()) as conn, conn:
         cur = conn.execute("SELECT admin_email, reminder_freq_minutes FROM settings WHERE id=1")
@@ -75,28 +155,146 @@ def mark_checkout_notified(checkout_id: int):
 def row_to_dict(cur, row):
     return {d[0]: row[i] for i, d in enumerate(cur.description)}
 
+# --------------------------------------------------------------------------
+# location cache: (system_number, shelf) <-> locations.id
+# --------------------------------------------------------------------------
+# Locations are almost only ever added, so a per-process map stays right
+# once a row is in it: warm it at startup, add what we insert, and fall back
+# to the table on a miss. What would make it wrong (a location renamed or
+# deleted, in any process, or a restore swapping the file) draws a new token
+# in cache_tokens (migration 18), and the map starts over when the token isn't
+# the one it was filled under. A lookup on the caller's connection reads the
+# token there (one more statement in a transaction it has open anyway); one
+# without a connection reuses the last reading for LOCATION_TOKEN_TTL seconds
+# rather than opening a connection just for the token, so another process's
+# rename can take that long to show up here.
+
+LocationKey = Tuple[Optional[str], Optional[str]]
+LOCATION_CHUNK = 250   # two parameters a key
+LOCATION_TOKEN_TTL = float(os.getenv("FMS_LOCATION_TOKEN_TTL", "2"))
+
+_location_ids: Dict[LocationKey, int] = {}
+_location_keys: Dict[int, LocationKey] = {}
+_location_token: Dict[str, Any] = {"value": None, "at": None}
+_location_lock = threading.Lock()
+
+_LOCATION_TOKEN_SQL = "SELECT token FROM cache_tokens WHERE name = 'locations'"
+
+
+def _check_location_token(conn=None) -> None:
+    """Drop the cache if the database's location token moved since it was filled."""
+    now = time.monotonic()
+    if conn is None:
+        at = _location_token["at"]
+        if at is not None and now - at < LOCATION_TOKEN_TTL:
+            return
+        rows = db_read(_LOCATION_TOKEN_SQL)
+    else:
+        rows = conn.execute(_LOCATION_TOKEN_SQL).fetchall()
+    token = rows[0][0] if rows else None
+    with _location_lock:
+        if token != _location_token["value"]:
+            _location_ids.clear()
+            _location_keys.clear()
+        _location_token.update(value=token, at=now)
+
+
+def _remember_locations(found: Dict[LocationKey, int]) -> None:
+    with _location_lock:
+        for key, loc_id in found.items():
+            _location_ids[key] = loc_id
+            _location_keys[loc_id] = key
+
+
+def warm_location_cache() -> int:
+    """Load every location into the cache. Returns how many there are."""
+    invalidate_location_cache()
+    _check_location_token()   # token first: a change after it shows up on the next lookup
+    rows = db_read("SELECT id, system_number, shelf FROM locations")
+    _remember_locations({(r["system_number"], r["shelf"]): r["id"] for r in rows})
+    return len(rows)
+
+
+def invalidate_location_cache() -> None:
+    with _location_lock:
+        _location_ids.clear()
+        _location_keys.clear()
+        _location_token.update(value=None, at=None)
+
+
+def location_key(location_id: int) -> Optional[LocationKey]:
+    """(system_number, shelf) for a location id, from the cache when it can."""
+    _check_location_token()
+    key = _location_keys.get(location_id)
+    if key is None:
+        rows = db_read("SELECT id, system_number, shelf FROM locations WHERE id = ?", (location_id,))
+        if not rows:
+            return None
+        key = (rows[0]["system_number"], rows[0]["shelf"])
+        _remember_locations({key: location_id})
+    return key
+
+
+def _select_locations(conn, keys: Sequence[LocationKey]) -> Dict[LocationKey, int]:
+    found: Dict[LocationKey, int] = {}
+    for i in range(0, len(keys), LOCATION_CHUNK):
+        chunk = keys[i:i + LOCATION_CHUNK]
+        # `IS` so a NULL shelf matches; SQLite still uses idx_locations_combo for each term
+        where = " OR ".join(["(system_number IS ? AND shelf IS ?)"] * len(chunk))
+        for r in conn.execute(f"SELECT id, system_number, shelf FROM locations WHERE {where}",
+                              [v for key in chunk for v in key]).fetchall():
+            found.setdefault((r[1], r[2]), r[0])
+    return found
+
+
+def resolve_locations(keys: Iterable[LocationKey], conn=None) -> Dict[LocationKey, int]:
+    """
+    Location id for every (system_number, shelf) in `keys`, creating the
+    missing ones with one executemany. Keys that are (None, None) are skipped.
+
+    With `conn`, the lookups and inserts run in the caller's transaction and
+    the new locations are left out of the cache (the caller might roll back);
+    they are picked up from the table on the next miss.
+    """
+    wanted = {k for k in keys if k[0] or k[1]}
+    if not wanted:
+        return {}
+    _check_location_token(conn)
+    out = {k: _location_ids[k] for k in wanted if k in _location_ids}
+    missing = sorted(wanted - out.keys(), key=lambda k: (k[0] or "", k[1] or ""))
+    if not missing:
+        return out
+
+    own = conn is None
+    if own:
+        conn = get_conn()
+        conn.execute("PRAGMA foreign_keys=ON")
+    try:
+        existing = _select_locations(conn, missing)
+        _remember_locations(existing)   # committed rows: safe to cache either way
+        out.update(existing)
+        new = [k for k in missing if k not in existing]
+        if new:
+            # OR IGNORE covers another writer adding the same key meanwhile; UNIQUE
+            # doesn't see NULLs, which is why the lookup above goes first
+            conn.executemany("INSERT OR IGNORE INTO locations(system_number, shelf) VALUES(?, ?)", new)
+            created = _select_locations(conn, new)
+            out.update(created)
+        if own:
+            conn.commit()
+            if new:
+                _remember_locations(created)
+    finally:
+        if own:
+            conn.close()
+    return out
+
+
 def upsert_location(system_number: Optional[str], shelf: Optional[str]) -> Optional[int]:
     if not system_number and not shelf:
         return None
-    c = get_conn()
-    c.execute("PRAGMA foreign_keys=ON")
-    cur = c.cursor()
-    cur.execute("""
-      INSERT OR IGNORE INTO locations(system_number, shelf)
-      VALUES(?, ?)
-    """, (system_number, shelf))
-    # If new row inserted, lastrowid is set; otherwise fetch existing id.
-    if cur.lastrowid:
-        loc_id = cur.lastrowid
-    else:
-        cur.execute("""
-          SELECT id FROM locations WHERE system_number IS ? AND shelf IS ? LIMIT 1
-        """, (system_number, shelf))
-        r = cur.fetchone()
-        loc_id = r[0] if r else None
-    c.commit()
-    c.close()
-    return loc_id
+    key = (system_number, shelf)
+    return resolve_locations([key]).get(key)
 
 def insert_item(
     name: str,
@@ -127,7 +325,7 @@ def insert_item(
     return item_id
 
 def get_item(item_id: int) -> Optional[Dict[str, Any]]:
-    c = conn(); c.row_factory = row_to_dict  # type: ignore
+    c = get_conn(); c.row_factory = row_to_dict  # type: ignore
     cur = c.cursor()
     cur.execute("""
       SELECT i.*,
@@ -141,7 +339,7 @@ def get_item(item_id: int) -> Optional[Dict[str, Any]]:
     return row
 
 def list_items(q: str = "", page: int = 1, page_size: int = 100, include_deleted: bool = False) -> Dict[str, Any]:
-    c = conn(); c.row_factory = row_to_dict  # type: ignore
+    c = get_conn(); c.row_factory = row_to_dict  # type: ignore
     cur = c.cursor()
 
     where = []
@@ -0,0 +1,316 @@
+# housekeeping.py
+"""
+Background database upkeep: checkpoints, ANALYZE / optimize, incremental
+vacuum and integrity checks. (maintenance.py is the CSV restore code; this is
+the SQLite side.)
+
+Jobs, registered on an APScheduler scheduler by add_jobs():
+
+    checkpoint      every minute. PASSIVE checkpoint; TRUNCATE instead during
+                    the quiet window (FMS_MAINT_QUIET_HOURS, UTC, e.g. "1-5")
+                    or once the WAL is past FMS_MAINT_WAL_TRUNCATE_MB.
+    requested       every minute. Runs ANALYZE / incremental_vacuum that other
+                    code asked for with request(): imports and restores ask
+                    for ANALYZE, the checkout archiver asks for a vacuum.
+    optimize        hourly. PRAGMA optimize.
+    quick_check     daily, inside the quiet window.
+
+Every run lands in `maintenance_runs` (created by migration 6) with its
+duration and the bytes it gave back to the filesystem.
+
+The notifier worker runs these. With FMS_MAINT_IN_APP=1 the API process runs
+them too (only turn that on for one process).
+
+    python housekeeping.py checkpoint|truncate|analyze|optimize|vacuum|quick_check
+    python housekeeping.py enable-incremental-vacuum   # one-off, rewrites the file
+
+New databases are created auto_vacuum=INCREMENTAL (see migrations.py,
+migration 1); on an older one the vacuum task skips and its run says so,
+with the one-off command above.
+    python housekeeping.py runs
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends
+
+import db
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/maintenance", tags=["admin"])
+
+QUIET_HOURS = os.getenv("FMS_MAINT_QUIET_HOURS", "1-5")
+WAL_TRUNCATE_BYTES = int(float(os.getenv("FMS_MAINT_WAL_TRUNCATE_MB", "64")) * 1024 * 1024)
+IN_APP = os.getenv("FMS_MAINT_IN_APP", "0") == "1"
+KEEP_RUNS_DAYS = 30
+BUSY_TIMEOUT_MS = 2000
+
+TASKS = ("checkpoint", "truncate", "analyze", "optimize", "vacuum", "quick_check")
+
+
+def request(task: str, reason: str = "") -> None:
+    """Ask for `task` ("analyze" / "vacuum") on the next scheduler tick. Cheap, never raises."""
+    if not db.is_sqlite():
+        return
+    try:
+        db.db_write(
+            """
+            INSERT INTO maintenance_requests (task, reason) VALUES (?, ?)
+            ON CONFLICT(task) DO UPDATE SET requested_at = CURRENT_TIMESTAMP, reason = excluded.reason
+            """,
+            (task, reason),
+        )
+    except sqlite3.Error as e:
+        print(f"[housekeeping] could not request {task}:", e)
+
+
+# --------------------------------------------------------------------------
+# tasks
+# --------------------------------------------------------------------------
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _db_bytes() -> int:
+    return _file_size(db.DB_PATH) + _file_size(db.DB_PATH + "-wal")
+
+
+def _in_quiet_window(now: Optional[datetime] = None) -> bool:
+    if not QUIET_HOURS:
+        return False
+    start, _, end = QUIET_HOURS.partition("-")
+    hour = (now or datetime.now(timezone.utc)).hour
+    start_h, end_h = int(start), int(end or start)
+    if start_h <= end_h:
+        return start_h <= hour <= end_h
+    return hour >= start_h or hour <= end_h   # window over midnight, e.g. 22-4
+
+
+def _checkpoint(conn: sqlite3.Connection, mode: str) -> Tuple[bool, Dict[str, Any]]:
+    busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return not busy, {"mode": mode, "busy": bool(busy), "wal_frames": log_frames,
+                      "checkpointed": checkpointed}
+
+
+def _task_checkpoint(conn):
+    return _checkpoint(conn, "PASSIVE")
+
+
+def _task_truncate(conn):
+    return _checkpoint(conn, "TRUNCATE")
+
+
+def _task_analyze(conn):
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    return True, {}
+
+
+def _task_optimize(conn):
+    conn.execute("PRAGMA optimize")
+    return True, {}
+
+
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+CONVERT_STEP = "python housekeeping.py enable-incremental-vacuum (one-off, app stopped; rewrites the file)"
+
+
+def _task_vacuum(conn):
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if mode != 2:
+        # NONE/FULL: incremental_vacuum is a no-op, and a full VACUUM needs
+        # the whole database to itself, so that stays a manual step. Databases
+        # made by migration 1 are INCREMENTAL already; older ones need it once
+        return False, {"freelist_pages": free, "auto_vacuum": AUTO_VACUUM_MODES.get(mode, mode),
+                       "skipped": "auto_vacuum is not INCREMENTAL", "convert": CONVERT_STEP}
+    conn.execute("PRAGMA incremental_vacuum").fetchall()
+    # hand the truncated pages back to the main file now rather than at the next checkpoint
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return True, {"freelist_pages": free}
+
+
+def _task_quick_check(conn):
+    problems = [r[0] for r in conn.execute("PRAGMA quick_check(20)")]
+    ok = problems == ["ok"]
+    return ok, {} if ok else {"problems": problems}
+
+
+_TASKS = {
+    "checkpoint": _task_checkpoint,
+    "truncate": _task_truncate,
+    "analyze": _task_analyze,
+    "optimize": _task_optimize,
+    "vacuum": _task_vacuum,
+    "quick_check": _task_quick_check,
+}
+
+
+def run_task(task: str) -> Dict[str, Any]:
+    """Run one task now and record it in maintenance_runs."""
+    fn = _TASKS[task]
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    before = _db_bytes()
+    t0 = time.perf_counter()
+
+    conn = db._connect()
+    conn.isolation_level = None   # ANALYZE/vacuum/checkpoint outside a transaction
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    try:
+        ok, detail = fn(conn)
+    except sqlite3.Error as e:
+        ok, detail = False, {"error": str(e)}
+    finally:
+        conn.close()
+
+    duration_ms = (time.perf_counter() - t0) * 1000.0
+    reclaimed = max(0, before - _db_bytes())
+    db.db_write(
+        """
+        INSERT INTO maintenance_runs (task, started_at, duration_ms, bytes_reclaimed, ok, detail)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (task, started_at, round(duration_ms, 3), reclaimed, int(ok), json.dumps(detail) if detail else None),
+    )
+    return {"task": task, "ok": ok, "duration_ms": round(duration_ms, 3),
+            "bytes_reclaimed": reclaimed, **detail}
+
+
+def run_requested() -> List[Dict[str, Any]]:
+    out = []
+    for r in db.db_read("SELECT task, requested_at FROM maintenance_requests ORDER BY requested_at"):
+        if r["task"] in _TASKS:
+            out.append(run_task(r["task"]))
+        # only clear the request we just served; a newer one stays queued
+        db.db_write("DELETE FROM maintenance_requests WHERE task = ? AND requested_at = ?",
+                    (r["task"], r["requested_at"]))
+    return out
+
+
+# --------------------------------------------------------------------------
+# scheduler jobs
+# --------------------------------------------------------------------------
+
+def checkpoint_job():
+    try:
+        big_wal = _file_size(db.DB_PATH + "-wal") > WAL_TRUNCATE_BYTES
+        run_task("truncate" if big_wal or _in_quiet_window() else "checkpoint")
+    except Exception as e:
+        print("[housekeeping] checkpoint failed:", e)
+
+
+def requested_job():
+    try:
+        for r in run_requested():
+            if r.get("convert"):
+                print(f"[housekeeping] {r['task']} skipped, auto_vacuum is {r['auto_vacuum']}: {r['convert']}")
+    except Exception as e:
+        print("[housekeeping] requested tasks failed:", e)
+
+
+def optimize_job():
+    try:
+        run_task("optimize")
+        db.db_write("DELETE FROM maintenance_runs WHERE started_at < ?",
+                    (datetime.fromtimestamp(time.time() - KEEP_RUNS_DAYS * 86400, timezone.utc)
+                     .isoformat(timespec="seconds"),))
+    except Exception as e:
+        print("[housekeeping] optimize failed:", e)
+
+
+def quick_check_job():
+    try:
+        result = run_task("quick_check")
+        if not result["ok"]:
+            print("[housekeeping] quick_check found problems:", result.get("problems") or result)
+    except Exception as e:
+        print("[housekeeping] quick_check failed:", e)
+
+
+def add_jobs(sched) -> None:
+    if not db.is_sqlite():
+        return   # Postgres has autovacuum / its own checkpointer
+    quiet_start = int(QUIET_HOURS.partition("-")[0]) if QUIET_HOURS else 3
+    sched.add_job(checkpoint_job, "interval", minutes=1, id="db-checkpoint")
+    sched.add_job(requested_job, "interval", minutes=1, id="db-requested")
+    sched.add_job(optimize_job, "interval", hours=1, id="db-optimize")
+    sched.add_job(quick_check_job, "cron", hour=quiet_start, minute=40, id="db-quick-check")
+
+
+def start_in_app():
+    """Run the jobs inside the API process (FMS_MAINT_IN_APP=1)."""
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    sched = BackgroundScheduler(timezone="UTC")
+    add_jobs(sched)
+    sched.start()
+    return sched
+
+
+# --------------------------------------------------------------------------
+# endpoints + cli
+# --------------------------------------------------------------------------
+
+def recent_runs(limit: int = 50, task: Optional[str] = None) -> List[Dict[str, Any]]:
+    sql = "SELECT * FROM maintenance_runs"
+    params: List[Any] = []
+    if task:
+        sql += " WHERE task = ?"
+        params.append(task)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    out = []
+    for r in db.db_read(sql, params):
+        d = dict(r)
+        d["ok"] = bool(d["ok"])
+        d["detail"] = json.loads(d["detail"]) if d["detail"] else None
+        out.append(d)
+    return out
+
+
+@router.get("/runs")
+def list_runs(limit: int = 50, task: Optional[str] = None, user=Depends(require_admin)):
+    return recent_runs(min(max(limit, 1), 500), task)
+
+
+def enable_incremental_vacuum() -> Dict[str, Any]:
+    """Switch the database to auto_vacuum=INCREMENTAL. Rewrites the whole file; stop the app first."""
+    before = _db_bytes()
+    conn = db._connect()
+    conn.isolation_level = None
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+    return {"auto_vacuum": mode, "bytes_reclaimed": max(0, before - _db_bytes())}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="FMS database upkeep.")
+    p.add_argument("task", choices=TASKS + ("requested", "enable-incremental-vacuum", "runs"))
+    args = p.parse_args(argv)
+    if args.task == "runs":
+        for r in reversed(recent_runs(20)):
+            print(r)
+    elif args.task == "requested":
+        print(run_requested())
+    elif args.task == "enable-incremental-vacuum":
+        print(enable_incremental_vacuum())
+    else:
+        print(run_task(args.task))
+
+
+if __name__ == "__main__":
+    main()
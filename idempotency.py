@@ -0,0 +1,220 @@
+# idempotency.py
+"""
+Idempotency-Key support for every write endpoint.
+
+A client that may retry (double-clicks, flaky desk Wi-Fi, an import
+re-sent after a timeout) sends the same `Idempotency-Key: <any string>`
+header with every attempt at one POST / PUT / PATCH / DELETE. The first
+attempt runs and its response is kept; later attempts get that response
+back, with `Idempotent-Replayed: true`, without running the endpoint or
+touching the catalog tables.
+
+Keys are scoped to the session's user; a key on a request without a
+session gets 401. Keeping the response is a row in
+idempotency_keys (migration 17):
+
+  1. the first attempt claims the key with one upsert. The row has no
+     response yet and expires after FMS_IDEMPOTENCY_INFLIGHT_SECONDS (300),
+     so a crashed worker can't hold a key forever,
+  2. the request runs. Its body is hashed as the endpoint reads it, and
+     whatever the endpoint left unread is read and hashed before the
+     response starts. The response is copied as it is sent,
+  3. the row gets the status, headers, zlib-compressed body and request
+     hash, and expires after FMS_IDEMPOTENCY_TTL_HOURS (24).
+
+A retry while the first attempt is still running gets 409 with
+Retry-After. A key re-used for a different request (other method, path,
+query or body) gets 422. 5xx and 429 responses, responses over
+FMS_IDEMPOTENCY_MAX_KB (1024), responses that set cookies (login) and
+responses sent before the request body was read to the end are not kept;
+the key is released and the next attempt runs again.
+
+The worker's purge job deletes expired rows hourly.
+"""
+import hashlib
+import json
+import os
+import zlib
+from contextlib import closing
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+import db
+from auth import get_current_user
+
+HEADER = "idempotency-key"
+METHODS = ("POST", "PUT", "PATCH", "DELETE")
+TTL_SECONDS = int(float(os.getenv("FMS_IDEMPOTENCY_TTL_HOURS", "24")) * 3600)
+INFLIGHT_SECONDS = int(os.getenv("FMS_IDEMPOTENCY_INFLIGHT_SECONDS", "300"))
+MAX_BODY_BYTES = int(os.getenv("FMS_IDEMPOTENCY_MAX_KB", "1024")) * 1024
+MAX_KEY_LENGTH = 255
+NOT_KEPT = (429, 503)   # "try again later": the retry must run
+
+# not replayed: framing the server sets again, and anything per-session
+_SKIP_HEADERS = {b"content-length", b"transfer-encoding", b"connection", b"date", b"server", b"set-cookie"}
+
+
+def _claim(owner: str, key: str, method: str, path: str) -> Optional[Any]:
+    """Take the key, or return the row that already holds it."""
+    with closing(db._connect()) as conn, conn:
+        claimed = conn.execute(
+            """
+            INSERT INTO idempotency_keys (owner, idem_key, method, path, expires_at)
+            VALUES (?, ?, ?, ?, datetime('now', ?))
+            ON CONFLICT (owner, idem_key) DO UPDATE SET
+              method = excluded.method, path = excluded.path, status = NULL, request_hash = NULL,
+              headers = NULL, body = NULL, created_at = excluded.created_at, expires_at = excluded.expires_at
+            WHERE idempotency_keys.expires_at < excluded.created_at
+            """,
+            (owner, key, method, path, f"+{INFLIGHT_SECONDS} seconds"),
+        ).rowcount
+        if claimed:
+            return None
+        rows = conn.execute(
+            "SELECT status, request_hash, headers, body FROM idempotency_keys WHERE owner = ? AND idem_key = ?",
+            (owner, key),
+        ).fetchall()
+    return rows[0] if rows else None
+
+
+def _store(owner: str, key: str, request_hash: str, status: int,
+           headers: List[Tuple[bytes, bytes]], body: bytes) -> None:
+    db.db_write(
+        """
+        UPDATE idempotency_keys
+        SET status = ?, request_hash = ?, headers = ?, body = ?, expires_at = datetime('now', ?)
+        WHERE owner = ? AND idem_key = ?
+        """,
+        (status, request_hash,
+         json.dumps([[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers]),
+         zlib.compress(body), f"+{TTL_SECONDS} seconds", owner, key),
+    )
+
+
+def _release(owner: str, key: str) -> None:
+    db.db_write("DELETE FROM idempotency_keys WHERE owner = ? AND idem_key = ? AND status IS NULL", (owner, key))
+
+
+def purge() -> int:
+    """Delete expired keys. Returns how many."""
+    with closing(db._connect()) as conn, conn:
+        return conn.execute("DELETE FROM idempotency_keys WHERE expires_at < datetime('now')").rowcount
+
+
+def purge_job():
+    try:
+        n = purge()
+        if n:
+            print(f"[idempotency] purged {n} expired keys")
+    except Exception as e:
+        print("[idempotency] purge failed:", e)
+
+
+def _request_hasher(scope):
+    h = hashlib.sha256()
+    for part in (scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1")):
+        h.update(part.encode() + b"\0")
+    return h
+
+
+async def _plain(send, status: int, detail: str, headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")]
+                           + [(k.encode(), v.encode()) for k, v in (headers or {}).items()]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI, so request bodies keep streaming through (uploads aren't buffered here)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in METHODS:
+            return await self.app(scope, receive, send)
+        key = dict(scope["headers"]).get(HEADER.encode())
+        if key is None:
+            return await self.app(scope, receive, send)
+
+        key = key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _plain(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters.")
+        user = get_current_user(Request(scope))
+        if not user or not user.get("email"):
+            # anonymous clients would all share one key space, and could replay each other's responses
+            return await _plain(send, 401, "Idempotency-Key needs a signed-in session.")
+        owner = user["email"]
+        hasher = _request_hasher(scope)
+
+        held = await run_in_threadpool(_claim, owner, key, scope["method"], scope["path"])
+        if held is not None:
+            if held["status"] is None:
+                return await _plain(send, 409, "A request with this Idempotency-Key is still in progress.",
+                                    {"retry-after": "1"})
+            # the retry's body only needs hashing, not buffering
+            while True:
+                message = await receive()
+                hasher.update(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            if hasher.hexdigest() != held["request_hash"]:
+                return await _plain(send, 422, "Idempotency-Key was already used for a different request.")
+            headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(held["headers"])]
+            await send({"type": "http.response.start", "status": held["status"],
+                        "headers": headers + [(b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": zlib.decompress(bytes(held["body"]))})
+            return
+
+        response: Dict[str, Any] = {"status": 500, "headers": [], "body": [], "size": 0, "keep": True,
+                                    "body_read": False}
+
+        async def hashing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                hasher.update(message.get("body", b""))
+                if not message.get("more_body"):
+                    response["body_read"] = True
+            return message
+
+        async def drain():
+            # hash whatever the endpoint left unread, so the stored hash is of the whole body
+            # (what a retry is compared with). Must happen before the response starts: after
+            # that the server only hands out http.disconnect
+            while not response["body_read"]:
+                if (await hashing_receive())["type"] != "http.request":
+                    break   # the client went away
+
+        async def copying_send(message):
+            if message["type"] == "http.response.start":
+                await drain()
+                response["status"] = message["status"]
+                response["headers"] = [(k, v) for k, v in message.get("headers", [])
+                                       if k.lower() not in _SKIP_HEADERS]
+                if any(k.lower() == b"set-cookie" for k, _ in message.get("headers", [])):
+                    response["keep"] = False
+            elif message["type"] == "http.response.body" and response["keep"]:
+                chunk = message.get("body", b"")
+                response["size"] += len(chunk)
+                if response["size"] > MAX_BODY_BYTES:
+                    response["keep"] = False
+                    response["body"] = []
+                else:
+                    response["body"].append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, copying_send)
+        except BaseException:
+            await run_in_threadpool(_release, owner, key)
+            raise
+        # a shed request (429 / 503) never ran; nor is a hash of half a body worth keeping
+        if response["keep"] and response["body_read"] and response["status"] not in NOT_KEPT \
+                and response["status"] < 500:
+            await run_in_threadpool(_store, owner, key, hasher.hexdigest(), response["status"],
+                                    response["headers"], b"".join(response["body"]))
+        else:
+            await run_in_threadpool(_release, owner, key)
@@ -1,16 +1,21 @@
 # items.py
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, field_validator
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import Any, Dict, List, Optional, Union
+from contextlib import nullcontext
+from datetime import datetime, timezone
+import codecs
+import json
+import time
+from starlette.concurrency import run_in_threadpool
 import db
+import ledger
+import locations
+import replenishment
+from auth import require_operator
 
 router = APIRouter(prefix="/api/items", tags=["items"])
 
-def require_operator():
-    # reuse existing auth dependency
-    class U: email="operator@example.com"
-    return U()
-
 class LocationIn(BaseModel):
     system_number: Optional[str] = None
     shelf: Optional[str] = None
@@ -34,31 +39,194 @@ class ItemIn(BaseModel):
         if v < 1 or v > 4: raise ValueError("clearance_level must be 1..4")
         return v
 
+# --------------------------------------------------------------------------
+# bulk creation
+# --------------------------------------------------------------------------
+# One write transaction for the whole batch: locations resolved set-wise
+# (db.resolve_locations), every row in one executemany, occupancy rollups
+# suspended and rebuilt once for the touched locations. Bad records are
+# reported by position and skipped, or fail the batch with atomic=true.
+
+MAX_BULK_ITEMS = 50000
+ID_CHUNK = 500
+
+_INSERT_ITEM_SQL = """
+  INSERT INTO items(name, tag, note, clearance_level,
+                    height_mm, width_mm, depth_mm,
+                    location_id, added_by, sku, category, unit)
+  VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+def _location_key(item: ItemIn):
+    if item.location and (item.location.system_number or item.location.shelf):
+        return (item.location.system_number, item.location.shelf)
+    return None
+
+def _taken_skus(conn, skus: List[str]) -> set:
+    taken = set()
+    for i in range(0, len(skus), ID_CHUNK):
+        chunk = skus[i:i + ID_CHUNK]
+        taken |= {r[0] for r in conn.execute(
+            f"SELECT sku FROM items WHERE sku IN ({', '.join('?' * len(chunk))})", chunk)}
+    return taken
+
+def create_items(records: List[Union[ItemIn, str]], added_by: Optional[str] = None,
+                 atomic: bool = False) -> Dict[str, Any]:
+    """
+    Insert `records` (ItemIn, or the validation error for a record that didn't
+    parse) in one transaction. Results come back in input order.
+    """
+    started = time.perf_counter()
+    results: List[Dict[str, Any]] = [
+        {"line": n, "ok": False, "error": r} if isinstance(r, str) else {"line": n, "ok": True}
+        for n, r in enumerate(records)
+    ]
+    good = [(n, r) for n, r in enumerate(records) if not isinstance(r, str)]
+
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # sku is UNIQUE: one clash would abort the executemany, so find them first
+            skus = [r.sku for _, r in good if r.sku]
+            taken = _taken_skus(conn, sorted(set(skus)))
+            seen = set()
+            for n, r in good:
+                if not r.sku:
+                    continue
+                if r.sku in taken:
+                    results[n] = {"line": n, "ok": False, "error": f"sku {r.sku!r} already exists."}
+                elif r.sku in seen:
+                    results[n] = {"line": n, "ok": False, "error": f"sku {r.sku!r} repeated in this batch."}
+                seen.add(r.sku)
+            good = [(n, r) for n, r in good if results[n]["ok"]]
+
+            if not good or (atomic and len(good) < len(records)):
+                conn.execute("ROLLBACK")
+                return _bulk_summary(results, False, started)
+
+            loc_ids = db.resolve_locations({k for _, r in good for k in [_location_key(r)] if k}, conn)
+            rows = []
+            for _, r in good:
+                key = _location_key(r)
+                rows.append((r.name, r.tag, r.note, r.clearance_level,
+                             r.height_mm, r.width_mm, r.depth_mm,
+                             loc_ids.get(key) if key else None, added_by, r.sku, r.category, r.unit))
+
+            # items without a location don't touch the rollups at all
+            with locations.suspend_rollups(conn) if loc_ids else nullcontext(set()) as touched:
+                touched.update(loc_ids.values())
+                if db.is_sqlite():
+                    # a new rowid is max(rowid) + 1 and we hold the write lock, so
+                    # the batch gets the next len(rows) ids, in insert order
+                    before = conn.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+                    conn.executemany(_INSERT_ITEM_SQL, rows)
+                    after = conn.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+                    if after - before != len(rows):
+                        raise RuntimeError("item ids were not assigned contiguously")
+                    ids = range(before + 1, after + 1)
+                else:
+                    # sequence values are shared with other writers: take each id as it comes
+                    ids = [conn.execute(_INSERT_ITEM_SQL, row).lastrowid for row in rows]
+            for (n, _), item_id in zip(good, ids):
+                results[n]["id"] = item_id
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return _bulk_summary(results, True, started)
+
+def _bulk_summary(results: List[Dict[str, Any]], written: bool, started: float) -> Dict[str, Any]:
+    seconds = time.perf_counter() - started
+    created = sum(1 for r in results if r.get("id") is not None)
+    return {
+        "written": written,
+        "records": len(results),
+        "created": created,
+        "failed": sum(1 for r in results if not r["ok"]),
+        "duration_ms": round(seconds * 1000.0, 3),
+        "records_per_second": round(created / seconds, 1) if seconds > 0 else None,
+        "results": results,
+    }
+
+def _parse_record(raw: Any) -> Union[ItemIn, str]:
+    try:
+        return ItemIn.model_validate(raw)
+    except ValidationError as e:
+        err = e.errors()[0]
+        return f"{'.'.join(str(p) for p in err['loc']) or 'record'}: {err['msg']}"
+
+async def _ndjson_records(request: Request) -> List[Union[ItemIn, str]]:
+    """Parse an NDJSON body one line at a time as it arrives."""
+    records: List[Union[ItemIn, str]] = []
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+
+    def take(line: str):
+        if not line.strip():
+            return
+        if len(records) >= MAX_BULK_ITEMS:
+            raise ValueError(f"At most {MAX_BULK_ITEMS} records per request.")
+        try:
+            records.append(_parse_record(json.loads(line)))
+        except json.JSONDecodeError as e:
+            records.append(f"invalid JSON: {e.msg}")
+
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            take(line)
+    take(pending + decoder.decode(b"", final=True))
+    return records
+
 @router.post("", status_code=201)
 def create_item(payload: ItemIn, user=Depends(require_operator)):
-    loc_id = None
-    if payload.location and (payload.location.system_number or payload.location.shelf):
-        loc_id = db.upsert_location(payload.location.system_number, payload.location.shelf)
-
-    item_id = db.insert_item(
-        name=payload.name,
-        tag=payload.tag,
-        note=payload.note,
-        clearance_level=payload.clearance_level,
-        height_mm=payload.height_mm,
-        width_mm=payload.width_mm,
-        depth_mm=payload.depth_mm,
-        location_id=loc_id,
-        added_by=getattr(user, "email", None),
-        sku=payload.sku,
-        category=payload.category,
-        unit=payload.unit
-    )
-    item = db.get_item(item_id)
+    result = create_items([payload], added_by=user["email"])
+    outcome = result["results"][0]
+    if not outcome["ok"]:
+        raise HTTPException(409, outcome["error"])
+    item = db.get_item(outcome["id"])
     if not item:
         raise HTTPException(500, "Failed to create item")
     return item
 
+@router.post("/bulk")
+async def create_items_bulk(
+    request: Request,
+    atomic: bool = Query(False, description="reject the whole batch if any record is bad"),
+    user=Depends(require_operator)
+):
+    """
+    Body: a JSON array of items (or {"items": [...]}), or NDJSON with one item
+    per line (Content-Type: application/x-ndjson). Returns one result per
+    record, in input order: {"line", "ok", "id"} or {"line", "ok": false, "error"}.
+    """
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            records = await _ndjson_records(request)
+        else:
+            body = await request.json()
+            raw = body.get("items") if isinstance(body, dict) else body
+            if not isinstance(raw, list):
+                raise ValueError('Body must be a JSON array or {"items": [...]}.')
+            if len(raw) > MAX_BULK_ITEMS:
+                raise ValueError(f"At most {MAX_BULK_ITEMS} records per request.")
+            records = [_parse_record(r) for r in raw]
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(400, str(e))
+    if not records:
+        raise HTTPException(400, "No records.")
+
+    result = await run_in_threadpool(create_items, records, user["email"], atomic)
+    if not result["written"]:
+        raise HTTPException(422, result)
+    return result
+
 @router.get("")
 def list_items(
     q: str = Query("", description="search in name/tag/note/sku"),
@@ -68,6 +236,35 @@ def list_items(
 ):
     return db.list_items(q=q, page=page, page_size=page_size, include_deleted=include_deleted)
 
+def _as_of_param(as_of: Optional[str]) -> str:
+    if not as_of:
+        return ledger.normalize_ts(datetime.now(timezone.utc).isoformat())
+    try:
+        return ledger.normalize_ts(as_of, end_of_day=True)
+    except ValueError:
+        raise HTTPException(400, "as_of must be an ISO date or datetime")
+
+@router.get("/quantity")
+def get_quantities_as_of(
+    as_of: Optional[str] = Query(None, description="ISO date/datetime (UTC); a bare date means end of that day"),
+    include_deleted: bool = False
+):
+    return ledger.quantities_as_of(_as_of_param(as_of), include_deleted=include_deleted)
+
+@router.get("/low_stock")
+def get_low_stock(
+    limit: int = Query(100, ge=1, le=1000),
+    category: Optional[str] = None
+):
+    # reorder points come from the nightly replenishment job
+    return {"items": replenishment.low_stock(limit=limit, category=category)}
+
+@router.get("/{item_id}/quantity")
+def get_quantity_as_of(item_id: int, as_of: Optional[str] = Query(None)):
+    if not db.db_read("SELECT 1 FROM items WHERE id = ?", (item_id,)):
+        raise HTTPException(404, "Not found")
+    return ledger.quantity_as_of(item_id, _as_of_param(as_of))
+
 @router.get("/{item_id}")
 def get_item(item_id: int):
     item = db.get_item(item_id)
@@ -0,0 +1,203 @@
+# ledger.py
+"""
+As-of stock queries over the movements ledger.
+
+items.quantity only knows "now". The quantity of an item at time D is the sum
+of its movements with timestamp <= D (transfers excluded, they don't change
+the total), which over a long ledger is a big scan. So every now and then we
+write a checkpoint: one quantity_checkpoint_runs row (its as_of time) plus
+the non-zero per-item quantities in item_quantity_checkpoints. An as-of
+query starts at the newest checkpoint at or before D and replays only the
+movements with as_of < timestamp <= D.
+
+A back-dated line (batch posts may carry their own timestamp) landing at or
+before a checkpoint's as_of would make that checkpoint stale, so
+trg_movements_checkpoints (migration 8) adds it into every checkpoint it
+falls before. That's rare and touches one row per affected checkpoint.
+
+The worker calls checkpoint_job() hourly; it only writes a checkpoint once
+FMS_QTY_CHECKPOINT_EVERY movements have piled up (or FMS_QTY_CHECKPOINT_DAYS
+have passed with at least one), so the replayed tail stays bounded by ledger
+volume, not by time.
+
+    python ledger.py checkpoint
+    python ledger.py as-of 2025-03-31 [--item 42]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import db
+
+CHECKPOINT_EVERY_MOVEMENTS = int(os.getenv("FMS_QTY_CHECKPOINT_EVERY", "20000"))
+CHECKPOINT_MAX_AGE_DAYS = int(os.getenv("FMS_QTY_CHECKPOINT_DAYS", "7"))
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"   # what datetime('now') writes into movements.timestamp
+
+
+def normalize_ts(value: str, end_of_day: bool = False) -> str:
+    """
+    ISO date/datetime -> the ledger's 'YYYY-MM-DD HH:MM:SS' UTC text, so plain
+    string comparison orders it correctly. A bare date is the start of that
+    day, or its last second with end_of_day=True ("stock on 2025-03-31").
+    Raises ValueError on anything unparseable.
+    """
+    raw = (value or "").strip()
+    if raw.endswith("Z"):
+        raw = raw[:-1] + "+00:00"
+    dt = datetime.fromisoformat(raw)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    if end_of_day and len(raw) == 10:
+        dt += timedelta(days=1, seconds=-1)
+    return dt.strftime(TS_FORMAT)
+
+
+def _now_ts() -> str:
+    return datetime.now(timezone.utc).strftime(TS_FORMAT)
+
+
+def _run_for(conn, as_of: str) -> Dict[str, Any]:
+    """Newest checkpoint at or before `as_of`; an empty stand-in if there is none."""
+    r = conn.execute(
+        "SELECT id, as_of, max_movement_id FROM quantity_checkpoint_runs "
+        "WHERE as_of <= ? ORDER BY as_of DESC, id DESC LIMIT 1",
+        (as_of,),
+    ).fetchone()
+    if r is None:
+        return {"id": None, "as_of": ""}
+    return dict(r)
+
+
+def _replay_sql(item_filter: str) -> str:
+    return f"""
+        SELECT item_id, CAST(SUM(quantity) AS INTEGER) AS q FROM movements
+        WHERE timestamp > ? AND timestamp <= ? AND movement_type <> 'transfer' {item_filter}
+        GROUP BY item_id
+    """
+
+
+def _quantities_as_of(conn, as_of: str, include_deleted: bool = False) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    run = _run_for(conn, as_of)
+    sql = f"""
+        SELECT i.id AS item_id, COALESCE(cp.quantity, 0) + COALESCE(r.q, 0) AS quantity
+        FROM items i
+        LEFT JOIN item_quantity_checkpoints cp ON cp.run_id = ? AND cp.item_id = i.id
+        LEFT JOIN ({_replay_sql("")}) r ON r.item_id = i.id
+        {"" if include_deleted else "WHERE i.is_deleted = 0"}
+        ORDER BY i.id
+    """
+    params = (run["id"] or -1, run["as_of"], as_of)
+    return [{"item_id": r["item_id"], "quantity": r["quantity"]} for r in conn.execute(sql, params)], run
+
+
+def quantity_as_of(item_id: int, as_of: str) -> Dict[str, Any]:
+    """Quantity of one item at `as_of` (ledger timestamp format, see normalize_ts)."""
+    conn = db._connect()
+    try:
+        run = _run_for(conn, as_of)
+        base = 0
+        if run["id"] is not None:
+            r = conn.execute("SELECT quantity FROM item_quantity_checkpoints WHERE run_id = ? AND item_id = ?",
+                             (run["id"], item_id)).fetchone()
+            base = r["quantity"] if r else 0
+        r = conn.execute(_replay_sql("AND item_id = ?"), (run["as_of"], as_of, item_id)).fetchone()
+    finally:
+        conn.close()
+    return {"item_id": item_id, "as_of": as_of, "quantity": base + (r["q"] if r else 0),
+            "checkpoint": run["as_of"] or None}
+
+
+def quantities_as_of(as_of: str, include_deleted: bool = False) -> Dict[str, Any]:
+    """Quantity of every item at `as_of`, in one pass."""
+    conn = db._connect()
+    try:
+        rows, run = _quantities_as_of(conn, as_of, include_deleted)
+    finally:
+        conn.close()
+    return {"as_of": as_of, "checkpoint": run["as_of"] or None, "items": rows}
+
+
+def create_checkpoint(as_of: Optional[str] = None) -> Dict[str, Any]:
+    """Write a checkpoint at `as_of` (default now), built from the previous one."""
+    started = time.perf_counter()
+    as_of = as_of or _now_ts()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        # max_movement_id is informational (checkpoint_due counts from it); the
+        # write lock keeps it in step with the sums
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) AS m FROM movements").fetchone()["m"]
+            rows, prev = _quantities_as_of(conn, as_of, include_deleted=True)
+            run_id = conn.execute(
+                "INSERT INTO quantity_checkpoint_runs (as_of, max_movement_id) VALUES (?, ?)",
+                (as_of, max_id),
+            ).lastrowid
+            nonzero = [(run_id, r["item_id"], r["quantity"]) for r in rows if r["quantity"]]
+            conn.executemany(
+                "INSERT INTO item_quantity_checkpoints (run_id, item_id, quantity) VALUES (?, ?, ?)",
+                nonzero,
+            )
+            duration_ms = round((time.perf_counter() - started) * 1000.0, 3)
+            conn.execute("UPDATE quantity_checkpoint_runs SET items = ?, duration_ms = ? WHERE id = ?",
+                         (len(nonzero), duration_ms, run_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return {"run_id": run_id, "as_of": as_of, "max_movement_id": max_id, "items": len(nonzero),
+            "built_from": prev["as_of"] or None, "duration_ms": duration_ms}
+
+
+def checkpoint_due() -> Optional[str]:
+    """Why a checkpoint should be written now, or None."""
+    last = db.db_read("SELECT as_of, max_movement_id FROM quantity_checkpoint_runs ORDER BY id DESC LIMIT 1")
+    since_id = last[0]["max_movement_id"] if last else 0
+    pending = db.db_read("SELECT COUNT(*) AS n FROM movements WHERE id > ?", (since_id,))[0]["n"]
+    if pending >= CHECKPOINT_EVERY_MOVEMENTS:
+        return f"{pending} movements since the last checkpoint"
+    if pending and last:
+        age = datetime.now(timezone.utc).replace(tzinfo=None) - datetime.strptime(last[0]["as_of"], TS_FORMAT)
+        if age >= timedelta(days=CHECKPOINT_MAX_AGE_DAYS):
+            return f"last checkpoint is {age.days} days old"
+    return None
+
+
+def checkpoint_job():
+    try:
+        reason = checkpoint_due()
+        if reason:
+            summary = create_checkpoint()
+            print(f"[ledger] quantity checkpoint {summary['as_of']} ({reason}): "
+                  f"{summary['items']} items in {summary['duration_ms']} ms")
+    except Exception as e:
+        print("[ledger] quantity checkpoint failed:", e)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Quantity checkpoints and as-of stock queries.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("checkpoint")
+    c.add_argument("--as-of", default=None)
+    a = sub.add_parser("as-of")
+    a.add_argument("when")
+    a.add_argument("--item", type=int, default=None)
+    args = p.parse_args(argv)
+
+    if args.cmd == "checkpoint":
+        print(create_checkpoint(normalize_ts(args.as_of) if args.as_of else None))
+    elif args.item is not None:
+        print(quantity_as_of(args.item, normalize_ts(args.when, end_of_day=True)))
+    else:
+        for row in quantities_as_of(normalize_ts(args.when, end_of_day=True))["items"]:
+            print(row["item_id"], row["quantity"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+# locations.py
+"""
+Location occupancy: how full each shelf and each system is.
+
+Triggers (migration 10) keep two rollup tables in step with `items`:
+
+    location_occupancy  one row per location (system_number + shelf):
+                        item_count, total_quantity, total_volume_mm3,
+                        capacity_mm3 and the stored fill_ratio
+    system_occupancy    the same summed per system_number
+
+so reading a fill level is a primary-key lookup and "top N fullest /
+emptiest" walks an index for N rows, however many items there are.
+
+An item's volume is height x width x depth x max(quantity, 1); items without
+all three dimensions count toward item_count but not volume.
+
+Putaway: a location with capacity dimensions (set_capacity) is a point in
+the `location_fit` R*Tree (migration 11) at (its sorted inner dimensions,
+its free volume). fit() asks the tree for shelves whose every side and free
+volume are at least the item's, which is an index range search rather than
+a scan of every shelf, and ranks them by how little room is left over.
+
+Bulk changes shouldn't pay two trigger UPDATEs per row. Wrap them in
+suspend_rollups(conn): the triggers stand down for that transaction and the
+touched locations are recomputed with one GROUP BY at the end.
+
+    python locations.py rebuild
+"""
+import argparse
+from contextlib import closing, contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+
+import db
+import migrations
+from auth import require_admin
+
+router = APIRouter(prefix="/api/locations", tags=["locations"])
+
+GUARD = "occupancy"
+ID_CHUNK = 500
+FIT_WINDOW = 2.0        # first putaway window: shelves with up to 2x the needed free volume
+FIT_WINDOW_STEPS = 12   # widened 4x a step, then no upper bound
+
+_TOP_COLUMNS = {
+    "fill": "fill_ratio",
+    "volume": "total_volume_mm3",
+    "quantity": "total_quantity",
+    "items": "item_count",
+}
+
+_LOCATION_ROWS_SQL = f"""
+    INSERT INTO location_occupancy (location_id, system_number, shelf, capacity_mm3,
+                                    item_count, total_quantity, total_volume_mm3)
+    SELECT l.id, COALESCE(l.system_number, ''), l.shelf, l.capacity_mm3,
+           COALESCE(a.n, 0), COALESCE(a.q, 0), COALESCE(a.v, 0)
+    FROM locations l
+    LEFT JOIN (
+        SELECT i.location_id, COUNT(*) AS n, SUM(i.quantity) AS q,
+               SUM({migrations._occupied_volume_sql("i")}) AS v
+        FROM items i
+        WHERE i.is_deleted = 0 AND i.location_id IS NOT NULL {{item_filter}}
+        GROUP BY i.location_id
+    ) a ON a.location_id = l.id
+    {{location_filter}}
+"""
+
+_SYSTEM_ROWS_SQL = """
+    INSERT INTO system_occupancy (system_number, location_count, item_count, total_quantity,
+                                  total_volume_mm3, capacity_mm3)
+    SELECT system_number, COUNT(*), SUM(item_count), SUM(total_quantity),
+           SUM(total_volume_mm3), COALESCE(SUM(capacity_mm3), 0)
+    FROM location_occupancy
+    {where}
+    GROUP BY system_number
+"""
+
+
+def _marks(n: int) -> str:
+    return ", ".join("?" * n)
+
+
+def rebuild_occupancy(conn, location_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    """
+    Recompute the rollups with set-based queries, inside the caller's
+    transaction. location_ids=None rebuilds everything.
+    """
+    conn.execute("INSERT OR IGNORE INTO rollup_guard (name) VALUES (?)", (GUARD,))
+    if location_ids is None:
+        conn.execute("DELETE FROM location_occupancy")
+        conn.execute("DELETE FROM system_occupancy")
+        conn.execute(_LOCATION_ROWS_SQL.format(item_filter="", location_filter=""))
+        conn.execute(_SYSTEM_ROWS_SQL.format(where=""))
+        locations = conn.execute("SELECT COUNT(*) FROM location_occupancy").fetchone()[0]
+        systems = conn.execute("SELECT COUNT(*) FROM system_occupancy").fetchone()[0]
+    else:
+        ids = sorted(set(location_ids))
+        touched_systems: Set[str] = set()
+        for i in range(0, len(ids), ID_CHUNK):
+            chunk = ids[i:i + ID_CHUNK]
+            marks = _marks(len(chunk))
+            touched_systems |= {r[0] for r in conn.execute(
+                f"SELECT system_number FROM location_occupancy WHERE location_id IN ({marks})", chunk)}
+            conn.execute(f"DELETE FROM location_occupancy WHERE location_id IN ({marks})", chunk)
+            conn.execute(_LOCATION_ROWS_SQL.format(item_filter=f"AND i.location_id IN ({marks})",
+                                                   location_filter=f"WHERE l.id IN ({marks})"),
+                         chunk + chunk)
+            touched_systems |= {r[0] for r in conn.execute(
+                f"SELECT system_number FROM location_occupancy WHERE location_id IN ({marks})", chunk)}
+        systems_list = sorted(touched_systems)
+        for i in range(0, len(systems_list), ID_CHUNK):
+            chunk = systems_list[i:i + ID_CHUNK]
+            marks = _marks(len(chunk))
+            conn.execute(f"DELETE FROM system_occupancy WHERE system_number IN ({marks})", chunk)
+            conn.execute(_SYSTEM_ROWS_SQL.format(where=f"WHERE system_number IN ({marks})"), chunk)
+        locations, systems = len(ids), len(systems_list)
+    conn.execute("DELETE FROM rollup_guard WHERE name = ?", (GUARD,))
+    return {"locations": locations, "systems": systems}
+
+
+@contextmanager
+def suspend_rollups(conn) -> Iterator[Set[int]]:
+    """
+    Inside an open write transaction on `conn`: switch the occupancy triggers
+    off, let the caller do its bulk writes, then rebuild the locations it
+    added to the yielded set (everything, if it added none).
+    """
+    conn.execute("INSERT OR IGNORE INTO rollup_guard (name) VALUES (?)", (GUARD,))
+    touched: Set[int] = set()
+    yield touched
+    rebuild_occupancy(conn, touched or None)
+
+
+def rebuild(location_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            out = rebuild_occupancy(conn, location_ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return out
+
+
+# --------------------------------------------------------------------------
+# capacity + putaway
+# --------------------------------------------------------------------------
+
+def set_capacity(location_id: int, height_mm: Optional[float], width_mm: Optional[float],
+                 depth_mm: Optional[float]) -> bool:
+    """
+    Record a location's inner box. capacity_mm3 is written in the same UPDATE
+    on purpose: that is what the occupancy and fit triggers listen to.
+    """
+    dims = (height_mm, width_mm, depth_mm)
+    volume = height_mm * width_mm * depth_mm if None not in dims else None
+    with closing(db._connect()) as conn, conn:
+        cur = conn.execute(
+            """
+            UPDATE locations
+               SET capacity_height_mm = ?, capacity_width_mm = ?, capacity_depth_mm = ?, capacity_mm3 = ?
+             WHERE id = ?
+            """,
+            (*dims, volume, location_id),
+        )
+        return cur.rowcount > 0
+
+
+def _fit_sql(use_rtree: bool, by_system: bool, bounded: bool) -> str:
+    s1, s2, s3 = migrations._sorted_dims_sql("l.capacity_height_mm", "l.capacity_width_mm",
+                                             "l.capacity_depth_mm")
+    free = "(o.capacity_mm3 - o.total_volume_mm3)"
+    # the exact test; the R*Tree's float32 coordinates can be a hair off either way
+    conds = [f"{s1} >= ?", f"{s2} >= ?", f"{s3} >= ?", f"{free} >= ?"]
+    if use_rtree:
+        source = """location_fit f
+            JOIN locations l ON l.id = f.id
+            JOIN location_occupancy o ON o.location_id = f.id"""
+        box = ["f.dim1_max >= ?", "f.dim2_max >= ?", "f.dim3_max >= ?", "f.free_max >= ?"]
+        if bounded:
+            box.append("f.free_min <= ?")
+        conds = box + conds
+    else:
+        source = "locations l JOIN location_occupancy o ON o.location_id = l.id"
+    if by_system:
+        conds.append("l.system_number = ?")
+    return f"""
+        SELECT l.id AS location_id, l.system_number, l.shelf, l.aisle, l.rack, l.bin,
+               l.capacity_height_mm, l.capacity_width_mm, l.capacity_depth_mm,
+               o.capacity_mm3, o.total_volume_mm3, o.fill_ratio,
+               {free} - ? AS free_after_mm3,
+               ({s1} - ?) + ({s2} - ?) + ({s3} - ?) AS slack_mm
+        FROM {source}
+        WHERE {" AND ".join(conds)}
+        ORDER BY free_after_mm3, slack_mm, l.id
+        LIMIT ?
+    """
+
+
+def fit(height_mm: float, width_mm: float, depth_mm: float, quantity: int = 1,
+        limit: int = 10, system_number: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Locations that can take `quantity` boxes of h x w x d, tightest fit first."""
+    a1, a2, a3 = sorted((height_mm, width_mm, depth_mm))
+    need = height_mm * width_mm * depth_mm * max(quantity, 1)
+    probe = [a1, a2, a3, need]
+    tail = ([system_number] if system_number is not None else []) + [limit]
+
+    if not db.is_sqlite():
+        # Postgres has no R*Tree module: same filter, plain scan
+        sql = _fit_sql(False, system_number is not None, False)
+        return [_location_row(r) for r in db.db_read(sql, [need, a1, a2, a3] + probe + tail)]
+
+    # Best fit = least free volume left, so look in a free-volume window just
+    # above what's needed and widen it until it holds `limit` candidates. A
+    # small box fits nearly every shelf; this keeps it from ranking them all.
+    bounded = _fit_sql(True, system_number is not None, True)
+    upper = max(need, 1.0) * FIT_WINDOW
+    for _ in range(FIT_WINDOW_STEPS):
+        rows = db.db_read(bounded, [need, a1, a2, a3] + probe + [upper] + probe + tail)
+        if len(rows) >= limit:
+            return [_location_row(r) for r in rows]
+        upper *= FIT_WINDOW ** 2
+    sql = _fit_sql(True, system_number is not None, False)
+    return [_location_row(r) for r in db.db_read(sql, [need, a1, a2, a3] + probe + probe + tail)]
+
+
+# --------------------------------------------------------------------------
+# endpoints
+# --------------------------------------------------------------------------
+
+def _location_row(r) -> Dict[str, Any]:
+    d = dict(r)
+    if d.get("fill_ratio") is not None:
+        d["fill_ratio"] = round(d["fill_ratio"], 4)
+    return d
+
+
+@router.get("/occupancy")
+def get_shelf_occupancy(
+    system_number: Optional[str] = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(200, ge=1, le=1000),
+):
+    """Fill level of every shelf, optionally within one system."""
+    where, params = "", []
+    if system_number is not None:
+        where, params = "WHERE system_number = ?", [system_number]
+    rows = db.db_read(
+        f"SELECT * FROM location_occupancy {where} ORDER BY system_number, shelf LIMIT ? OFFSET ?",
+        params + [page_size, (page - 1) * page_size],
+    )
+    return [_location_row(r) for r in rows]
+
+
+@router.get("/occupancy/systems")
+def get_system_occupancy():
+    return [_location_row(r) for r in db.db_read("SELECT * FROM system_occupancy ORDER BY system_number")]
+
+
+@router.get("/occupancy/top")
+def get_top_locations(
+    by: str = Query("fill", description="fill | volume | quantity | items"),
+    order: str = Query("fullest", description="fullest | emptiest"),
+    limit: int = Query(10, ge=1, le=500),
+    system_number: Optional[str] = Query(None),
+):
+    """Top-N fullest or emptiest locations, read straight off the rollup's index."""
+    col = _TOP_COLUMNS.get(by)
+    if col is None or order not in ("fullest", "emptiest"):
+        raise HTTPException(400, "by must be fill|volume|quantity|items and order fullest|emptiest")
+    conds: List[str] = []
+    params: List[Any] = []
+    if col == "fill_ratio":
+        conds.append("fill_ratio IS NOT NULL")   # no capacity recorded, no fill level
+    if system_number is not None:
+        conds.append("system_number = ?")
+        params.append(system_number)
+    where = f"WHERE {' AND '.join(conds)}" if conds else ""
+    direction = "DESC" if order == "fullest" else "ASC"
+    rows = db.db_read(
+        f"SELECT * FROM location_occupancy {where} ORDER BY {col} {direction}, location_id {direction} LIMIT ?",
+        params + [limit],
+    )
+    return [_location_row(r) for r in rows]
+
+
+@router.get("/fit")
+def get_fit(
+    h: float = Query(..., gt=0, description="item height, mm"),
+    w: float = Query(..., gt=0, description="item width, mm"),
+    d: float = Query(..., gt=0, description="item depth, mm"),
+    qty: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1, le=200),
+    system_number: Optional[str] = Query(None),
+):
+    """Putaway candidates for an h x w x d item, best (tightest) fit first."""
+    return fit(h, w, d, quantity=qty, limit=limit, system_number=system_number)
+
+
+@router.put("/{location_id}/capacity")
+def put_capacity(
+    location_id: int,
+    height_mm: Optional[float] = Body(None, embed=True, gt=0),
+    width_mm: Optional[float] = Body(None, embed=True, gt=0),
+    depth_mm: Optional[float] = Body(None, embed=True, gt=0),
+    user=Depends(require_admin),
+):
+    if not set_capacity(location_id, height_mm, width_mm, depth_mm):
+        raise HTTPException(404, "Not found")
+    return get_location_occupancy(location_id)
+
+
+@router.get("/{location_id}/occupancy")
+def get_location_occupancy(location_id: int):
+    rows = db.db_read("SELECT * FROM location_occupancy WHERE location_id = ?", (location_id,))
+    if not rows:
+        raise HTTPException(404, "Not found")
+    return _location_row(rows[0])
+
+
+@router.post("/occupancy/rebuild")
+def post_rebuild_occupancy(user=Depends(require_admin)):
+    return rebuild()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Location occupancy rollups.")
+    p.add_argument("cmd", choices=("rebuild",))
+    args = p.parse_args(argv)
+    if args.cmd == "rebuild":
+        print(rebuild())
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from fastapi import APIRouter, UploadFile, File, HTTPException
 from starlette import status
 
 from db import db_read, db_write 
+import db
+import housekeeping
 
 router = APIRouter()
 
@@ -78,7 +80,8 @@ def _update_existing(rec: Dict[str, Any]) -> None:
             added_by = ?,
             is_deleted = ?,
             deleted_at = ?,
-            updated_at = CURRENT_TIMESTAMP
+            updated_at = CURRENT_TIMESTAMP,
+            version = version + 1
         WHERE id = ?
         """,
         (
@@ -227,6 +230,10 @@ def restore_from_csv(file_obj: io.TextIOBase) -> Dict[str, Any]:
                 "error": str(e),
             })
 
+    if inserted or updated:
+        db.BACKEND.after_bulk_load("files")
+        housekeeping.request("analyze", "restore_catalog")
+
     return {
         "inserted": inserted,
         "updated": updated,
@@ -462,6 +469,10 @@ def restore_checkouts_from_csv(file_obj: io.TextIOBase) -> Dict[str, Any]:
                 "error": str(e),
             })
 
+    if inserted:
+        db.BACKEND.after_bulk_load("checkouts")
+        housekeeping.request("analyze", "restore_checkouts")
+
     return {
         "inserted": inserted,
         "failed": failed,
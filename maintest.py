@@ -1,23 +1,46 @@
+import time
+_import_started = time.perf_counter()
+
 import csv
 from typing import Optional, Sequence, Tuple, Any
 import zipfile
 from fastapi import FastAPI, HTTPException, Request, Response, status, Path, Body, Query, UploadFile, File
-import sqlite3, io, openpyxl
+import sqlite3, io
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse, StreamingResponse
 from maintenance import router as maintenance_router
 from auth import router as auth_router
-from db import db_read, db_write
+import db
+import migrations
+from db import db_read, db_write, db_write_returning
+import archive
+import replica
+import housekeeping
+import backup
+import reconcile
+import locations
+import orders
+import analytics
 from settings import router as settings_router
 from items import router as items_router
+from movements import router as movements_router
+from checkouts import router as checkouts_router
+from advisor import router as advisor_router
+from profiling import router as profiling_router, profiling_middleware
+from idempotency import IdempotencyMiddleware
+import admission
+from admission import AdmissionMiddleware
 
 from auth import (
     get_current_user,
     require_admin,
 )
 
-DB_PATH = "Database/database.db"
 app = FastAPI(title="FMS", version="1.0")
+app.middleware("http")(profiling_middleware)
+# idempotent replays are answered before admission; see admission.py for the classes
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(IdempotencyMiddleware)
 
 
 #@app.get("/")
@@ -36,150 +59,6 @@ def dbTest():
     clearance_level=  1,
     added_by= "admin"))
 
-def innitDB():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    conn.execute("PRAGMA foreign_keys = ON;")
-    schema=cursor.executescript('''
-       CREATE TABLE IF NOT EXISTS files (
-          id                INTEGER PRIMARY KEY AUTOINCREMENT,
-          name              TEXT NOT NULL,
-          size_label        TEXT,
-          type_label        TEXT,
-          tag               TEXT,
-          note              TEXT,
-
-          system_number     TEXT NOT NULL,
-          shelf             TEXT NOT NULL,
-
-          clearance_level   INTEGER NOT NULL CHECK (clearance_level BETWEEN 1 AND 4),
-
-          added_by          TEXT NOT NULL DEFAULT 'admin',
-          created_at        TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
-          updated_at        TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
-          deleted_at        TEXT,
-          is_deleted        INTEGER NOT NULL DEFAULT 0 CHECK (is_deleted IN (0,1))
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_files_name       ON files(name);
-        CREATE INDEX IF NOT EXISTS idx_files_location   ON files(system_number, shelf);
-        CREATE INDEX IF NOT EXISTS idx_files_clearance  ON files(clearance_level);
-        CREATE INDEX IF NOT EXISTS idx_files_is_deleted ON files(is_deleted);
-        CREATE INDEX IF NOT EXISTS idx_files_active_name ON files(is_deleted, name);
-        CREATE INDEX IF NOT EXISTS idx_files_created_at ON files(created_at);
-
-    
-        -- CHECKOUTS (movement log)
-   
-        CREATE TABLE IF NOT EXISTS checkouts (
-          id             INTEGER PRIMARY KEY AUTOINCREMENT,
-          file_id        INTEGER NOT NULL,
-          holder_name    TEXT NOT NULL,
-          checkout_at    TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
-          return_at      TEXT,
-          operator_name  TEXT NOT NULL DEFAULT 'admin',
-          note           TEXT,
-          -- Timeline guard: return cannot predate checkout
-          CHECK (return_at IS NULL OR return_at >= checkout_at),
-          FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
-        );
-
-        CREATE INDEX IF NOT EXISTS idx_checkouts_file_return    ON checkouts(file_id, return_at);
-        CREATE INDEX IF NOT EXISTS idx_checkouts_checkout_at    ON checkouts(checkout_at);
-        CREATE INDEX IF NOT EXISTS idx_checkouts_return_at      ON checkouts(return_at);
-        CREATE INDEX IF NOT EXISTS idx_checkouts_file_checkout_at ON checkouts(file_id, checkout_at DESC);
-
-
-        CREATE UNIQUE INDEX IF NOT EXISTS oneCheckoutPerFile
-        ON checkouts(file_id)
-        WHERE return_at IS NULL;
-
-
-        DROP TRIGGER IF EXISTS trg_checkouts_return_after_checkout;
-        CREATE TRIGGER IF NOT EXISTS trg_checkouts_return_after_checkout
-        BEFORE UPDATE OF return_at ON checkouts
-        FOR EACH ROW
-        WHEN NEW.return_at IS NOT NULL AND NEW.return_at < NEW.checkout_at
-        BEGIN
-          SELECT RAISE(ABORT, 'return_at cannot be earlier than checkout_at');
-        END;
-
-
-        -- DERIVED STATUS VIEW
-
-        CREATE VIEW IF NOT EXISTS file_status AS
-        SELECT
-          f.id AS file_id,
-          f.name,
-          f.system_number,
-          f.shelf,
-          f.clearance_level,
-          f.is_deleted,
-          (
-            SELECT c.holder_name
-            FROM checkouts c
-            WHERE c.file_id = f.id AND c.return_at IS NULL
-            ORDER BY c.checkout_at DESC
-            LIMIT 1
-          ) AS currently_held_by,
-          (
-            SELECT c.checkout_at
-            FROM checkouts c
-            WHERE c.file_id = f.id AND c.return_at IS NULL
-            ORDER BY c.checkout_at DESC
-            LIMIT 1
-          ) AS date_of_checkout,
-          (
-            SELECT c2.checkout_at
-            FROM checkouts c2
-            WHERE c2.file_id = f.id AND c2.return_at IS NOT NULL
-            ORDER BY c2.checkout_at DESC
-            LIMIT 1
-          ) AS date_of_previous_checkout
-        FROM files f;
-
-
-        -- LAST 10 CHECKOUTS PER FILE (ranked window)
-
-        DROP VIEW IF EXISTS file_last_10_access;
-        CREATE VIEW IF NOT EXISTS file_last_10_access AS
-        WITH ranked AS (
-          SELECT
-            c.file_id,
-            c.holder_name,
-            c.checkout_at,
-            ROW_NUMBER() OVER (
-              PARTITION BY c.file_id
-              ORDER BY c.checkout_at DESC
-            ) AS rn
-          FROM checkouts c
-        )
-        SELECT file_id, holder_name, checkout_at
-        FROM ranked
-        WHERE rn <= 10
-        ORDER BY file_id, checkout_at DESC;
-
-        -- SOFT DELETE GUARD
-
-        DROP TRIGGER IF EXISTS trg_filesSoftDeleteBlocksOpenCheckout;
-        CREATE TRIGGER IF NOT EXISTS trg_filesSoftDeleteBlocksOpenCheckout
-        BEFORE UPDATE OF is_deleted ON files
-        FOR EACH ROW
-        WHEN NEW.is_deleted = 1
-        AND EXISTS (
-          SELECT 1 FROM checkouts c
-          WHERE c.file_id = NEW.id AND c.return_at IS NULL
-        )
-        BEGIN
-          SELECT RAISE(ABORT, 'Cannot soft-delete a file with an open checkout. Return it first.');
-        END;
-        
-    ''')
-    print("Database Initialized \n ",schema)
-    conn.commit()
-    conn.close()
-
-
 @app.post("/api/add_file")
 def add_file(
     request: Request,
@@ -378,15 +257,18 @@ def list_files(
         where_sql = "WHERE " + " AND ".join(where_clauses)
 
     #
-    # 4. ORDER BY (same logic you had)
+    # 4. ORDER BY
     #
+    # every key here has an (is_deleted, key, id) index, see migrations._ensure_sort_keys.
+    # ties are always newest file first; for ASC keys SQLite walks the index and
+    # only sorts within a run of equal keys (temp B-tree for the right part).
     allowed_sorts = {
-        "name": "LOWER(f.name)",
+        "name": "f.name_key",
         "created_at": "f.created_at",
         "updated_at": "f.updated_at",
         "clearance_level": "f.clearance_level",
-        "location": "SUBSTR(f.system_number,1,1), f.shelf",
-        "prev_checkout": "last_movement_ts"
+        "location": "f.location_key",
+        "prev_checkout": "f.last_movement_at"
     }
     sort_col = allowed_sorts.get(sort, "f.created_at")
     sort_dir = "ASC" if dir.lower() == "asc" else "DESC"
@@ -437,21 +319,10 @@ def list_files(
                 LIMIT 1
             ) AS last_return_at,
 
-            -- unified "last movement" timestamp
-            -- if it's checked out now -> use the active checkout_at
-            -- else -> use last_return_at
-            CASE
-            WHEN fs.currently_held_by IS NOT NULL
-                THEN fs.date_of_checkout
-            ELSE (
-                SELECT c.return_at
-                FROM checkouts c
-                WHERE c.file_id = f.id
-                AND c.return_at IS NOT NULL
-                ORDER BY c.checkout_at DESC
-                LIMIT 1
-            )
-            END AS last_movement_ts
+            -- unified "last movement" timestamp: the active checkout_at if it's
+            -- checked out now, else the last return. The same column the
+            -- prev_checkout sort uses, kept by triggers and kept through archiving.
+            f.last_movement_at           AS last_movement_ts
 
         FROM files f
         LEFT JOIN file_status fs
@@ -498,68 +369,131 @@ def list_files(
     }
     
     
+#
+# file writes: one statement each.
+# Each handler is a single UPDATE/INSERT ... RETURNING whose WHERE clause
+# carries every precondition, so there's no read-then-write race; the
+# constraints (oneCheckoutPerFile, the soft-delete guard) do the rest and
+# their IntegrityError becomes a 409. Only when the statement touches no row
+# do we look at the file again, to say why (404 / 409 / 412).
+#
+# files.version goes up on every write and is sent as the ETag; a request
+# with If-Match only applies if the file is still at one of those versions.
+#
+
+def _if_match(request: Request) -> Optional[list[int]]:
+    """Versions the If-Match header accepts; None if there's no header (or it's *)."""
+    raw = request.headers.get("if-match")
+    if raw is None or raw.strip() == "*":
+        return None
+    versions = []
+    for tag in raw.split(","):
+        tag = tag.strip()
+        tag = (tag[2:] if tag.startswith("W/") else tag).strip('"')
+        if tag.isdigit():
+            versions.append(int(tag))
+    return versions   # empty: matches nothing
+
+
+def _version_clause(versions: Optional[list[int]]) -> Tuple[str, list[int]]:
+    if versions is None:
+        return "", []
+    if not versions:
+        return " AND 1 = 0", []
+    return f" AND version IN ({', '.join('?' * len(versions))})", versions
+
+
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _file_state(file_id: int):
+    rows = db_read("SELECT is_deleted, deleted_at, version FROM files WHERE id = ?", (file_id,))
+    return rows[0] if rows else None
+
+
+def _precondition_failed(state) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail=f"File has changed (now version {state['version']}); reload it and retry.",
+        headers={"ETag": _etag(state["version"])},
+    )
+
+
 @app.delete("/api/files/{file_id}")
 def soft_delete_file(
     file_id: int,
     request: Request,
+    response: Response,
 ):
     # auth
     user = get_current_user(request)
     require_admin(user)
 
-    # does file exist?
-    row = db_read("SELECT id, is_deleted FROM files WHERE id = ?", (file_id,))
-    if not row:
-        raise HTTPException(status_code=404, detail="File not found.")
-
-    # is it currently checked out?
-    open_co = db_read("""
-        SELECT holder_name, checkout_at
-        FROM checkouts
-        WHERE file_id = ? AND return_at IS NULL
-        LIMIT 1
-    """, (file_id,))
-    if open_co:
-        holder, ts = open_co[0]["holder_name"], open_co[0]["checkout_at"]
+    cond, params = _version_clause(_if_match(request))
+    try:
+        # the soft-delete guard trigger refuses while a checkout is open
+        row = db_write_returning(
+            f"""
+            UPDATE files SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP, version = version + 1
+            WHERE id = ? AND is_deleted = 0{cond}
+            RETURNING deleted_at, version
+            """,
+            (file_id, *params),
+        )
+    except db.IntegrityError:
+        open_co = db_read("""
+            SELECT holder_name, checkout_at
+            FROM checkouts
+            WHERE file_id = ? AND return_at IS NULL
+            LIMIT 1
+        """, (file_id,))
+        holder, ts = (open_co[0]["holder_name"], open_co[0]["checkout_at"]) if open_co else ("someone", "?")
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Cannot delete: file is currently checked out by {holder} since {ts}."
         )
 
-    # already deleted? just echo state
-    if row[0]["is_deleted"] == 1:
-        deleted = db_read("SELECT deleted_at FROM files WHERE id = ?", (file_id,))
-        return {"id": file_id, "deleted": True, "deleted_at": deleted[0]["deleted_at"]}
+    if row is None:
+        state = _file_state(file_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="File not found.")
+        if state["is_deleted"] != 1:
+            raise _precondition_failed(state)
+        # already deleted? just echo state
+        row = state
 
-    # soft delete now
-    db_write(
-        "UPDATE files SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP WHERE id = ?",
-        (file_id,)
-    )
-    out = db_read("SELECT deleted_at FROM files WHERE id = ?", (file_id,))
-    return {"id": file_id, "deleted": True, "deleted_at": out[0]["deleted_at"]}
+    response.headers["ETag"] = _etag(row["version"])
+    return {"id": file_id, "deleted": True, "deleted_at": row["deleted_at"]}
 
 # RESTORE
 @app.patch("/api/files/{file_id}/restore")
 def restore_file(
     file_id: int,
     request: Request,
+    response: Response,
 ):
     # auth
     user = get_current_user(request)
     require_admin(user)
 
-    row = db_read("SELECT id, is_deleted FROM files WHERE id = ?", (file_id,))
-    if not row:
-        raise HTTPException(status_code=404, detail="File not found.")
-
-    if row[0]["is_deleted"] == 0:
-        return {"id": file_id, "restored": True}
-
-    db_write(
-        "UPDATE files SET is_deleted = 0, deleted_at = NULL WHERE id = ?",
-        (file_id,)
+    cond, params = _version_clause(_if_match(request))
+    row = db_write_returning(
+        f"""
+        UPDATE files SET is_deleted = 0, deleted_at = NULL, version = version + 1
+        WHERE id = ? AND is_deleted = 1{cond}
+        RETURNING version
+        """,
+        (file_id, *params),
     )
+    if row is None:
+        row = _file_state(file_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="File not found.")
+        if row["is_deleted"] != 0:
+            raise _precondition_failed(row)
+
+    response.headers["ETag"] = _etag(row["version"])
     return {"id": file_id, "restored": True}
 
 @app.get("/api/deleted_files")
@@ -595,19 +529,6 @@ def checkout_file(
 
     operator_name = (user.get("email") or "admin").strip()
 
-    row = db_read(
-        "SELECT id, is_deleted FROM files WHERE id = ?",
-        (file_id,)
-    )
-    if not row:
-        raise HTTPException(status_code=404, detail="File not found.")
-
-    if row[0]["is_deleted"] == 1:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Cannot check out a deleted file."
-        )
-
     clean_holder = holder_name.strip() if holder_name else ""
     if not clean_holder:
         raise HTTPException(
@@ -615,38 +536,35 @@ def checkout_file(
             detail="holder_name is required."
         )
 
-    open_co = db_read(
-        """
-        SELECT id FROM checkouts
-        WHERE file_id = ? AND return_at IS NULL
-        LIMIT 1
-        """,
-        (file_id,)
-    )
-    if open_co:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="File is already checked out."
-        )
-
     try:
-        checkout_id = db_write(
+        # no row if the file is missing or deleted; oneCheckoutPerFile refuses a second open checkout
+        row = db_write_returning(
             """
             INSERT INTO checkouts (file_id, holder_name, operator_name, note)
-            VALUES (?, ?, ?, ?)
+            SELECT f.id, ?, ?, ? FROM files f WHERE f.id = ? AND f.is_deleted = 0
+            RETURNING id, checkout_at
             """,
-            (file_id, clean_holder, operator_name, note),
+            (clean_holder, operator_name, note, file_id),
         )
-    except Exception as e:
+    except db.IntegrityError:
         raise HTTPException(
-            status_code=500,
-            detail=f"DB insert failed: {e}",
+            status_code=status.HTTP_409_CONFLICT,
+            detail="File is already checked out."
+        )
+
+    if row is None:
+        if _file_state(file_id) is None:
+            raise HTTPException(status_code=404, detail="File not found.")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Cannot check out a deleted file."
         )
 
     return {
         "status": "checked_out",
         "file_id": file_id,
-        "checkout_id": checkout_id,
+        "checkout_id": row["id"],
+        "checkout_at": row["checkout_at"],
         "holder_name": clean_holder,
         "operator_name": operator_name,
     }
@@ -668,42 +586,28 @@ def return_file(
     require_admin(user)
     operator_name = user.get("email", "admin")
 
-    file_row = db_read("SELECT id FROM files WHERE id = ?", (file_id,))
-    if not file_row:
-        raise HTTPException(status_code=404, detail="File not found.")
-
-    checkout_rows = db_read(
-        """
-        SELECT id, note FROM checkouts
-        WHERE file_id = ? AND return_at IS NULL
-        ORDER BY checkout_at DESC LIMIT 1
-        """,
-        (file_id,),
-    )
-    if not checkout_rows:
-        raise HTTPException(status_code=409, detail="No active checkout to return.")
-
-    checkout_id = checkout_rows[0]["id"]
-    prev_note = checkout_rows[0]["note"]
-
-    final_note = note or prev_note
-
-    db_write(
+    # oneCheckoutPerFile: at most one open checkout per file, so this touches one row or none
+    row = db_write_returning(
         """
         UPDATE checkouts
         SET return_at = CURRENT_TIMESTAMP,
             operator_name = ?,
-            note = ?
-        WHERE id = ?
+            note = COALESCE(NULLIF(?, ''), note)
+        WHERE file_id = ? AND return_at IS NULL
+        RETURNING note
         """,
-        (operator_name, final_note, checkout_id),
+        (operator_name, note, file_id),
     )
+    if row is None:
+        if _file_state(file_id) is None:
+            raise HTTPException(status_code=404, detail="File not found.")
+        raise HTTPException(status_code=409, detail="No active checkout to return.")
 
-    return {"status": "returned", "file_id": file_id, "note": final_note}
+    return {"status": "returned", "file_id": file_id, "note": row["note"]}
 
 
 @app.get("/api/files/{file_id}/details")
-def file_details(file_id: int):
+def file_details(file_id: int, response: Response):
     # Basic file metadata and live status
     info_rows = db_read(
         """
@@ -722,6 +626,7 @@ def file_details(file_id: int):
             f.updated_at,
             f.is_deleted,
             f.deleted_at,
+            f.version,
 
             fs.currently_held_by,
             fs.date_of_checkout,
@@ -739,6 +644,7 @@ def file_details(file_id: int):
         raise HTTPException(status_code=404, detail="File not found.")
 
     info = dict(info_rows[0])
+    response.headers["ETag"] = _etag(info["version"])
 
     # Last 10 access history for this file
     history_rows = db_read(
@@ -758,6 +664,9 @@ def file_details(file_id: int):
     )
 
     history = [dict(r) for r in history_rows]
+    # older returns may have been moved to the archive; only look there if we're short
+    if len(history) < 10:
+        history.extend(archive.archived_history(file_id, 10 - len(history)))
 
     return {
         "file": info,
@@ -769,6 +678,7 @@ def file_details(file_id: int):
 def update_file(
     file_id: int,
     request: Request,
+    response: Response,
     name: str = Body(...),
     size_label: Optional[str] = Body(None),
     type_label: Optional[str] = Body(None),
@@ -782,17 +692,6 @@ def update_file(
     user = get_current_user(request)
     require_admin(user)
 
-    row = db_read(
-        """
-        SELECT id, is_deleted
-        FROM files
-        WHERE id = ?
-        """,
-        (file_id,)
-    )
-    if not row:
-        raise HTTPException(status_code=404, detail="File not found.")
-
     clean_name = name.strip() if name else ""
     if not clean_name:
         raise HTTPException(status_code=400, detail="File name cannot be empty.")
@@ -805,8 +704,9 @@ def update_file(
     if clearance_level not in (1, 2, 3, 4):
         raise HTTPException(status_code=400, detail="Clearance level must be between 1 and 4.")
 
-    db_write(
-        """
+    cond, versions = _version_clause(_if_match(request))
+    updated = db_write_returning(
+        f"""
         UPDATE files
         SET
             name = ?,
@@ -817,25 +717,10 @@ def update_file(
             system_number = ?,
             shelf = ?,
             clearance_level = ?,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-        """,
-        (
-            clean_name,
-            size_label,
-            type_label,
-            tag,
-            note,
-            clean_system_number,
-            clean_shelf,
-            clearance_level,
-            file_id,
-        ),
-    )
-
-    updated = db_read(
-        """
-        SELECT
+            updated_at = CURRENT_TIMESTAMP,
+            version = version + 1
+        WHERE id = ?{cond}
+        RETURNING
             id,
             name,
             size_label,
@@ -848,13 +733,29 @@ def update_file(
             added_by,
             created_at,
             updated_at,
-            is_deleted
-        FROM files
-        WHERE id = ?
+            is_deleted,
+            version
         """,
-        (file_id,)
-    )[0]
+        (
+            clean_name,
+            size_label,
+            type_label,
+            tag,
+            note,
+            clean_system_number,
+            clean_shelf,
+            clearance_level,
+            file_id,
+            *versions,
+        ),
+    )
+    if updated is None:
+        state = _file_state(file_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail="File not found.")
+        raise _precondition_failed(state)
 
+    response.headers["ETag"] = _etag(updated["version"])
     return {
         "updated": True,
         "file": dict(updated),
@@ -918,7 +819,10 @@ def _rows_from_csv(text: str) -> list[dict]:
 
 
 def _rows_from_xlsx(data: bytes) -> list[dict]:
-    if openpyxl is None:
+    # imported here so worker start-up doesn't pay for it
+    try:
+        import openpyxl
+    except ImportError:
         raise HTTPException(
             status_code=500,
             detail="Excel import not available (openpyxl not installed on server)."
@@ -953,6 +857,12 @@ def _rows_from_xlsx(data: bytes) -> list[dict]:
     return rows
 
 
+_IMPORT_COLUMNS = (
+    "name", "size_label", "type_label", "tag", "note",
+    "system_number", "shelf", "clearance_level", "added_by",
+)
+
+
 @app.post("/api/import_file")
 def import_file(
     request: Request,
@@ -991,54 +901,62 @@ def import_file(
             "errors": ["No rows detected in file."]
         }
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.execute("PRAGMA synchronous = NORMAL;")
-
     inserted = 0
     failed = 0
     errors: list[dict] = []
 
-    try:
-        cur = conn.cursor()
-        for idx, raw_row in enumerate(rows_raw, start=2):
-            try:
-                cleaned = _validate_and_normalize_row(raw_row)
-
-                cur.execute(
-                    """
-                    INSERT INTO files
-                    (name, size_label, type_label, tag, note,
-                     system_number, shelf, clearance_level, added_by)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        cleaned["name"],
-                        cleaned["size_label"],
-                        cleaned["type_label"],
-                        cleaned["tag"],
-                        cleaned["note"],
-                        cleaned["system_number"],
-                        cleaned["shelf"],
-                        cleaned["clearance_level"],
-                        cleaned["added_by"],
-                    ),
-                )
-                inserted += 1
-
-            except Exception as e:
-                failed += 1
-                errors.append({
-                    "row": idx,
-                    "error": str(e),
-                    "data": raw_row
-                })
-
-        conn.commit()
-
-    finally:
-        conn.close()
+    valid: list[tuple] = []
+    for idx, raw_row in enumerate(rows_raw, start=2):
+        try:
+            cleaned = _validate_and_normalize_row(raw_row)
+            valid.append((idx, raw_row, tuple(cleaned[c] for c in _IMPORT_COLUMNS)))
+        except Exception as e:
+            failed += 1
+            errors.append({
+                "row": idx,
+                "error": str(e),
+                "data": raw_row
+            })
+
+    if valid and db.BACKEND.bulk_copy:
+        # Postgres: one COPY for the whole file; if a row trips a constraint
+        # fall through to row-by-row so the others still get in
+        try:
+            inserted = db.BACKEND.copy_rows("files", _IMPORT_COLUMNS, [v for _, _, v in valid])
+            valid = []
+        except db.IntegrityError:
+            pass
+
+    if valid:
+        conn = db._connect()
+        try:
+            cur = conn.cursor()
+            for idx, raw_row, values in valid:
+                try:
+                    cur.execute(
+                        f"""
+                        INSERT INTO files ({", ".join(_IMPORT_COLUMNS)})
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        values,
+                    )
+                    inserted += 1
+
+                except Exception as e:
+                    failed += 1
+                    errors.append({
+                        "row": idx,
+                        "error": str(e),
+                        "data": raw_row
+                    })
+
+            conn.commit()
+
+        finally:
+            conn.close()
+
+    if inserted:
+        housekeeping.request("analyze", "import_file")
 
     return {
         "imported": inserted,
@@ -1069,7 +987,7 @@ def _export_files_csv() -> io.StringIO:
     FROM files
     ORDER BY created_at DESC
     """
-    rows = db_read(sql)
+    rows = replica.read(sql, stream=True)
 
     buf = io.StringIO()
     writer = csv.writer(buf)
@@ -1113,8 +1031,7 @@ def _export_files_csv() -> io.StringIO:
     return buf
 
 def _export_checkouts_csv() -> io.StringIO:
-    sql = """
-    SELECT
+    cols = """
         id,
         file_id,
         holder_name,
@@ -1122,10 +1039,23 @@ def _export_checkouts_csv() -> io.StringIO:
         return_at,
         operator_name,
         note
-    FROM checkouts
-    ORDER BY checkout_at DESC
     """
-    rows = db_read(sql)
+    if archive.archive_has_rows():
+        # a replica taken before the last archiver run can still have the
+        # moved rows in checkouts, so don't count them twice
+        rows = replica.read(f"""
+        SELECT {cols} FROM main.checkouts
+        UNION ALL
+        SELECT {cols} FROM {archive.archive_table()} a
+        WHERE NOT EXISTS (SELECT 1 FROM main.checkouts c WHERE c.id = a.id)
+        ORDER BY checkout_at DESC
+        """, with_archive=True)
+    else:
+        rows = replica.read(f"""
+        SELECT {cols}
+        FROM checkouts
+        ORDER BY checkout_at DESC
+        """, stream=True)
 
     buf = io.StringIO()
     writer = csv.writer(buf)
@@ -1240,7 +1170,7 @@ def file_stats(request: Request):
     # - admin: sees all 3 numbers
     # - viewer/guest: sees only active + total_active (same number twice effectively)
 
-    rows = db_read("""
+    rows = replica.read("""
         SELECT
           SUM(CASE WHEN is_deleted = 0 THEN 1 ELSE 0 END) AS active_count,
           SUM(CASE WHEN is_deleted = 1 THEN 1 ELSE 0 END) AS archived_count,
@@ -1262,7 +1192,6 @@ def file_stats(request: Request):
     return stats
 
 
-innitDB()
 
 @app.get("/")
 def root():
@@ -1271,8 +1200,36 @@ def root():
 
 
 app.include_router(items_router)
+app.include_router(movements_router)
+app.include_router(reconcile.router)
+app.include_router(locations.router)
+app.include_router(orders.router)
+app.include_router(checkouts_router)
+app.include_router(analytics.router)
 app.include_router(maintenance_router)
 app.include_router(auth_router)
 app.include_router(settings_router)
+app.include_router(profiling_router)
+app.include_router(admission.router)
+
+# these work on the SQLite file itself (EXPLAIN QUERY PLAN, ATTACH, backup API, PRAGMAs)
+if db.is_sqlite():
+    app.include_router(advisor_router)
+    app.include_router(archive.router)
+    app.include_router(replica.router)
+    app.include_router(housekeeping.router)
+    app.include_router(backup.router)
+
+@app.on_event("startup")
+def _warm_caches():
+    db.warm_location_cache()
+
+
+if housekeeping.IN_APP:
+    @app.on_event("startup")
+    def _start_housekeeping():
+        housekeeping.start_in_app()
+
+app.mount("/app", StaticFiles(directory="/Users/rushilb/Desktop/DBMS/Frontend", html=True, check_dir=False), name="FrontEnd")
 
-app.mount("/app", StaticFiles(directory="/Users/rushilb/Desktop/DBMS/Frontend", html=True), name="FrontEnd")
+migrations.startup_report(_import_started, migrations.migrate())
@@ -0,0 +1,1912 @@
+# migrations.py
+"""
+Versioned schema migrations.
+
+Each migration is (version, name, fn(conn)), applied in order. The current
+version lives in the database header (PRAGMA user_version), so the startup
+check is one header read with no lock; only when the file is behind do we
+take the write lock (BEGIN IMMEDIATE), re-check, and run what's missing.
+Every applied step is logged in `schema_version` with how long it took.
+
+Migrations are written to be safe on databases that already have the tables
+(every database created before this module existed starts at version 0 but
+has most of the schema), so they use IF NOT EXISTS / column checks.
+
+Each migration also carries its Postgres body (PG_* next to the SQLite one).
+storage.PostgresBackend.migrate applies the missing ones in order, in one
+transaction under an advisory lock, and records them in the same
+`schema_version` table. A Postgres database from before that starts at 0;
+the bodies are idempotent, so it is brought up to date without losing rows.
+
+To change the schema, append a migration with both bodies; never edit one
+that has shipped.
+
+    python migrations.py            # migrate FMS_DB_PATH
+    python migrations.py --status
+"""
+import argparse
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import db
+
+STARTUP_BUDGET_MS = float(os.getenv("FMS_STARTUP_BUDGET_MS", "1500"))
+
+
+def _run_script(conn: sqlite3.Connection, script: str) -> None:
+    """executescript() without its implicit COMMIT, so a migration stays inside our transaction."""
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            conn.execute(stmt)
+            stmt = ""
+    leftover = [l for l in stmt.splitlines() if l.strip() and not l.strip().startswith("--")]
+    if leftover:
+        raise ValueError(f"Incomplete SQL statement at end of script: {leftover[0]!r}")
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set:
+    return {r[1] for r in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+# --------------------------------------------------------------------------
+# 1: files + checkouts (what innitDB used to run on every import)
+# --------------------------------------------------------------------------
+
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+  id                INTEGER PRIMARY KEY AUTOINCREMENT,
+  name              TEXT NOT NULL,
+  size_label        TEXT,
+  type_label        TEXT,
+  tag               TEXT,
+  note              TEXT,
+
+  system_number     TEXT NOT NULL,
+  shelf             TEXT NOT NULL,
+
+  clearance_level   INTEGER NOT NULL CHECK (clearance_level BETWEEN 1 AND 4),
+
+  added_by          TEXT NOT NULL DEFAULT 'admin',
+  created_at        TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  updated_at        TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  deleted_at        TEXT,
+  is_deleted        INTEGER NOT NULL DEFAULT 0 CHECK (is_deleted IN (0,1))
+);
+
+CREATE INDEX IF NOT EXISTS idx_files_name       ON files(name);
+CREATE INDEX IF NOT EXISTS idx_files_location   ON files(system_number, shelf);
+CREATE INDEX IF NOT EXISTS idx_files_clearance  ON files(clearance_level);
+CREATE INDEX IF NOT EXISTS idx_files_is_deleted ON files(is_deleted);
+CREATE INDEX IF NOT EXISTS idx_files_active_name ON files(is_deleted, name);
+CREATE INDEX IF NOT EXISTS idx_files_created_at ON files(created_at);
+
+-- CHECKOUTS (movement log)
+
+CREATE TABLE IF NOT EXISTS checkouts (
+  id             INTEGER PRIMARY KEY AUTOINCREMENT,
+  file_id        INTEGER NOT NULL,
+  holder_name    TEXT NOT NULL,
+  checkout_at    TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  return_at      TEXT,
+  operator_name  TEXT NOT NULL DEFAULT 'admin',
+  note           TEXT,
+  -- Timeline guard: return cannot predate checkout
+  CHECK (return_at IS NULL OR return_at >= checkout_at),
+  FOREIGN KEY (file_id) REFERENCES files(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_checkouts_file_return    ON checkouts(file_id, return_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_checkout_at    ON checkouts(checkout_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_return_at      ON checkouts(return_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_file_checkout_at ON checkouts(file_id, checkout_at DESC);
+
+CREATE UNIQUE INDEX IF NOT EXISTS oneCheckoutPerFile
+ON checkouts(file_id)
+WHERE return_at IS NULL;
+
+DROP TRIGGER IF EXISTS trg_checkouts_return_after_checkout;
+CREATE TRIGGER IF NOT EXISTS trg_checkouts_return_after_checkout
+BEFORE UPDATE OF return_at ON checkouts
+FOR EACH ROW
+WHEN NEW.return_at IS NOT NULL AND NEW.return_at < NEW.checkout_at
+BEGIN
+  SELECT RAISE(ABORT, 'return_at cannot be earlier than checkout_at');
+END;
+
+-- DERIVED STATUS VIEW
+
+CREATE VIEW IF NOT EXISTS file_status AS
+SELECT
+  f.id AS file_id,
+  f.name,
+  f.system_number,
+  f.shelf,
+  f.clearance_level,
+  f.is_deleted,
+  (
+    SELECT c.holder_name
+    FROM checkouts c
+    WHERE c.file_id = f.id AND c.return_at IS NULL
+    ORDER BY c.checkout_at DESC
+    LIMIT 1
+  ) AS currently_held_by,
+  (
+    SELECT c.checkout_at
+    FROM checkouts c
+    WHERE c.file_id = f.id AND c.return_at IS NULL
+    ORDER BY c.checkout_at DESC
+    LIMIT 1
+  ) AS date_of_checkout,
+  (
+    SELECT c2.checkout_at
+    FROM checkouts c2
+    WHERE c2.file_id = f.id AND c2.return_at IS NOT NULL
+    ORDER BY c2.checkout_at DESC
+    LIMIT 1
+  ) AS date_of_previous_checkout
+FROM files f;
+
+-- LAST 10 CHECKOUTS PER FILE (ranked window)
+
+DROP VIEW IF EXISTS file_last_10_access;
+CREATE VIEW IF NOT EXISTS file_last_10_access AS
+WITH ranked AS (
+  SELECT
+    c.file_id,
+    c.holder_name,
+    c.checkout_at,
+    ROW_NUMBER() OVER (
+      PARTITION BY c.file_id
+      ORDER BY c.checkout_at DESC
+    ) AS rn
+  FROM checkouts c
+)
+SELECT file_id, holder_name, checkout_at
+FROM ranked
+WHERE rn <= 10
+ORDER BY file_id, checkout_at DESC;
+
+-- SOFT DELETE GUARD
+
+DROP TRIGGER IF EXISTS trg_filesSoftDeleteBlocksOpenCheckout;
+CREATE TRIGGER IF NOT EXISTS trg_filesSoftDeleteBlocksOpenCheckout
+BEFORE UPDATE OF is_deleted ON files
+FOR EACH ROW
+WHEN NEW.is_deleted = 1
+AND EXISTS (
+  SELECT 1 FROM checkouts c
+  WHERE c.file_id = NEW.id AND c.return_at IS NULL
+)
+BEGIN
+  SELECT RAISE(ABORT, 'Cannot soft-delete a file with an open checkout. Return it first.');
+END;
+"""
+
+
+def _m001_base(conn):
+    _run_script(conn, BASE_SCHEMA)
+
+
+def _m001_auto_vacuum(conn):
+    """
+    Run by migrate() ahead of migration 1, on a file with no tables yet: make
+    it auto_vacuum=INCREMENTAL so housekeeping's vacuum task can hand free
+    pages back. The pragma is ignored inside a transaction and once a table
+    exists, and after the header is written (our own switch to WAL, or an app
+    connection that got there first) it only takes with a VACUUM, which on an
+    empty file is instant. Older databases need housekeeping's one-off
+    enable-incremental-vacuum instead.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+PG_BASE_SCHEMA = """
+CREATE OR REPLACE FUNCTION fms_now() RETURNS text LANGUAGE sql STABLE AS $$
+  SELECT to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS')
+$$;
+
+CREATE TABLE IF NOT EXISTS files (
+  id                BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  name              TEXT NOT NULL,
+  size_label        TEXT,
+  type_label        TEXT,
+  tag               TEXT,
+  note              TEXT,
+  system_number     TEXT NOT NULL,
+  shelf             TEXT NOT NULL,
+  clearance_level   INTEGER NOT NULL CHECK (clearance_level BETWEEN 1 AND 4),
+  added_by          TEXT NOT NULL DEFAULT 'admin',
+  created_at        TEXT NOT NULL DEFAULT fms_now(),
+  updated_at        TEXT NOT NULL DEFAULT fms_now(),
+  deleted_at        TEXT,
+  is_deleted        INTEGER NOT NULL DEFAULT 0 CHECK (is_deleted IN (0,1))
+);
+
+CREATE INDEX IF NOT EXISTS idx_files_name        ON files(name);
+CREATE INDEX IF NOT EXISTS idx_files_location    ON files(system_number, shelf);
+CREATE INDEX IF NOT EXISTS idx_files_created_at  ON files(created_at);
+
+CREATE TABLE IF NOT EXISTS checkouts (
+  id                BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  file_id           BIGINT NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  holder_name       TEXT NOT NULL,
+  checkout_at       TEXT NOT NULL DEFAULT fms_now(),
+  return_at         TEXT,
+  operator_name     TEXT NOT NULL DEFAULT 'admin',
+  note              TEXT,
+  CHECK (return_at IS NULL OR return_at >= checkout_at)
+);
+
+CREATE INDEX IF NOT EXISTS idx_checkouts_file_return      ON checkouts(file_id, return_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_checkout_at      ON checkouts(checkout_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_return_at        ON checkouts(return_at);
+CREATE INDEX IF NOT EXISTS idx_checkouts_file_checkout_at ON checkouts(file_id, checkout_at DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS oneCheckoutPerFile ON checkouts(file_id) WHERE return_at IS NULL;
+
+CREATE OR REPLACE VIEW file_status AS
+SELECT
+  f.id AS file_id, f.name, f.system_number, f.shelf, f.clearance_level, f.is_deleted,
+  (SELECT c.holder_name FROM checkouts c
+    WHERE c.file_id = f.id AND c.return_at IS NULL ORDER BY c.checkout_at DESC LIMIT 1) AS currently_held_by,
+  (SELECT c.checkout_at FROM checkouts c
+    WHERE c.file_id = f.id AND c.return_at IS NULL ORDER BY c.checkout_at DESC LIMIT 1) AS date_of_checkout,
+  (SELECT c2.checkout_at FROM checkouts c2
+    WHERE c2.file_id = f.id AND c2.return_at IS NOT NULL ORDER BY c2.checkout_at DESC LIMIT 1) AS date_of_previous_checkout
+FROM files f;
+
+CREATE OR REPLACE VIEW file_last_10_access AS
+WITH ranked AS (
+  SELECT c.file_id, c.holder_name, c.checkout_at,
+         ROW_NUMBER() OVER (PARTITION BY c.file_id ORDER BY c.checkout_at DESC) AS rn
+  FROM checkouts c
+)
+SELECT file_id, holder_name, checkout_at FROM ranked WHERE rn <= 10 ORDER BY file_id, checkout_at DESC;
+
+CREATE OR REPLACE FUNCTION fms_files_soft_delete_guard() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.is_deleted = 1 AND EXISTS (
+    SELECT 1 FROM checkouts c WHERE c.file_id = NEW.id AND c.return_at IS NULL
+  ) THEN
+    RAISE EXCEPTION 'Cannot soft-delete a file with an open checkout. Return it first.'
+      USING ERRCODE = 'integrity_constraint_violation';   -- IntegrityError, as on SQLite
+  END IF;
+  RETURN NEW;
+END $$;
+DROP TRIGGER IF EXISTS trg_filesSoftDeleteBlocksOpenCheckout ON files;
+CREATE TRIGGER trg_filesSoftDeleteBlocksOpenCheckout
+  BEFORE UPDATE OF is_deleted ON files
+  FOR EACH ROW EXECUTE FUNCTION fms_files_soft_delete_guard();
+"""
+
+
+# --------------------------------------------------------------------------
+# 2: overdue tracking columns on checkouts (was devfile.execute)
+# --------------------------------------------------------------------------
+
+def _m002_checkout_due(conn):
+    have = _columns(conn, "checkouts")
+    for col, decl in (("max_checkout_time", "INTEGER"),   # in minutes
+                      ("due_at", "TEXT"),                 # ISO string (UTC)
+                      ("notified_at", "TEXT")):           # null until emailed
+        if col not in have:
+            conn.execute(f"ALTER TABLE checkouts ADD COLUMN {col} {decl}")
+
+
+PG_CHECKOUT_DUE = """
+ALTER TABLE checkouts ADD COLUMN IF NOT EXISTS max_checkout_time INTEGER;
+ALTER TABLE checkouts ADD COLUMN IF NOT EXISTS due_at TEXT;
+ALTER TABLE checkouts ADD COLUMN IF NOT EXISTS notified_at TEXT;
+"""
+
+
+# --------------------------------------------------------------------------
+# 3: users + settings
+# --------------------------------------------------------------------------
+
+USERS_SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL CHECK(role IN ('admin','user')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    active INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  admin_email TEXT NOT NULL,
+  reminder_freq_minutes INTEGER NOT NULL DEFAULT 180,
+  created_at TEXT DEFAULT (datetime('now')),
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+INSERT OR IGNORE INTO settings (id, admin_email, reminder_freq_minutes)
+VALUES (1, 'homeofcreativechaos@gmail.com', 180);
+"""
+
+
+def _m003_users_settings(conn):
+    _run_script(conn, USERS_SETTINGS_SCHEMA)
+
+
+PG_USERS_SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+  id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  email          TEXT UNIQUE NOT NULL,
+  password_hash  TEXT NOT NULL,
+  role           TEXT NOT NULL CHECK (role IN ('admin','user')),
+  created_at     TEXT DEFAULT fms_now(),
+  active         INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+
+CREATE TABLE IF NOT EXISTS settings (
+  id                    INTEGER PRIMARY KEY CHECK (id = 1),
+  admin_email           TEXT NOT NULL,
+  reminder_freq_minutes INTEGER NOT NULL DEFAULT 180,
+  created_at            TEXT DEFAULT fms_now(),
+  updated_at            TEXT DEFAULT fms_now()
+);
+INSERT INTO settings (id, admin_email, reminder_freq_minutes)
+VALUES (1, 'homeofcreativechaos@gmail.com', 180)
+ON CONFLICT DO NOTHING;
+"""
+
+
+# --------------------------------------------------------------------------
+# 4: inventory (was devfile.exec1, run on every devfile import)
+# --------------------------------------------------------------------------
+
+INVENTORY_SCHEMA = """
+-- 1) Core tables
+CREATE TABLE IF NOT EXISTS locations (
+  id             INTEGER PRIMARY KEY,
+  system_number  TEXT,
+  shelf          TEXT,
+  aisle          TEXT,
+  rack           TEXT,
+  bin            TEXT,
+  UNIQUE(system_number, shelf)
+);
+
+CREATE TABLE IF NOT EXISTS items (
+  id               INTEGER PRIMARY KEY,
+  sku              TEXT UNIQUE,
+  name             TEXT NOT NULL,
+  category         TEXT,
+  unit             TEXT DEFAULT 'units',
+  quantity         INTEGER NOT NULL DEFAULT 0,
+  height_mm        REAL,
+  width_mm         REAL,
+  depth_mm         REAL,
+  location_id      INTEGER REFERENCES locations(id) ON DELETE SET NULL,
+  tag              TEXT,
+  note             TEXT,
+  clearance_level  INTEGER,
+  added_by         TEXT,
+  created_at       TEXT DEFAULT (datetime('now')),
+  updated_at       TEXT DEFAULT (datetime('now')),
+  is_deleted       INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS movements (
+  id               INTEGER PRIMARY KEY,
+  item_id          INTEGER NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+  movement_type    TEXT NOT NULL CHECK (movement_type IN ('in','out','adjust','transfer')),
+  quantity         INTEGER NOT NULL,
+  operator_name    TEXT,
+  from_location_id INTEGER REFERENCES locations(id),
+  to_location_id   INTEGER REFERENCES locations(id),
+  timestamp        TEXT NOT NULL DEFAULT (datetime('now')),
+  note             TEXT
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+  id               INTEGER PRIMARY KEY,
+  supplier_name    TEXT,
+  status           TEXT NOT NULL CHECK(status IN ('draft','placed','partial','received','cancelled')) DEFAULT 'draft',
+  created_at       TEXT NOT NULL DEFAULT (datetime('now')),
+  expected_arrival TEXT
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+  id                INTEGER PRIMARY KEY,
+  order_id          INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+  item_id           INTEGER NOT NULL REFERENCES items(id)  ON DELETE CASCADE,
+  quantity_ordered  INTEGER NOT NULL,
+  quantity_received INTEGER NOT NULL DEFAULT 0
+);
+
+-- 2) Seed locations from existing files (safe if rerun)
+INSERT OR IGNORE INTO locations(system_number, shelf)
+SELECT DISTINCT system_number, shelf
+FROM files
+WHERE system_number IS NOT NULL AND shelf IS NOT NULL;
+
+-- 3) Seed items 1:1 from files, keeping IDs aligned (only if not present)
+INSERT INTO items(
+  id, name, tag, note, clearance_level, added_by,
+  created_at, updated_at, is_deleted, location_id
+)
+SELECT
+  f.id, f.name, f.tag, f.note, f.clearance_level, f.added_by,
+  f.created_at, COALESCE(f.updated_at, f.created_at), f.is_deleted,
+  (SELECT l.id FROM locations l
+     WHERE l.system_number = f.system_number AND l.shelf = f.shelf
+     LIMIT 1)
+FROM files f
+WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = f.id);
+
+-- 4) Compatibility view for old code paths
+DROP VIEW IF EXISTS files_v;
+CREATE VIEW files_v AS
+SELECT
+  i.id,
+  i.name,
+  NULL AS size_label,
+  NULL AS type_label,
+  i.tag,
+  i.note,
+  l.system_number,
+  l.shelf,
+  i.clearance_level,
+  i.added_by,
+  i.created_at,
+  i.updated_at,
+  i.is_deleted
+FROM items i
+LEFT JOIN locations l ON l.id = i.location_id;
+
+-- 5) Quantity bookkeeping on movements
+CREATE TRIGGER IF NOT EXISTS trg_movements_ai
+AFTER INSERT ON movements
+BEGIN
+  UPDATE items
+     SET quantity = quantity + NEW.quantity,
+         updated_at = datetime('now')
+   WHERE id = NEW.item_id;
+END;
+
+-- 6) Helpful indexes (optional but recommended)
+CREATE INDEX IF NOT EXISTS idx_items_location   ON items(location_id);
+CREATE INDEX IF NOT EXISTS idx_movements_item   ON movements(item_id);
+CREATE INDEX IF NOT EXISTS idx_locations_combo  ON locations(system_number, shelf);
+CREATE INDEX IF NOT EXISTS idx_orders_status    ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON order_items(order_id);
+"""
+
+
+def _m004_inventory(conn):
+    _run_script(conn, INVENTORY_SCHEMA)
+
+
+# no seeding from files here: a Postgres database starts empty
+PG_INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+  id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  system_number  TEXT,
+  shelf          TEXT,
+  aisle          TEXT,
+  rack           TEXT,
+  bin            TEXT,
+  UNIQUE (system_number, shelf)
+);
+
+CREATE TABLE IF NOT EXISTS items (
+  id               BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  sku              TEXT UNIQUE,
+  name             TEXT NOT NULL,
+  category         TEXT,
+  unit             TEXT DEFAULT 'units',
+  quantity         INTEGER NOT NULL DEFAULT 0,
+  height_mm        DOUBLE PRECISION,
+  width_mm         DOUBLE PRECISION,
+  depth_mm         DOUBLE PRECISION,
+  location_id      BIGINT REFERENCES locations(id) ON DELETE SET NULL,
+  tag              TEXT,
+  note             TEXT,
+  clearance_level  INTEGER,
+  added_by         TEXT,
+  created_at       TEXT DEFAULT fms_now(),
+  updated_at       TEXT DEFAULT fms_now(),
+  is_deleted       INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS movements (
+  id               BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  item_id          BIGINT NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+  movement_type    TEXT NOT NULL CHECK (movement_type IN ('in','out','adjust','transfer')),
+  quantity         INTEGER NOT NULL,
+  operator_name    TEXT,
+  from_location_id BIGINT REFERENCES locations(id),
+  to_location_id   BIGINT REFERENCES locations(id),
+  timestamp        TEXT NOT NULL DEFAULT fms_now(),
+  note             TEXT
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+  id               BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  supplier_name    TEXT,
+  status           TEXT NOT NULL DEFAULT 'draft'
+                   CHECK (status IN ('draft','placed','partial','received','cancelled')),
+  created_at       TEXT NOT NULL DEFAULT fms_now(),
+  expected_arrival TEXT
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+  id                BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  order_id          BIGINT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+  item_id           BIGINT NOT NULL REFERENCES items(id) ON DELETE CASCADE,
+  quantity_ordered  INTEGER NOT NULL,
+  quantity_received INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE VIEW files_v AS
+SELECT i.id, i.name, NULL AS size_label, NULL AS type_label, i.tag, i.note,
+       l.system_number, l.shelf, i.clearance_level, i.added_by,
+       i.created_at, i.updated_at, i.is_deleted
+FROM items i
+LEFT JOIN locations l ON l.id = i.location_id;
+
+CREATE OR REPLACE FUNCTION fms_movements_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE items SET quantity = quantity + NEW.quantity, updated_at = fms_now()
+  WHERE id = NEW.item_id;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_movements_ai ON movements;
+CREATE TRIGGER trg_movements_ai
+  AFTER INSERT ON movements
+  FOR EACH ROW EXECUTE FUNCTION fms_movements_apply();
+
+CREATE INDEX IF NOT EXISTS idx_items_location   ON items(location_id);
+CREATE INDEX IF NOT EXISTS idx_movements_item   ON movements(item_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status    ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON order_items(order_id);
+"""
+
+
+# --------------------------------------------------------------------------
+# 5: list_files sort keys
+# --------------------------------------------------------------------------
+
+# characters a location label may start with before its first number ("C03", "SYS-001")
+_LABEL_PREFIX_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz -_./#"
+
+
+def _natural_key_sql(col: str) -> str:
+    """
+    SQL expression turning a label into a natural-order sort key:
+    lowercase prefix + first number zero-padded to 10 digits + lowercase rest.
+    So "2b" < "10a" and "C3" < "C12", which plain text order gets wrong.
+    """
+    rest = f"LTRIM({col}, '{_LABEL_PREFIX_CHARS}')"
+    return (
+        f"LOWER(SUBSTR({col}, 1, LENGTH({col}) - LENGTH({rest})))"
+        f" || CASE WHEN {rest} GLOB '[0-9]*' THEN printf('%010d', CAST({rest} AS INTEGER)) ELSE '' END"
+        f" || LOWER(LTRIM({rest}, '0123456789'))"
+    )
+
+
+def _last_movement_sql(file_id: str) -> str:
+    # same rule as last_movement_ts in list_files: open checkout time, else the latest return
+    return f"""COALESCE(
+            (SELECT c.checkout_at FROM checkouts c
+              WHERE c.file_id = {file_id} AND c.return_at IS NULL
+              ORDER BY c.checkout_at DESC LIMIT 1),
+            (SELECT c.return_at FROM checkouts c
+              WHERE c.file_id = {file_id} AND c.return_at IS NOT NULL
+              ORDER BY c.checkout_at DESC LIMIT 1)
+          )"""
+
+
+def _ensure_sort_keys(conn: sqlite3.Connection) -> None:
+    """
+    Sort keys for every list_files sort option, each with an
+    (is_deleted, key, id) index so a page is an index range scan + LIMIT:
+      - name_key / location_key: virtual generated columns (casefolded / natural order)
+      - last_movement_at: kept current by triggers on checkouts
+    """
+    cols = {r[1] for r in conn.execute("PRAGMA table_xinfo(files)")}
+    if "name_key" not in cols:
+        conn.execute("ALTER TABLE files ADD COLUMN name_key TEXT GENERATED ALWAYS AS (LOWER(name)) VIRTUAL")
+    if "location_key" not in cols:
+        conn.execute(
+            "ALTER TABLE files ADD COLUMN location_key TEXT GENERATED ALWAYS AS ("
+            + _natural_key_sql("system_number") + " || char(1) || " + _natural_key_sql("shelf")
+            + ") VIRTUAL"
+        )
+    if "last_movement_at" not in cols:
+        conn.execute("ALTER TABLE files ADD COLUMN last_movement_at TEXT")
+        conn.execute(f"UPDATE files SET last_movement_at = {_last_movement_sql('files.id')}")
+
+    _run_script(conn, f"""
+        CREATE INDEX IF NOT EXISTS idx_files_sort_name      ON files(is_deleted, name_key, id);
+        CREATE INDEX IF NOT EXISTS idx_files_sort_location  ON files(is_deleted, location_key, id);
+        CREATE INDEX IF NOT EXISTS idx_files_sort_created   ON files(is_deleted, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_files_sort_updated   ON files(is_deleted, updated_at, id);
+        CREATE INDEX IF NOT EXISTS idx_files_sort_clearance ON files(is_deleted, clearance_level, id);
+        CREATE INDEX IF NOT EXISTS idx_files_sort_movement  ON files(is_deleted, last_movement_at, id);
+
+        CREATE TRIGGER IF NOT EXISTS trg_checkouts_last_movement_ai
+        AFTER INSERT ON checkouts
+        BEGIN
+          UPDATE files SET last_movement_at = {_last_movement_sql('NEW.file_id')}
+          WHERE id = NEW.file_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_checkouts_last_movement_au
+        AFTER UPDATE OF checkout_at, return_at ON checkouts
+        BEGIN
+          UPDATE files SET last_movement_at = {_last_movement_sql('NEW.file_id')}
+          WHERE id = NEW.file_id;
+        END;
+    """)
+
+
+def _m005_sort_keys(conn):
+    _ensure_sort_keys(conn)
+
+
+# stored, not virtual: Postgres has no virtual generated columns
+PG_SORT_KEYS = """
+-- natural-order sort key, same rule as _natural_key_sql
+CREATE OR REPLACE FUNCTION fms_natural_key(s text) RETURNS text LANGUAGE sql IMMUTABLE AS $$
+  SELECT lower(substring(s from '^[A-Za-z _./#-]*'))
+      || COALESCE(lpad(ltrim(substring(s from '^[A-Za-z _./#-]*([0-9]+)'), '0'), 10, '0'), '')
+      || lower(COALESCE(substring(s from '^[A-Za-z _./#-]*[0-9]*(.*)$'), ''))
+$$;
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS name_key TEXT GENERATED ALWAYS AS (lower(name)) STORED;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS location_key TEXT
+  GENERATED ALWAYS AS (fms_natural_key(system_number) || chr(1) || fms_natural_key(shelf)) STORED;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS last_movement_at TEXT;
+
+CREATE OR REPLACE FUNCTION fms_last_movement(fid BIGINT) RETURNS text LANGUAGE sql STABLE AS $$
+  SELECT COALESCE(
+    (SELECT c.checkout_at FROM checkouts c
+      WHERE c.file_id = fid AND c.return_at IS NULL ORDER BY c.checkout_at DESC LIMIT 1),
+    (SELECT c.return_at FROM checkouts c
+      WHERE c.file_id = fid AND c.return_at IS NOT NULL ORDER BY c.checkout_at DESC LIMIT 1))
+$$;
+UPDATE files SET last_movement_at = fms_last_movement(id)
+WHERE last_movement_at IS DISTINCT FROM fms_last_movement(id);
+
+CREATE INDEX IF NOT EXISTS idx_files_sort_name      ON files(is_deleted, name_key, id);
+CREATE INDEX IF NOT EXISTS idx_files_sort_location  ON files(is_deleted, location_key, id);
+CREATE INDEX IF NOT EXISTS idx_files_sort_created   ON files(is_deleted, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_files_sort_updated   ON files(is_deleted, updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_files_sort_clearance ON files(is_deleted, clearance_level, id);
+CREATE INDEX IF NOT EXISTS idx_files_sort_movement  ON files(is_deleted, last_movement_at, id);
+
+CREATE OR REPLACE FUNCTION fms_checkouts_last_movement() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE files SET last_movement_at = fms_last_movement(NEW.file_id) WHERE id = NEW.file_id;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_checkouts_last_movement_ai ON checkouts;
+CREATE TRIGGER trg_checkouts_last_movement_ai
+  AFTER INSERT ON checkouts
+  FOR EACH ROW EXECUTE FUNCTION fms_checkouts_last_movement();
+DROP TRIGGER IF EXISTS trg_checkouts_last_movement_au ON checkouts;
+CREATE TRIGGER trg_checkouts_last_movement_au
+  AFTER UPDATE OF checkout_at, return_at ON checkouts
+  FOR EACH ROW EXECUTE FUNCTION fms_checkouts_last_movement();
+"""
+
+
+# --------------------------------------------------------------------------
+# 6: housekeeping bookkeeping
+# --------------------------------------------------------------------------
+
+HOUSEKEEPING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+  id              INTEGER PRIMARY KEY AUTOINCREMENT,
+  task            TEXT NOT NULL,
+  started_at      TEXT NOT NULL,
+  duration_ms     REAL NOT NULL,
+  bytes_reclaimed INTEGER NOT NULL DEFAULT 0,
+  ok              INTEGER NOT NULL DEFAULT 1,
+  detail          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_maintenance_runs_task_started
+  ON maintenance_runs(task, started_at);
+
+CREATE TABLE IF NOT EXISTS maintenance_requests (
+  task         TEXT PRIMARY KEY,
+  requested_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  reason       TEXT
+);
+"""
+
+
+def _m006_housekeeping(conn):
+    _run_script(conn, HOUSEKEEPING_SCHEMA)
+
+
+# --------------------------------------------------------------------------
+# 7: batched movement posting
+# --------------------------------------------------------------------------
+# Rows posted through movements.post_batch carry a batch_id; the batch applies
+# one aggregated quantity update per item itself, so the per-row trigger skips
+# them. Transfers move stock between locations and leave the total alone.
+
+MOVEMENT_BATCHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movement_batches (
+  id           INTEGER PRIMARY KEY,
+  posted_by    TEXT,
+  posted_at    TEXT NOT NULL DEFAULT (datetime('now')),
+  lines        INTEGER NOT NULL,
+  accepted     INTEGER NOT NULL DEFAULT 0,
+  duration_ms  REAL
+);
+
+DROP TRIGGER IF EXISTS trg_movements_ai;
+CREATE TRIGGER trg_movements_ai
+AFTER INSERT ON movements
+WHEN NEW.batch_id IS NULL AND NEW.movement_type <> 'transfer'
+BEGIN
+  UPDATE items
+     SET quantity = quantity + NEW.quantity,
+         updated_at = datetime('now')
+   WHERE id = NEW.item_id;
+END;
+
+CREATE INDEX IF NOT EXISTS idx_movements_batch ON movements(batch_id) WHERE batch_id IS NOT NULL;
+"""
+
+
+def _m007_movement_batches(conn):
+    if "batch_id" not in _columns(conn, "movements"):
+        conn.execute("ALTER TABLE movements ADD COLUMN batch_id INTEGER REFERENCES movement_batches(id)")
+    _run_script(conn, MOVEMENT_BATCHES_SCHEMA)
+
+
+PG_MOVEMENT_BATCHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movement_batches (
+  id           BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  posted_by    TEXT,
+  posted_at    TEXT NOT NULL DEFAULT fms_now(),
+  lines        INTEGER NOT NULL,
+  accepted     INTEGER NOT NULL DEFAULT 0,
+  duration_ms  DOUBLE PRECISION
+);
+ALTER TABLE movements ADD COLUMN IF NOT EXISTS batch_id BIGINT REFERENCES movement_batches(id);
+CREATE INDEX IF NOT EXISTS idx_movements_batch ON movements(batch_id) WHERE batch_id IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION fms_movements_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.batch_id IS NULL AND NEW.movement_type <> 'transfer' THEN
+    UPDATE items SET quantity = quantity + NEW.quantity, updated_at = fms_now()
+    WHERE id = NEW.item_id;
+  END IF;
+  RETURN NULL;
+END $$;
+"""
+
+
+# --------------------------------------------------------------------------
+# 8: quantity checkpoints for as-of queries (ledger.py)
+# --------------------------------------------------------------------------
+
+QUANTITY_CHECKPOINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quantity_checkpoint_runs (
+  id               INTEGER PRIMARY KEY,
+  as_of            TEXT NOT NULL,
+  max_movement_id  INTEGER NOT NULL,
+  items            INTEGER NOT NULL DEFAULT 0,
+  created_at       TEXT NOT NULL DEFAULT (datetime('now')),
+  duration_ms      REAL
+);
+CREATE INDEX IF NOT EXISTS idx_quantity_checkpoint_runs_as_of ON quantity_checkpoint_runs(as_of);
+
+-- only non-zero quantities are stored; a missing item was at 0
+CREATE TABLE IF NOT EXISTS item_quantity_checkpoints (
+  run_id    INTEGER NOT NULL REFERENCES quantity_checkpoint_runs(id) ON DELETE CASCADE,
+  item_id   INTEGER NOT NULL,
+  quantity  INTEGER NOT NULL,
+  PRIMARY KEY (run_id, item_id)
+) WITHOUT ROWID;
+
+-- a line dated at or before an existing checkpoint is added into it
+DROP TRIGGER IF EXISTS trg_movements_checkpoints;
+CREATE TRIGGER trg_movements_checkpoints
+AFTER INSERT ON movements
+WHEN NEW.movement_type <> 'transfer'
+ AND NEW.timestamp <= (SELECT MAX(as_of) FROM quantity_checkpoint_runs)
+BEGIN
+  INSERT INTO item_quantity_checkpoints (run_id, item_id, quantity)
+  SELECT id, NEW.item_id, NEW.quantity FROM quantity_checkpoint_runs WHERE as_of >= NEW.timestamp
+  ON CONFLICT (run_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+END;
+
+-- tail replay: one item's movements in a time window / all movements in a window
+CREATE INDEX IF NOT EXISTS idx_movements_item_timestamp ON movements(item_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_timestamp ON movements(timestamp);
+"""
+
+
+def _m008_quantity_checkpoints(conn):
+    _run_script(conn, QUANTITY_CHECKPOINTS_SCHEMA)
+
+
+PG_QUANTITY_CHECKPOINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quantity_checkpoint_runs (
+  id               BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  as_of            TEXT NOT NULL,
+  max_movement_id  BIGINT NOT NULL,
+  items            INTEGER NOT NULL DEFAULT 0,
+  created_at       TEXT NOT NULL DEFAULT fms_now(),
+  duration_ms      DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS idx_quantity_checkpoint_runs_as_of ON quantity_checkpoint_runs(as_of);
+CREATE TABLE IF NOT EXISTS item_quantity_checkpoints (
+  run_id    BIGINT NOT NULL REFERENCES quantity_checkpoint_runs(id) ON DELETE CASCADE,
+  item_id   BIGINT NOT NULL,
+  quantity  INTEGER NOT NULL,
+  PRIMARY KEY (run_id, item_id)
+);
+CREATE OR REPLACE FUNCTION fms_movements_checkpoints() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF NEW.movement_type <> 'transfer'
+     AND NEW.timestamp <= (SELECT MAX(as_of) FROM quantity_checkpoint_runs) THEN
+    INSERT INTO item_quantity_checkpoints (run_id, item_id, quantity)
+    SELECT id, NEW.item_id, NEW.quantity FROM quantity_checkpoint_runs WHERE as_of >= NEW.timestamp
+    ON CONFLICT (run_id, item_id) DO UPDATE
+      SET quantity = item_quantity_checkpoints.quantity + excluded.quantity;
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_movements_checkpoints ON movements;
+CREATE TRIGGER trg_movements_checkpoints
+  AFTER INSERT ON movements
+  FOR EACH ROW EXECUTE FUNCTION fms_movements_checkpoints();
+CREATE INDEX IF NOT EXISTS idx_movements_item_timestamp ON movements(item_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_timestamp ON movements(timestamp);
+"""
+
+
+# --------------------------------------------------------------------------
+# 9: ledger reconciliation (reconcile.py)
+# --------------------------------------------------------------------------
+
+RECONCILE_SCHEMA = """
+-- high-water marks for jobs that walk a table incrementally
+CREATE TABLE IF NOT EXISTS job_watermarks (
+  name        TEXT PRIMARY KEY,
+  last_id     INTEGER NOT NULL DEFAULT 0,
+  last_ts     TEXT,
+  updated_at  TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+CREATE TABLE IF NOT EXISTS ledger_discrepancies (
+  id               INTEGER PRIMARY KEY,
+  found_at         TEXT NOT NULL DEFAULT (datetime('now')),
+  run_kind         TEXT NOT NULL CHECK (run_kind IN ('incremental','full')),
+  item_id          INTEGER NOT NULL,
+  cached_quantity  INTEGER NOT NULL,
+  ledger_quantity  INTEGER NOT NULL,
+  movement_id      INTEGER   -- the compensating adjust, if one was posted
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_discrepancies_item ON ledger_discrepancies(item_id);
+"""
+
+
+def _m009_reconcile(conn):
+    _run_script(conn, RECONCILE_SCHEMA)
+
+
+PG_RECONCILE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_watermarks (
+  name        TEXT PRIMARY KEY,
+  last_id     BIGINT NOT NULL DEFAULT 0,
+  last_ts     TEXT,
+  updated_at  TEXT NOT NULL DEFAULT fms_now()
+);
+CREATE TABLE IF NOT EXISTS ledger_discrepancies (
+  id               BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  found_at         TEXT NOT NULL DEFAULT fms_now(),
+  run_kind         TEXT NOT NULL CHECK (run_kind IN ('incremental','full')),
+  item_id          BIGINT NOT NULL,
+  cached_quantity  INTEGER NOT NULL,
+  ledger_quantity  INTEGER NOT NULL,
+  movement_id      BIGINT
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_discrepancies_item ON ledger_discrepancies(item_id);
+"""
+
+
+# --------------------------------------------------------------------------
+# 10: location occupancy rollups (locations.py)
+# --------------------------------------------------------------------------
+
+def _occupied_volume_sql(row: str) -> str:
+    # mm^3 an item takes up: its box times its quantity, and a catalogue entry
+    # with no stock count (files are quantity 0) still takes its own box
+    return (f"CAST(ROUND(COALESCE({row}.height_mm * {row}.width_mm * {row}.depth_mm, 0)) AS BIGINT)"
+            f" * (CASE WHEN {row}.quantity > 1 THEN {row}.quantity ELSE 1 END)")
+
+
+_OCCUPANCY_GUARD = "NOT EXISTS (SELECT 1 FROM rollup_guard WHERE name = 'occupancy')"
+
+
+def _occupancy_schema() -> str:
+    new_vol, old_vol = _occupied_volume_sql("NEW"), _occupied_volume_sql("OLD")
+    return f"""
+-- a row here suspends the occupancy triggers for the writing transaction;
+-- locations.suspend_rollups() adds it and rebuilds the rollups set-based at the end
+CREATE TABLE IF NOT EXISTS rollup_guard (name TEXT PRIMARY KEY);
+
+-- one row per location (a location is one system_number + shelf)
+CREATE TABLE IF NOT EXISTS location_occupancy (
+  location_id       INTEGER PRIMARY KEY,
+  system_number     TEXT NOT NULL DEFAULT '',
+  shelf             TEXT,
+  item_count        INTEGER NOT NULL DEFAULT 0,
+  total_quantity    INTEGER NOT NULL DEFAULT 0,
+  total_volume_mm3  INTEGER NOT NULL DEFAULT 0,
+  capacity_mm3      REAL,
+  fill_ratio        REAL GENERATED ALWAYS AS
+                      (CASE WHEN capacity_mm3 > 0 THEN total_volume_mm3 / capacity_mm3 END) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_fill     ON location_occupancy(fill_ratio);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_volume   ON location_occupancy(total_volume_mm3);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_quantity ON location_occupancy(total_quantity);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_system   ON location_occupancy(system_number, shelf);
+
+CREATE TABLE IF NOT EXISTS system_occupancy (
+  system_number     TEXT PRIMARY KEY,
+  location_count    INTEGER NOT NULL DEFAULT 0,
+  item_count        INTEGER NOT NULL DEFAULT 0,
+  total_quantity    INTEGER NOT NULL DEFAULT 0,
+  total_volume_mm3  INTEGER NOT NULL DEFAULT 0,
+  capacity_mm3      REAL NOT NULL DEFAULT 0,
+  fill_ratio        REAL GENERATED ALWAYS AS
+                      (CASE WHEN capacity_mm3 > 0 THEN total_volume_mm3 / capacity_mm3 END) STORED
+);
+
+-- items -> location_occupancy
+DROP TRIGGER IF EXISTS trg_items_occupancy_ai;
+CREATE TRIGGER trg_items_occupancy_ai
+AFTER INSERT ON items
+WHEN NEW.location_id IS NOT NULL AND NEW.is_deleted = 0 AND {_OCCUPANCY_GUARD}
+BEGIN
+  UPDATE location_occupancy
+     SET item_count = item_count + 1,
+         total_quantity = total_quantity + NEW.quantity,
+         total_volume_mm3 = total_volume_mm3 + {new_vol}
+   WHERE location_id = NEW.location_id;
+END;
+
+DROP TRIGGER IF EXISTS trg_items_occupancy_ad;
+CREATE TRIGGER trg_items_occupancy_ad
+AFTER DELETE ON items
+WHEN OLD.location_id IS NOT NULL AND OLD.is_deleted = 0 AND {_OCCUPANCY_GUARD}
+BEGIN
+  UPDATE location_occupancy
+     SET item_count = item_count - 1,
+         total_quantity = total_quantity - OLD.quantity,
+         total_volume_mm3 = total_volume_mm3 - {old_vol}
+   WHERE location_id = OLD.location_id;
+END;
+
+DROP TRIGGER IF EXISTS trg_items_occupancy_au;
+CREATE TRIGGER trg_items_occupancy_au
+AFTER UPDATE OF location_id, quantity, height_mm, width_mm, depth_mm, is_deleted ON items
+WHEN {_OCCUPANCY_GUARD}
+BEGIN
+  UPDATE location_occupancy
+     SET item_count = item_count - 1,
+         total_quantity = total_quantity - OLD.quantity,
+         total_volume_mm3 = total_volume_mm3 - {old_vol}
+   WHERE location_id = OLD.location_id AND OLD.is_deleted = 0;
+  UPDATE location_occupancy
+     SET item_count = item_count + 1,
+         total_quantity = total_quantity + NEW.quantity,
+         total_volume_mm3 = total_volume_mm3 + {new_vol}
+   WHERE location_id = NEW.location_id AND NEW.is_deleted = 0;
+END;
+
+-- locations -> location_occupancy (every location has a row, so empty shelves rank too)
+DROP TRIGGER IF EXISTS trg_locations_occupancy_ai;
+CREATE TRIGGER trg_locations_occupancy_ai
+AFTER INSERT ON locations
+BEGIN
+  INSERT OR IGNORE INTO location_occupancy (location_id, system_number, shelf, capacity_mm3)
+  VALUES (NEW.id, COALESCE(NEW.system_number, ''), NEW.shelf, NEW.capacity_mm3);
+END;
+
+DROP TRIGGER IF EXISTS trg_locations_occupancy_au;
+CREATE TRIGGER trg_locations_occupancy_au
+AFTER UPDATE OF system_number, shelf, capacity_mm3 ON locations
+BEGIN
+  UPDATE location_occupancy
+     SET system_number = COALESCE(NEW.system_number, ''), shelf = NEW.shelf, capacity_mm3 = NEW.capacity_mm3
+   WHERE location_id = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS trg_locations_occupancy_ad;
+CREATE TRIGGER trg_locations_occupancy_ad
+AFTER DELETE ON locations
+BEGIN
+  DELETE FROM location_occupancy WHERE location_id = OLD.id;
+END;
+
+-- location_occupancy -> system_occupancy
+DROP TRIGGER IF EXISTS trg_location_occupancy_ai;
+CREATE TRIGGER trg_location_occupancy_ai
+AFTER INSERT ON location_occupancy
+WHEN {_OCCUPANCY_GUARD}
+BEGIN
+  INSERT INTO system_occupancy (system_number, location_count, item_count, total_quantity,
+                                total_volume_mm3, capacity_mm3)
+  VALUES (NEW.system_number, 1, NEW.item_count, NEW.total_quantity,
+          NEW.total_volume_mm3, COALESCE(NEW.capacity_mm3, 0))
+  ON CONFLICT (system_number) DO UPDATE SET
+    location_count = location_count + 1,
+    item_count = item_count + excluded.item_count,
+    total_quantity = total_quantity + excluded.total_quantity,
+    total_volume_mm3 = total_volume_mm3 + excluded.total_volume_mm3,
+    capacity_mm3 = capacity_mm3 + excluded.capacity_mm3;
+END;
+
+DROP TRIGGER IF EXISTS trg_location_occupancy_au;
+CREATE TRIGGER trg_location_occupancy_au
+AFTER UPDATE ON location_occupancy
+WHEN {_OCCUPANCY_GUARD}
+BEGIN
+  UPDATE system_occupancy
+     SET location_count = location_count - 1,
+         item_count = item_count - OLD.item_count,
+         total_quantity = total_quantity - OLD.total_quantity,
+         total_volume_mm3 = total_volume_mm3 - OLD.total_volume_mm3,
+         capacity_mm3 = capacity_mm3 - COALESCE(OLD.capacity_mm3, 0)
+   WHERE system_number = OLD.system_number;
+  INSERT INTO system_occupancy (system_number, location_count, item_count, total_quantity,
+                                total_volume_mm3, capacity_mm3)
+  VALUES (NEW.system_number, 1, NEW.item_count, NEW.total_quantity,
+          NEW.total_volume_mm3, COALESCE(NEW.capacity_mm3, 0))
+  ON CONFLICT (system_number) DO UPDATE SET
+    location_count = location_count + 1,
+    item_count = item_count + excluded.item_count,
+    total_quantity = total_quantity + excluded.total_quantity,
+    total_volume_mm3 = total_volume_mm3 + excluded.total_volume_mm3,
+    capacity_mm3 = capacity_mm3 + excluded.capacity_mm3;
+END;
+
+DROP TRIGGER IF EXISTS trg_location_occupancy_ad;
+CREATE TRIGGER trg_location_occupancy_ad
+AFTER DELETE ON location_occupancy
+WHEN {_OCCUPANCY_GUARD}
+BEGIN
+  UPDATE system_occupancy
+     SET location_count = location_count - 1,
+         item_count = item_count - OLD.item_count,
+         total_quantity = total_quantity - OLD.total_quantity,
+         total_volume_mm3 = total_volume_mm3 - OLD.total_volume_mm3,
+         capacity_mm3 = capacity_mm3 - COALESCE(OLD.capacity_mm3, 0)
+   WHERE system_number = OLD.system_number;
+END;
+"""
+
+
+def _m010_location_occupancy(conn):
+    if "capacity_mm3" not in _columns(conn, "locations"):
+        conn.execute("ALTER TABLE locations ADD COLUMN capacity_mm3 REAL")
+    _run_script(conn, _occupancy_schema())
+    _run_script(conn, _occupancy_fill())
+
+
+def _occupancy_fill() -> str:
+    # the initial fill, frozen here rather than borrowed from locations.py so
+    # this migration doesn't change when the app's rebuild does. The guard
+    # keeps the per-row triggers out of it; system_occupancy is filled once.
+    return f"""
+INSERT OR IGNORE INTO rollup_guard (name) VALUES ('occupancy');
+DELETE FROM location_occupancy;
+DELETE FROM system_occupancy;
+INSERT INTO location_occupancy (location_id, system_number, shelf, capacity_mm3,
+                                item_count, total_quantity, total_volume_mm3)
+SELECT l.id, COALESCE(l.system_number, ''), l.shelf, l.capacity_mm3,
+       COALESCE(a.n, 0), COALESCE(a.q, 0), COALESCE(a.v, 0)
+FROM locations l
+LEFT JOIN (
+  SELECT i.location_id, COUNT(*) AS n, SUM(i.quantity) AS q, SUM({_occupied_volume_sql("i")}) AS v
+  FROM items i
+  WHERE i.is_deleted = 0 AND i.location_id IS NOT NULL
+  GROUP BY i.location_id
+) a ON a.location_id = l.id;
+INSERT INTO system_occupancy (system_number, location_count, item_count, total_quantity,
+                              total_volume_mm3, capacity_mm3)
+SELECT system_number, COUNT(*), SUM(item_count), SUM(total_quantity),
+       SUM(total_volume_mm3), COALESCE(SUM(capacity_mm3), 0)
+FROM location_occupancy
+GROUP BY system_number;
+DELETE FROM rollup_guard WHERE name = 'occupancy';
+"""
+
+
+PG_OCCUPANCY_SCHEMA = """
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS capacity_mm3 DOUBLE PRECISION;
+CREATE TABLE IF NOT EXISTS rollup_guard (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS location_occupancy (
+  location_id       BIGINT PRIMARY KEY,
+  system_number     TEXT NOT NULL DEFAULT '',
+  shelf             TEXT,
+  item_count        INTEGER NOT NULL DEFAULT 0,
+  total_quantity    BIGINT NOT NULL DEFAULT 0,
+  total_volume_mm3  BIGINT NOT NULL DEFAULT 0,
+  capacity_mm3      DOUBLE PRECISION,
+  fill_ratio        DOUBLE PRECISION GENERATED ALWAYS AS
+                      (CASE WHEN capacity_mm3 > 0 THEN total_volume_mm3 / capacity_mm3 END) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_fill     ON location_occupancy(fill_ratio);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_volume   ON location_occupancy(total_volume_mm3);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_quantity ON location_occupancy(total_quantity);
+CREATE INDEX IF NOT EXISTS idx_location_occupancy_system   ON location_occupancy(system_number, shelf);
+CREATE TABLE IF NOT EXISTS system_occupancy (
+  system_number     TEXT PRIMARY KEY,
+  location_count    INTEGER NOT NULL DEFAULT 0,
+  item_count        INTEGER NOT NULL DEFAULT 0,
+  total_quantity    BIGINT NOT NULL DEFAULT 0,
+  total_volume_mm3  BIGINT NOT NULL DEFAULT 0,
+  capacity_mm3      DOUBLE PRECISION NOT NULL DEFAULT 0,
+  fill_ratio        DOUBLE PRECISION GENERATED ALWAYS AS
+                      (CASE WHEN capacity_mm3 > 0 THEN total_volume_mm3 / capacity_mm3 END) STORED
+);
+
+CREATE OR REPLACE FUNCTION fms_occupancy_suspended() RETURNS boolean LANGUAGE sql STABLE AS $$
+  SELECT EXISTS (SELECT 1 FROM rollup_guard WHERE name = 'occupancy')
+$$;
+CREATE OR REPLACE FUNCTION fms_item_volume(h DOUBLE PRECISION, w DOUBLE PRECISION, d DOUBLE PRECISION,
+                                           qty INTEGER) RETURNS BIGINT LANGUAGE sql IMMUTABLE AS $$
+  SELECT CAST(ROUND(COALESCE(h * w * d, 0)) AS BIGINT) * GREATEST(qty, 1)
+$$;
+
+CREATE OR REPLACE FUNCTION fms_items_occupancy() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF fms_occupancy_suspended() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.location_id IS NOT NULL AND OLD.is_deleted = 0 THEN
+    UPDATE location_occupancy
+       SET item_count = item_count - 1,
+           total_quantity = total_quantity - OLD.quantity,
+           total_volume_mm3 = total_volume_mm3
+                              - fms_item_volume(OLD.height_mm, OLD.width_mm, OLD.depth_mm, OLD.quantity)
+     WHERE location_id = OLD.location_id;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'INSERT') AND NEW.location_id IS NOT NULL AND NEW.is_deleted = 0 THEN
+    UPDATE location_occupancy
+       SET item_count = item_count + 1,
+           total_quantity = total_quantity + NEW.quantity,
+           total_volume_mm3 = total_volume_mm3
+                              + fms_item_volume(NEW.height_mm, NEW.width_mm, NEW.depth_mm, NEW.quantity)
+     WHERE location_id = NEW.location_id;
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_items_occupancy ON items;
+CREATE TRIGGER trg_items_occupancy
+  AFTER INSERT OR DELETE OR UPDATE OF location_id, quantity, height_mm, width_mm, depth_mm, is_deleted ON items
+  FOR EACH ROW EXECUTE FUNCTION fms_items_occupancy();
+
+CREATE OR REPLACE FUNCTION fms_locations_occupancy() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO location_occupancy (location_id, system_number, shelf, capacity_mm3)
+    VALUES (NEW.id, COALESCE(NEW.system_number, ''), NEW.shelf, NEW.capacity_mm3)
+    ON CONFLICT DO NOTHING;
+  ELSIF TG_OP = 'UPDATE' THEN
+    UPDATE location_occupancy
+       SET system_number = COALESCE(NEW.system_number, ''), shelf = NEW.shelf, capacity_mm3 = NEW.capacity_mm3
+     WHERE location_id = NEW.id;
+  ELSE
+    DELETE FROM location_occupancy WHERE location_id = OLD.id;
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_locations_occupancy ON locations;
+CREATE TRIGGER trg_locations_occupancy
+  AFTER INSERT OR DELETE OR UPDATE OF system_number, shelf, capacity_mm3 ON locations
+  FOR EACH ROW EXECUTE FUNCTION fms_locations_occupancy();
+
+CREATE OR REPLACE FUNCTION fms_location_occupancy_systems() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF fms_occupancy_suspended() THEN
+    RETURN NULL;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    UPDATE system_occupancy
+       SET location_count = location_count - 1,
+           item_count = item_count - OLD.item_count,
+           total_quantity = total_quantity - OLD.total_quantity,
+           total_volume_mm3 = total_volume_mm3 - OLD.total_volume_mm3,
+           capacity_mm3 = capacity_mm3 - COALESCE(OLD.capacity_mm3, 0)
+     WHERE system_number = OLD.system_number;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'INSERT') THEN
+    INSERT INTO system_occupancy AS s (system_number, location_count, item_count, total_quantity,
+                                       total_volume_mm3, capacity_mm3)
+    VALUES (NEW.system_number, 1, NEW.item_count, NEW.total_quantity,
+            NEW.total_volume_mm3, COALESCE(NEW.capacity_mm3, 0))
+    ON CONFLICT (system_number) DO UPDATE SET
+      location_count = s.location_count + 1,
+      item_count = s.item_count + excluded.item_count,
+      total_quantity = s.total_quantity + excluded.total_quantity,
+      total_volume_mm3 = s.total_volume_mm3 + excluded.total_volume_mm3,
+      capacity_mm3 = s.capacity_mm3 + excluded.capacity_mm3;
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_location_occupancy ON location_occupancy;
+CREATE TRIGGER trg_location_occupancy
+  AFTER INSERT OR UPDATE OR DELETE ON location_occupancy
+  FOR EACH ROW EXECUTE FUNCTION fms_location_occupancy_systems();
+
+-- locations that existed before the triggers; system_occupancy fills from the trigger above
+INSERT INTO location_occupancy (location_id, system_number, shelf, item_count, total_quantity,
+                                total_volume_mm3, capacity_mm3)
+SELECT l.id, COALESCE(l.system_number, ''), l.shelf, COUNT(i.id), COALESCE(SUM(i.quantity), 0),
+       COALESCE(SUM(fms_item_volume(i.height_mm, i.width_mm, i.depth_mm, i.quantity)), 0), l.capacity_mm3
+FROM locations l
+LEFT JOIN items i ON i.location_id = l.id AND i.is_deleted = 0
+GROUP BY l.id
+ON CONFLICT (location_id) DO NOTHING;
+"""
+
+
+# --------------------------------------------------------------------------
+# 11: location capacity dimensions + R*Tree for putaway (locations.fit)
+# --------------------------------------------------------------------------
+
+def _sorted_dims_sql(h: str, w: str, d: str) -> Tuple[str, str, str]:
+    # smallest / middle / largest side, so a box fits a shelf in any orientation
+    lo, hi = f"MIN({h}, {w}, {d})", f"MAX({h}, {w}, {d})"
+    return lo, f"({h} + {w} + {d} - {lo} - {hi})", hi
+
+
+def _location_fit_schema() -> str:
+    s1, s2, s3 = _sorted_dims_sql("l.capacity_height_mm", "l.capacity_width_mm", "l.capacity_depth_mm")
+    refresh = f"""
+  DELETE FROM location_fit WHERE id = NEW.location_id;
+  INSERT INTO location_fit (id, dim1_min, dim1_max, dim2_min, dim2_max, dim3_min, dim3_max, free_min, free_max)
+  SELECT l.id, {s1}, {s1}, {s2}, {s2}, {s3}, {s3},
+         NEW.capacity_mm3 - NEW.total_volume_mm3, NEW.capacity_mm3 - NEW.total_volume_mm3
+  FROM locations l
+  WHERE l.id = NEW.location_id
+    AND l.capacity_height_mm IS NOT NULL AND l.capacity_width_mm IS NOT NULL AND l.capacity_depth_mm IS NOT NULL
+    AND NEW.capacity_mm3 IS NOT NULL;"""
+    return f"""
+-- one point per location with a known box: (sorted inner dimensions, free volume).
+-- R*Tree keeps 32-bit floats, so locations.fit re-checks candidates exactly.
+CREATE VIRTUAL TABLE IF NOT EXISTS location_fit USING rtree(
+  id,
+  dim1_min, dim1_max,
+  dim2_min, dim2_max,
+  dim3_min, dim3_max,
+  free_min, free_max
+);
+
+DROP TRIGGER IF EXISTS trg_location_occupancy_fit_ai;
+CREATE TRIGGER trg_location_occupancy_fit_ai
+AFTER INSERT ON location_occupancy
+BEGIN{refresh}
+END;
+
+DROP TRIGGER IF EXISTS trg_location_occupancy_fit_au;
+CREATE TRIGGER trg_location_occupancy_fit_au
+AFTER UPDATE OF total_volume_mm3, capacity_mm3 ON location_occupancy
+BEGIN{refresh}
+END;
+
+DROP TRIGGER IF EXISTS trg_location_occupancy_fit_ad;
+CREATE TRIGGER trg_location_occupancy_fit_ad
+AFTER DELETE ON location_occupancy
+BEGIN
+  DELETE FROM location_fit WHERE id = OLD.location_id;
+END;
+"""
+
+
+def _m011_location_fit(conn):
+    have = _columns(conn, "locations")
+    for col in ("capacity_height_mm", "capacity_width_mm", "capacity_depth_mm"):
+        if col not in have:
+            conn.execute(f"ALTER TABLE locations ADD COLUMN {col} REAL")
+    _run_script(conn, _location_fit_schema())
+
+
+# the inner box only; the R*Tree is SQLite's, and locations.fit scans on Postgres
+PG_LOCATION_FIT = """
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS capacity_height_mm DOUBLE PRECISION;
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS capacity_width_mm  DOUBLE PRECISION;
+ALTER TABLE locations ADD COLUMN IF NOT EXISTS capacity_depth_mm  DOUBLE PRECISION;
+"""
+
+
+# --------------------------------------------------------------------------
+# 12: purchase-order receiving (orders.receive)
+# --------------------------------------------------------------------------
+# A receipt is a movement batch tagged with its order, so "what arrived
+# against PO 42" is one indexed lookup and each line keeps its movement.
+
+def _m012_order_receipts(conn):
+    if "order_id" not in _columns(conn, "movement_batches"):
+        conn.execute("ALTER TABLE movement_batches ADD COLUMN order_id INTEGER REFERENCES orders(id)")
+    _run_script(conn, """
+CREATE INDEX IF NOT EXISTS idx_movement_batches_order ON movement_batches(order_id) WHERE order_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_orderitems_order_item ON order_items(order_id, item_id);
+""")
+
+
+PG_ORDER_RECEIPTS = """
+ALTER TABLE movement_batches ADD COLUMN IF NOT EXISTS order_id BIGINT REFERENCES orders(id);
+CREATE INDEX IF NOT EXISTS idx_movement_batches_order ON movement_batches(order_id) WHERE order_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_orderitems_order_item ON order_items(order_id, item_id);
+"""
+
+
+# --------------------------------------------------------------------------
+# 13: demand forecasts and reorder points (replenishment.py)
+# --------------------------------------------------------------------------
+
+REPLENISHMENT_SCHEMA = """
+-- one row per item with demand in the forecast window; replaced by each run
+CREATE TABLE IF NOT EXISTS item_replenishment (
+  item_id              INTEGER PRIMARY KEY REFERENCES items(id) ON DELETE CASCADE,
+  avg_daily_demand     REAL NOT NULL,
+  recent_daily_demand  REAL NOT NULL,
+  demand_std           REAL NOT NULL,
+  lead_time_days       REAL NOT NULL,
+  safety_stock         INTEGER NOT NULL,
+  reorder_point        INTEGER NOT NULL,
+  window_days          INTEGER NOT NULL,
+  service_level        REAL NOT NULL,
+  computed_at          TEXT NOT NULL DEFAULT (datetime('now'))
+);
+"""
+
+
+def _m013_replenishment(conn):
+    _run_script(conn, REPLENISHMENT_SCHEMA)
+
+
+PG_REPLENISHMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS item_replenishment (
+  item_id              BIGINT PRIMARY KEY REFERENCES items(id) ON DELETE CASCADE,
+  avg_daily_demand     DOUBLE PRECISION NOT NULL,
+  recent_daily_demand  DOUBLE PRECISION NOT NULL,
+  demand_std           DOUBLE PRECISION NOT NULL,
+  lead_time_days       DOUBLE PRECISION NOT NULL,
+  safety_stock         BIGINT NOT NULL,
+  reorder_point        BIGINT NOT NULL,
+  window_days          INTEGER NOT NULL,
+  service_level        DOUBLE PRECISION NOT NULL,
+  computed_at          TEXT NOT NULL DEFAULT fms_now()
+);
+"""
+
+
+# --------------------------------------------------------------------------
+# 14: movement rollups for analytics (analytics.py)
+# --------------------------------------------------------------------------
+
+MOVEMENT_ROLLUPS_SCHEMA = """
+-- filled from the `movement_rollups` watermark; period is the bucket's first day
+CREATE TABLE IF NOT EXISTS movement_rollup_items (
+  bucket         TEXT NOT NULL CHECK (bucket IN ('day','week','month')),
+  movement_type  TEXT NOT NULL,
+  period         TEXT NOT NULL,
+  item_id        INTEGER NOT NULL,
+  lines          INTEGER NOT NULL,
+  quantity       INTEGER NOT NULL,
+  units          INTEGER NOT NULL,
+  PRIMARY KEY (bucket, movement_type, period, item_id)
+) WITHOUT ROWID;
+-- one item's series
+CREATE INDEX IF NOT EXISTS idx_movement_rollup_items_item
+  ON movement_rollup_items(item_id, bucket, movement_type, period);
+
+CREATE TABLE IF NOT EXISTS movement_rollup_categories (
+  bucket         TEXT NOT NULL CHECK (bucket IN ('day','week','month')),
+  movement_type  TEXT NOT NULL,
+  category       TEXT NOT NULL,   -- '' for items without one
+  period         TEXT NOT NULL,
+  lines          INTEGER NOT NULL,
+  quantity       INTEGER NOT NULL,
+  units          INTEGER NOT NULL,
+  PRIMARY KEY (bucket, movement_type, category, period)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS item_last_movement (
+  item_id           INTEGER PRIMARY KEY,
+  last_movement_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_item_last_movement_at ON item_last_movement(last_movement_at);
+"""
+
+
+def _m014_movement_rollups(conn):
+    _run_script(conn, MOVEMENT_ROLLUPS_SCHEMA)
+
+
+PG_MOVEMENT_ROLLUPS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movement_rollup_items (
+  bucket         TEXT NOT NULL CHECK (bucket IN ('day','week','month')),
+  movement_type  TEXT NOT NULL,
+  period         TEXT NOT NULL,
+  item_id        BIGINT NOT NULL,
+  lines          BIGINT NOT NULL,
+  quantity       BIGINT NOT NULL,
+  units          BIGINT NOT NULL,
+  PRIMARY KEY (bucket, movement_type, period, item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_movement_rollup_items_item
+  ON movement_rollup_items(item_id, bucket, movement_type, period);
+CREATE TABLE IF NOT EXISTS movement_rollup_categories (
+  bucket         TEXT NOT NULL CHECK (bucket IN ('day','week','month')),
+  movement_type  TEXT NOT NULL,
+  category       TEXT NOT NULL,
+  period         TEXT NOT NULL,
+  lines          BIGINT NOT NULL,
+  quantity       BIGINT NOT NULL,
+  units          BIGINT NOT NULL,
+  PRIMARY KEY (bucket, movement_type, category, period)
+);
+CREATE TABLE IF NOT EXISTS item_last_movement (
+  item_id           BIGINT PRIMARY KEY,
+  last_movement_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_item_last_movement_at ON item_last_movement(last_movement_at);
+"""
+
+
+# --------------------------------------------------------------------------
+# 15: checkout rollups for analytics (analytics.refresh_checkouts)
+# --------------------------------------------------------------------------
+# A return updates an old checkouts row, so "new since the watermark" can't
+# be an id range over checkouts. The triggers copy each returned checkout
+# into checkout_returns instead (sign +1), and a correction to one already
+# counted queues the old values with sign -1 first. Archiving and deleting
+# checkouts queue nothing: the rollups keep their history.
+
+# the queue row as analytics reads it
+CHECKOUT_RETURN_COLUMNS = "sign, checkout_id, file_id, holder_name, system_number, checkout_at, return_at, due_at"
+
+
+def _queue_return(sign: int, row: str) -> str:
+    return f"""
+  INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+  SELECT {sign}, {row}.id, {row}.file_id, {row}.holder_name,
+         (SELECT f.system_number FROM files f WHERE f.id = {row}.file_id),
+         {row}.checkout_at, {row}.return_at, {row}.due_at
+  WHERE {row}.return_at IS NOT NULL;"""
+
+
+CHECKOUT_ROLLUPS_SCHEMA = f"""
+-- returned checkouts not yet folded in; AUTOINCREMENT so a drained queue never reuses an id
+CREATE TABLE IF NOT EXISTS checkout_returns (
+  id             INTEGER PRIMARY KEY AUTOINCREMENT,
+  sign           INTEGER NOT NULL CHECK (sign IN (-1, 1)),
+  checkout_id    INTEGER NOT NULL,
+  file_id        INTEGER NOT NULL,
+  holder_name    TEXT NOT NULL,
+  system_number  TEXT,
+  checkout_at    TEXT NOT NULL,
+  return_at      TEXT NOT NULL,
+  due_at         TEXT
+);
+
+DROP TRIGGER IF EXISTS trg_checkouts_returns_ai;
+CREATE TRIGGER trg_checkouts_returns_ai
+AFTER INSERT ON checkouts
+WHEN NEW.return_at IS NOT NULL
+BEGIN{_queue_return(1, "NEW")}
+END;
+
+DROP TRIGGER IF EXISTS trg_checkouts_returns_au;
+CREATE TRIGGER trg_checkouts_returns_au
+AFTER UPDATE OF file_id, holder_name, checkout_at, return_at, due_at ON checkouts
+WHEN OLD.return_at IS NOT NULL OR NEW.return_at IS NOT NULL
+BEGIN{_queue_return(-1, "OLD")}{_queue_return(1, "NEW")}
+END;
+
+-- checkouts: how many; hold_seconds: total checkout -> return;
+-- with_due: how many had a due date; overdue / overdue_seconds: returned after it, by how much
+CREATE TABLE IF NOT EXISTS checkout_rollup_files (
+  file_id          INTEGER PRIMARY KEY,
+  checkouts        INTEGER NOT NULL,
+  hold_seconds     INTEGER NOT NULL,
+  with_due         INTEGER NOT NULL,
+  overdue          INTEGER NOT NULL,
+  overdue_seconds  INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS checkout_rollup_holders (
+  holder_name      TEXT PRIMARY KEY,
+  checkouts        INTEGER NOT NULL,
+  hold_seconds     INTEGER NOT NULL,
+  with_due         INTEGER NOT NULL,
+  overdue          INTEGER NOT NULL,
+  overdue_seconds  INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS checkout_rollup_systems (
+  system_number    TEXT PRIMARY KEY,   -- '' if the file was gone before the return
+  checkouts        INTEGER NOT NULL,
+  hold_seconds     INTEGER NOT NULL,
+  with_due         INTEGER NOT NULL,
+  overdue          INTEGER NOT NULL,
+  overdue_seconds  INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- by the day and hour (UTC) the checkout started: daily series and busiest hours
+CREATE TABLE IF NOT EXISTS checkout_rollup_hours (
+  day              TEXT NOT NULL,
+  hour             INTEGER NOT NULL CHECK (hour BETWEEN 0 AND 23),
+  checkouts        INTEGER NOT NULL,
+  hold_seconds     INTEGER NOT NULL,
+  with_due         INTEGER NOT NULL,
+  overdue          INTEGER NOT NULL,
+  overdue_seconds  INTEGER NOT NULL,
+  PRIMARY KEY (day, hour)
+) WITHOUT ROWID;
+"""
+
+
+def _m015_checkout_rollups(conn):
+    _run_script(conn, CHECKOUT_ROLLUPS_SCHEMA)
+    # history so far goes through the same queue; archived checkouts via analytics.py rebuild-checkouts
+    conn.execute(f"""
+        INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+        SELECT 1, c.id, c.file_id, c.holder_name, f.system_number, c.checkout_at, c.return_at, c.due_at
+        FROM checkouts c
+        LEFT JOIN files f ON f.id = c.file_id
+        WHERE c.return_at IS NOT NULL
+        ORDER BY c.id
+    """)
+
+
+PG_CHECKOUT_ROLLUPS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS checkout_returns (
+  id             BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  sign           INTEGER NOT NULL CHECK (sign IN (-1, 1)),
+  checkout_id    BIGINT NOT NULL,
+  file_id        BIGINT NOT NULL,
+  holder_name    TEXT NOT NULL,
+  system_number  TEXT,
+  checkout_at    TEXT NOT NULL,
+  return_at      TEXT NOT NULL,
+  due_at         TEXT
+);
+CREATE OR REPLACE FUNCTION fms_checkouts_returns() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND OLD.return_at IS NOT NULL THEN
+    INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+    VALUES (-1, OLD.id, OLD.file_id, OLD.holder_name,
+            (SELECT f.system_number FROM files f WHERE f.id = OLD.file_id),
+            OLD.checkout_at, OLD.return_at, OLD.due_at);
+  END IF;
+  IF NEW.return_at IS NOT NULL THEN
+    INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+    VALUES (1, NEW.id, NEW.file_id, NEW.holder_name,
+            (SELECT f.system_number FROM files f WHERE f.id = NEW.file_id),
+            NEW.checkout_at, NEW.return_at, NEW.due_at);
+  END IF;
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_checkouts_returns_ai ON checkouts;
+CREATE TRIGGER trg_checkouts_returns_ai
+  AFTER INSERT ON checkouts
+  FOR EACH ROW WHEN (NEW.return_at IS NOT NULL) EXECUTE FUNCTION fms_checkouts_returns();
+DROP TRIGGER IF EXISTS trg_checkouts_returns_au ON checkouts;
+CREATE TRIGGER trg_checkouts_returns_au
+  AFTER UPDATE OF file_id, holder_name, checkout_at, return_at, due_at ON checkouts
+  FOR EACH ROW WHEN (OLD.return_at IS NOT NULL OR NEW.return_at IS NOT NULL)
+  EXECUTE FUNCTION fms_checkouts_returns();
+CREATE TABLE IF NOT EXISTS checkout_rollup_files (
+  file_id          BIGINT PRIMARY KEY,
+  checkouts        BIGINT NOT NULL,
+  hold_seconds     BIGINT NOT NULL,
+  with_due         BIGINT NOT NULL,
+  overdue          BIGINT NOT NULL,
+  overdue_seconds  BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkout_rollup_holders (
+  holder_name      TEXT PRIMARY KEY,
+  checkouts        BIGINT NOT NULL,
+  hold_seconds     BIGINT NOT NULL,
+  with_due         BIGINT NOT NULL,
+  overdue          BIGINT NOT NULL,
+  overdue_seconds  BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkout_rollup_systems (
+  system_number    TEXT PRIMARY KEY,
+  checkouts        BIGINT NOT NULL,
+  hold_seconds     BIGINT NOT NULL,
+  with_due         BIGINT NOT NULL,
+  overdue          BIGINT NOT NULL,
+  overdue_seconds  BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkout_rollup_hours (
+  day              TEXT NOT NULL,
+  hour             INTEGER NOT NULL CHECK (hour BETWEEN 0 AND 23),
+  checkouts        BIGINT NOT NULL,
+  hold_seconds     BIGINT NOT NULL,
+  with_due         BIGINT NOT NULL,
+  overdue          BIGINT NOT NULL,
+  overdue_seconds  BIGINT NOT NULL,
+  PRIMARY KEY (day, hour)
+);
+
+-- history so far, unless the trigger has been queueing already (a database from before
+-- migrations were versioned on Postgres)
+INSERT INTO checkout_returns ({CHECKOUT_RETURN_COLUMNS})
+SELECT 1, c.id, c.file_id, c.holder_name, f.system_number, c.checkout_at, c.return_at, c.due_at
+FROM checkouts c
+LEFT JOIN files f ON f.id = c.file_id
+WHERE c.return_at IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM checkout_returns)
+  AND NOT EXISTS (SELECT 1 FROM job_watermarks WHERE name = 'checkout_rollups')
+ORDER BY c.id;
+"""
+
+
+# --------------------------------------------------------------------------
+# 16: file versions for If-Match (maintest.update_file and friends)
+# --------------------------------------------------------------------------
+# Every write to a file row bumps version; it is the file's ETag.
+
+def _m016_file_version(conn):
+    if "version" not in _columns(conn, "files"):
+        conn.execute("ALTER TABLE files ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+PG_FILE_VERSION = """
+ALTER TABLE files ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
+"""
+
+
+# --------------------------------------------------------------------------
+# 17: Idempotency-Key responses (idempotency.py)
+# --------------------------------------------------------------------------
+
+IDEMPOTENCY_SCHEMA = """
+-- status IS NULL while the first attempt is still running
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  owner         TEXT NOT NULL,   -- session email, '' without a session
+  idem_key      TEXT NOT NULL,
+  method        TEXT NOT NULL,
+  path          TEXT NOT NULL,
+  status        INTEGER,
+  request_hash  TEXT,
+  headers       TEXT,            -- JSON [[name, value], ...]
+  body          BLOB,            -- zlib
+  created_at    TEXT NOT NULL DEFAULT (datetime('now')),
+  expires_at    TEXT NOT NULL,
+  PRIMARY KEY (owner, idem_key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+"""
+
+
+def _m017_idempotency(conn):
+    _run_script(conn, IDEMPOTENCY_SCHEMA)
+
+
+PG_IDEMPOTENCY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  owner         TEXT NOT NULL,
+  idem_key      TEXT NOT NULL,
+  method        TEXT NOT NULL,
+  path          TEXT NOT NULL,
+  status        INTEGER,
+  request_hash  TEXT,
+  headers       TEXT,
+  body          BYTEA,
+  created_at    TEXT NOT NULL DEFAULT fms_now(),
+  expires_at    TEXT NOT NULL,
+  PRIMARY KEY (owner, idem_key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+"""
+
+
+# --------------------------------------------------------------------------
+# 18: location cache token (db.resolve_locations)
+# --------------------------------------------------------------------------
+# A per-process cache of locations is only right while no location row
+# changes or goes away. Those changes draw a new random token here, and so
+# does every database file (a restored backup doesn't share the live file's
+# token), so a worker that sees a token it didn't load from drops its cache.
+
+LOCATION_CACHE_TOKEN = """
+CREATE TABLE IF NOT EXISTS cache_tokens (
+  name   TEXT PRIMARY KEY,
+  token  INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_tokens (name, token) VALUES ('locations', random());
+
+DROP TRIGGER IF EXISTS trg_locations_cache_token_au;
+CREATE TRIGGER trg_locations_cache_token_au
+AFTER UPDATE OF id, system_number, shelf ON locations
+BEGIN
+  UPDATE cache_tokens SET token = random() WHERE name = 'locations';
+END;
+
+DROP TRIGGER IF EXISTS trg_locations_cache_token_ad;
+CREATE TRIGGER trg_locations_cache_token_ad
+AFTER DELETE ON locations
+BEGIN
+  UPDATE cache_tokens SET token = random() WHERE name = 'locations';
+END;
+"""
+
+
+def _m018_location_cache_token(conn):
+    _run_script(conn, LOCATION_CACHE_TOKEN)
+
+
+PG_LOCATION_CACHE_TOKEN = """
+CREATE TABLE IF NOT EXISTS cache_tokens (
+  name   TEXT PRIMARY KEY,
+  token  BIGINT NOT NULL
+);
+CREATE OR REPLACE FUNCTION fms_random_token() RETURNS BIGINT LANGUAGE sql VOLATILE AS $$
+  SELECT CAST(floor((random() - 0.5) * 9.2e18) AS BIGINT)
+$$;
+INSERT INTO cache_tokens (name, token) VALUES ('locations', fms_random_token()) ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION fms_locations_cache_token() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE cache_tokens SET token = fms_random_token() WHERE name = 'locations';
+  RETURN NULL;
+END $$;
+DROP TRIGGER IF EXISTS trg_locations_cache_token ON locations;
+CREATE TRIGGER trg_locations_cache_token
+  AFTER UPDATE OF id, system_number, shelf OR DELETE ON locations
+  FOR EACH STATEMENT EXECUTE FUNCTION fms_locations_cache_token();
+"""
+
+
+# (version, name, SQLite fn(conn), Postgres script or None if there's nothing to do there)
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None], Optional[str]]] = [
+    (1, "files and checkouts", _m001_base, PG_BASE_SCHEMA),
+    (2, "checkout due/notified columns", _m002_checkout_due, PG_CHECKOUT_DUE),
+    (3, "users and settings", _m003_users_settings, PG_USERS_SETTINGS_SCHEMA),
+    (4, "inventory: locations, items, movements, orders", _m004_inventory, PG_INVENTORY_SCHEMA),
+    (5, "list_files sort keys", _m005_sort_keys, PG_SORT_KEYS),
+    (6, "housekeeping tables", _m006_housekeeping, None),   # housekeeping is SQLite-only
+    (7, "movement batches", _m007_movement_batches, PG_MOVEMENT_BATCHES_SCHEMA),
+    (8, "quantity checkpoints", _m008_quantity_checkpoints, PG_QUANTITY_CHECKPOINTS_SCHEMA),
+    (9, "ledger reconciliation", _m009_reconcile, PG_RECONCILE_SCHEMA),
+    (10, "location occupancy rollups", _m010_location_occupancy, PG_OCCUPANCY_SCHEMA),
+    (11, "location capacity and fit index", _m011_location_fit, PG_LOCATION_FIT),
+    (12, "order receipts", _m012_order_receipts, PG_ORDER_RECEIPTS),
+    (13, "item replenishment", _m013_replenishment, PG_REPLENISHMENT_SCHEMA),
+    (14, "movement rollups", _m014_movement_rollups, PG_MOVEMENT_ROLLUPS_SCHEMA),
+    (15, "checkout rollups", _m015_checkout_rollups, PG_CHECKOUT_ROLLUPS_SCHEMA),
+    (16, "file versions", _m016_file_version, PG_FILE_VERSION),
+    (17, "idempotency keys", _m017_idempotency, PG_IDEMPOTENCY_SCHEMA),
+    (18, "location cache token", _m018_location_cache_token, PG_LOCATION_CACHE_TOKEN),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+# --------------------------------------------------------------------------
+# runner
+# --------------------------------------------------------------------------
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str = None) -> Dict[str, Any]:
+    """Bring the database up to LATEST. Returns what was done and how long it took."""
+    started = time.perf_counter()
+    if not db.is_sqlite():
+        before, applied = db.BACKEND.migrate([(v, name, pg) for v, name, _, pg in MIGRATIONS])
+        return {"backend": db.BACKEND.name, "from_version": before, "to_version": LATEST, "applied": applied,
+                "total_ms": round((time.perf_counter() - started) * 1000.0, 3)}
+
+    conn = sqlite3.connect(db_path or db.DB_PATH)
+    conn.isolation_level = None   # we manage the transaction
+    applied: List[Dict[str, Any]] = []
+    try:
+        # fast path: header read, no lock
+        before = current_version(conn)
+        if before >= LATEST:
+            return {"from_version": before, "to_version": before, "applied": [],
+                    "total_ms": round((time.perf_counter() - started) * 1000.0, 3)}
+
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA busy_timeout = 30000")
+        if before == 0:
+            _m001_auto_vacuum(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another worker may have migrated while we waited for the lock
+            before = current_version(conn)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                  version     INTEGER PRIMARY KEY,
+                  name        TEXT NOT NULL,
+                  applied_at  TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+                  duration_ms REAL NOT NULL
+                )
+            """)
+            for version, name, fn, _ in MIGRATIONS:
+                if version <= before:
+                    continue
+                t0 = time.perf_counter()
+                fn(conn)
+                ms = round((time.perf_counter() - t0) * 1000.0, 3)
+                conn.execute("INSERT OR REPLACE INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)",
+                             (version, name, ms))
+                applied.append({"version": version, "name": name, "ms": ms})
+            conn.execute(f"PRAGMA user_version = {LATEST}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return {"from_version": before, "to_version": LATEST, "applied": applied,
+            "total_ms": round((time.perf_counter() - started) * 1000.0, 3)}
+
+
+def startup_report(import_started: float, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Print where worker start-up time went, and warn past FMS_STARTUP_BUDGET_MS."""
+    total_ms = (time.perf_counter() - import_started) * 1000.0
+    report = {
+        "total_ms": round(total_ms, 1),
+        "imports_ms": round(total_ms - schema["total_ms"], 1),
+        "schema_ms": schema["total_ms"],
+        "migrations_applied": [m["version"] for m in schema["applied"]],
+        "budget_ms": STARTUP_BUDGET_MS,
+        "over_budget": total_ms > STARTUP_BUDGET_MS,
+    }
+    line = (f"[startup] ready in {total_ms:.1f} ms: imports {report['imports_ms']:.1f} ms, "
+            f"schema check {schema['total_ms']:.1f} ms"
+            + (f" (applied migrations {report['migrations_applied']})" if schema["applied"] else "")
+            + f"; budget {STARTUP_BUDGET_MS:.0f} ms")
+    print(line + (" -- OVER BUDGET" if report["over_budget"] else ""))
+    return report
+
+
+def status(db_path: str = None) -> List[Dict[str, Any]]:
+    conn = sqlite3.connect(db_path or db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        have = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'schema_version'").fetchone()
+        rows = conn.execute("SELECT * FROM schema_version ORDER BY version").fetchall() if have else []
+        done = {r["version"]: dict(r) for r in rows}
+        return [done.get(v, {"version": v, "name": name, "applied_at": None}) for v, name, _, _ in MIGRATIONS]
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Apply FMS schema migrations.")
+    p.add_argument("--db", default=db.DB_PATH)
+    p.add_argument("--status", action="store_true")
+    args = p.parse_args(argv)
+    if args.status:
+        for row in status(args.db):
+            print(row)
+    else:
+        print(migrate(args.db))
+
+
+if __name__ == "__main__":
+    main()
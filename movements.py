@@ -0,0 +1,247 @@
+# movements.py
+"""
+Batched movement posting.
+
+Posting movements one INSERT at a time fires trg_movements_ai for every row,
+i.e. one `UPDATE items` per line. POST /api/movements/batch takes a whole
+delivery (thousands of lines) instead and, in one write transaction:
+
+  1. loads every referenced item / location once and validates the lines in
+     order against a running balance per item,
+  2. inserts the accepted lines tagged with a movement_batches id (the
+     trigger skips batched rows, see migration 7),
+  3. applies one aggregated quantity update per item.
+
+Quantities in `movements` are the signed change to items.quantity, so lines
+come in as positive amounts and are stored as:
+
+    in        +quantity
+    out       -quantity
+    adjust    quantity as given (signed, non-zero)
+    transfer  +quantity, from_location_id -> to_location_id; total unchanged
+
+With atomic=true (the default) one bad line rejects the whole batch with 422
+and nothing is written; with atomic=false the good lines are posted and the
+bad ones reported.
+"""
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Literal, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, Body, HTTPException, Request
+from pydantic import BaseModel, field_validator
+
+import db
+import ledger
+from auth import get_current_user, require_admin
+
+router = APIRouter(prefix="/api/movements", tags=["movements"])
+
+MAX_BATCH_LINES = 20000
+ID_CHUNK = 500   # stays under SQLite's bound-parameter limit
+
+
+class MovementLine(BaseModel):
+    item_id: int
+    movement_type: Literal["in", "out", "adjust", "transfer"]
+    quantity: int
+    from_location_id: Optional[int] = None
+    to_location_id: Optional[int] = None
+    timestamp: Optional[str] = None
+    note: Optional[str] = None
+
+    @field_validator("timestamp")
+    def _ts(cls, v):
+        # stored in the ledger's own text format so as-of comparisons hold
+        return ledger.normalize_ts(v) if v else None
+
+
+def _fetch_by_id(conn, sql: str, ids: Iterable[int]) -> Dict[int, Any]:
+    """Run `sql` (with an `IN ({marks})` slot) over ids in chunks; rows keyed by id."""
+    ids = list(ids)
+    out: Dict[int, Any] = {}
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = ids[i:i + ID_CHUNK]
+        for r in conn.execute(sql.format(marks=", ".join("?" * len(chunk))), chunk):
+            out[r["id"]] = r
+    return out
+
+
+def _delta(line: MovementLine) -> int:
+    if line.movement_type == "in":
+        return line.quantity
+    if line.movement_type == "out":
+        return -line.quantity
+    if line.movement_type == "adjust":
+        return line.quantity
+    return 0   # transfer
+
+
+def _check_line(line: MovementLine, items: Dict[int, Any], locations: Dict[int, Any],
+                balance: Dict[int, int], allow_negative: bool) -> Optional[str]:
+    item = items.get(line.item_id)
+    if item is None:
+        return "Unknown item."
+    if item["is_deleted"]:
+        return "Item is deleted."
+    if line.movement_type == "adjust":
+        if line.quantity == 0:
+            return "adjust quantity cannot be 0."
+    elif line.quantity <= 0:
+        return f"{line.movement_type} quantity must be positive."
+
+    for loc in (line.from_location_id, line.to_location_id):
+        if loc is not None and loc not in locations:
+            return f"Unknown location {loc}."
+    if line.movement_type == "transfer":
+        if line.from_location_id is None or line.to_location_id is None:
+            return "transfer needs from_location_id and to_location_id."
+        if line.from_location_id == line.to_location_id:
+            return "transfer from and to the same location."
+
+    d = _delta(line)
+    # only a line that takes stock out can be refused for it
+    if d < 0 and balance[line.item_id] + d < 0 and not allow_negative:
+        return f"Insufficient stock: {balance[line.item_id]} on hand."
+    return None
+
+
+def post_batch(lines: Sequence[MovementLine], operator: Optional[str] = None,
+               atomic: bool = True, allow_negative: bool = False) -> Dict[str, Any]:
+    """Validate and post `lines` in one transaction. See the module docstring."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        # take the write lock up front so the balances we validate against can't move
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            batch_id, results, accepted, changed = apply_batch(conn, lines, operator, atomic, allow_negative,
+                                                               started)
+            conn.execute("COMMIT" if batch_id else "ROLLBACK")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return _summary(batch_id, results, lines, accepted, changed, started, written=batch_id is not None)
+
+
+def apply_batch(conn, lines: Sequence[MovementLine], operator: Optional[str], atomic: bool,
+                allow_negative: bool, started: float,
+                order_id: Optional[int] = None) -> Tuple[Optional[int], List[Dict[str, Any]], List[MovementLine], int]:
+    """
+    post_batch's work inside the caller's write transaction, so other writers
+    (order receiving) can post movements and their own rows atomically.
+    Returns (batch_id, per-line results, accepted lines, items updated);
+    batch_id is None when nothing should be written and the caller must roll back.
+    """
+    db.lock_rows(conn, "items", {l.item_id for l in lines})   # the balances we check can't move
+    items = _fetch_by_id(
+        conn, "SELECT id, quantity, is_deleted FROM items WHERE id IN ({marks})",
+        {l.item_id for l in lines},
+    )
+    locations = _fetch_by_id(
+        conn, "SELECT id FROM locations WHERE id IN ({marks})",
+        {loc for l in lines for loc in (l.from_location_id, l.to_location_id) if loc is not None},
+    )
+
+    balance: Dict[int, int] = defaultdict(int)
+    balance.update({iid: r["quantity"] for iid, r in items.items()})
+    deltas: Dict[int, int] = defaultdict(int)
+    results: List[Dict[str, Any]] = []
+    accepted: List[MovementLine] = []
+    for n, line in enumerate(lines):
+        error = _check_line(line, items, locations, balance, allow_negative)
+        if error:
+            results.append({"line": n, "ok": False, "item_id": line.item_id, "error": error})
+            continue
+        d = _delta(line)
+        balance[line.item_id] += d
+        deltas[line.item_id] += d
+        results.append({"line": n, "ok": True, "item_id": line.item_id})
+        accepted.append(line)
+
+    rejected = len(lines) - len(accepted)
+    if not accepted or (rejected and atomic):
+        return None, results, accepted, 0
+
+    batch_id = conn.execute(
+        "INSERT INTO movement_batches (posted_by, lines, order_id) VALUES (?, ?, ?)",
+        (operator, len(lines), order_id),
+    ).lastrowid
+    conn.executemany(
+        """
+        INSERT INTO movements (
+            item_id, movement_type, quantity, operator_name,
+            from_location_id, to_location_id, timestamp, note, batch_id
+        ) VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, datetime('now')), ?, ?)
+        """,
+        [
+            (l.item_id, l.movement_type,
+             l.quantity if l.movement_type == "transfer" else _delta(l),
+             operator, l.from_location_id, l.to_location_id, l.timestamp, l.note, batch_id)
+            for l in accepted
+        ],
+    )
+    changed = [(d, iid) for iid, d in deltas.items() if d]
+    conn.executemany(
+        "UPDATE items SET quantity = quantity + ?, updated_at = datetime('now') WHERE id = ?",
+        changed,
+    )
+
+    # ids come back in insert order, which is the order of the accepted lines
+    ids = iter(r["id"] for r in conn.execute(
+        "SELECT id FROM movements WHERE batch_id = ? ORDER BY id", (batch_id,)))
+    for res in results:
+        if res["ok"]:
+            res["movement_id"] = next(ids)
+
+    duration_ms = (time.perf_counter() - started) * 1000.0
+    conn.execute(
+        "UPDATE movement_batches SET accepted = ?, duration_ms = ? WHERE id = ?",
+        (len(accepted), round(duration_ms, 3), batch_id),
+    )
+    return batch_id, results, accepted, len(changed)
+
+
+def _summary(batch_id, results, lines, accepted, items_updated, started, written) -> Dict[str, Any]:
+    seconds = time.perf_counter() - started
+    return {
+        "batch_id": batch_id,
+        "written": written,
+        "lines": len(lines),
+        "accepted": len(accepted) if written else 0,
+        "rejected": sum(1 for r in results if not r["ok"]),
+        "items_updated": items_updated,
+        "duration_ms": round(seconds * 1000.0, 3),
+        "lines_per_second": round(len(lines) / seconds, 1) if seconds > 0 else None,
+        "results": results,
+    }
+
+
+@router.post("/batch")
+def post_movements_batch(
+    request: Request,
+    lines: List[MovementLine] = Body(..., embed=True, min_length=1, max_length=MAX_BATCH_LINES),
+    atomic: bool = Body(True, embed=True),
+    allow_negative: bool = Body(False, embed=True),
+):
+    user = get_current_user(request)
+    require_admin(user)
+    operator_name = (user.get("email") or "admin").strip()
+
+    result = post_batch(lines, operator_name, atomic=atomic, allow_negative=allow_negative)
+    if not result["written"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
+
+
+@router.get("/batches/{batch_id}")
+def get_movement_batch(batch_id: int, request: Request):
+    require_admin(get_current_user(request))
+    rows = db.db_read("SELECT * FROM movement_batches WHERE id = ?", (batch_id,))
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return dict(rows[0])
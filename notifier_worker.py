@@ -4,6 +4,15 @@ from email.message import EmailMessage
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
 import db
+import archive
+import replica
+import housekeeping
+import backup
+import ledger
+import reconcile
+import analytics
+import idempotency
+import replenishment
 
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
@@ -47,9 +56,44 @@ def overdue_scan_job():
         # a "retry" mechanism (e.g., clear notified_at on failure). Keeping it simple:
         print("[worker] email send failed:", e)
 
+def archive_checkouts_job():
+    try:
+        summary = archive.run_archiver()
+        if summary["moved"]:
+            print(f"[{datetime.utcnow().isoformat()}] Archived {summary['moved']} checkout(s) in {summary['seconds']}s")
+    except Exception as e:
+        print("[worker] checkout archiving failed:", e)
+
+def replica_refresh_job():
+    try:
+        replica.refresh()
+    except Exception as e:
+        print("[worker] replica refresh failed:", e)
+
+def backup_rotate_job():
+    try:
+        summary = backup.rotate()
+        print(f"[{datetime.utcnow().isoformat()}] Backup written, removed {len(summary['removed'])} old one(s)")
+    except Exception as e:
+        print("[worker] backup failed:", e)
+
 def main():
     sched = BackgroundScheduler(timezone="UTC")
     sched.add_job(overdue_scan_job, "interval", minutes=1, id="overdue-scan")
+    if db.is_sqlite():
+        sched.add_job(archive_checkouts_job, "cron", hour=3, minute=15, id="archive-checkouts")
+        sched.add_job(backup_rotate_job, "cron", hour=2, minute=30, id="backup-rotate")
+    sched.add_job(ledger.checkpoint_job, "interval", hours=1, id="quantity-checkpoint")
+    sched.add_job(reconcile.incremental_job, "interval", minutes=reconcile.INTERVAL_MINUTES, id="reconcile")
+    sched.add_job(reconcile.full_job, "cron", day_of_week="sun", hour=4, minute=0, id="reconcile-full")
+    sched.add_job(replenishment.forecast_job, "cron", hour=3, minute=45, id="replenishment-forecast")
+    sched.add_job(analytics.refresh_job, "interval", minutes=analytics.INTERVAL_MINUTES, id="movement-rollups")
+    sched.add_job(analytics.refresh_checkouts_job, "interval", minutes=analytics.INTERVAL_MINUTES,
+                  id="checkout-rollups")
+    sched.add_job(idempotency.purge_job, "interval", hours=1, id="idempotency-purge")
+    housekeeping.add_jobs(sched)
+    if replica.enabled():
+        sched.add_job(replica_refresh_job, "interval", seconds=replica.REFRESH_SECONDS, id="replica-refresh")
     sched.start()
     print("[worker] notifier started (tick = 1 min); uses settings.reminder_freq_minutes to pace scans")
 
@@ -0,0 +1,307 @@
+# orders.py
+"""
+Purchase-order receiving.
+
+POST /api/orders/{id}/receive takes a whole advance shipping notice and
+applies it in one write transaction:
+
+  1. every line is matched to the order (by item_id or sku) and checked,
+  2. the accepted lines are posted as `in` movements through
+     movements.apply_batch, i.e. one movement batch tagged with the order and
+     one aggregated quantity update per item,
+  3. order_items.quantity_received goes up, filling an item's order lines
+     oldest first (an item ordered twice is received against the first
+     line until it is complete),
+  4. the order becomes `received` when every line is complete, else `partial`.
+
+The body is either JSON, {"lines": [{"item_id" | "sku", "quantity",
+"location_id", "note"}, ...]}, or a CSV with the same column names
+(Content-Type: text/csv). The CSV is spooled to disk as it streams in, so a
+large notice isn't held in memory as one string.
+
+The response reports over-receipts (more received than ordered, refused
+when allow_over=false) and under-receipts (lines still outstanding).
+Like movement batches, atomic=true (the default) rejects the whole notice
+with 422 on any bad line; atomic=false receives the good lines.
+
+    curl -X POST -H 'Content-Type: text/csv' --data-binary @asn.csv \
+      'http://127.0.0.1:8000/api/orders/42/receive?atomic=false'
+"""
+import codecs
+import csv
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+
+import db
+import movements
+from auth import get_current_user, require_admin
+
+router = APIRouter(prefix="/api/orders", tags=["orders"])
+
+MAX_RECEIPT_LINES = movements.MAX_BATCH_LINES
+RECEIVABLE = ("placed", "partial")
+SPOOL_BYTES = 1024 * 1024   # CSV bodies beyond this go to a temp file
+ID_CHUNK = movements.ID_CHUNK
+
+
+class ReceiptLine(BaseModel):
+    item_id: Optional[int] = None
+    sku: Optional[str] = None
+    quantity: int
+    location_id: Optional[int] = None
+    note: Optional[str] = None
+
+
+class OrderNotFound(LookupError):
+    pass
+
+
+class OrderNotReceivable(ValueError):
+    pass
+
+
+def _skus(conn, skus: Sequence[str]) -> Dict[str, int]:
+    skus = list(skus)
+    out: Dict[str, int] = {}
+    for i in range(0, len(skus), ID_CHUNK):
+        chunk = skus[i:i + ID_CHUNK]
+        for r in conn.execute(f"SELECT id, sku FROM items WHERE sku IN ({', '.join('?' * len(chunk))})", chunk):
+            out[r["sku"]] = r["id"]
+    return out
+
+
+def _allocate(order_lines: List[Dict[str, Any]], received: Dict[int, int]) -> List[tuple]:
+    """(amount, order_item_id) updates: fill each item's lines in id order, excess on the last."""
+    rows_for: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+    for r in order_lines:
+        rows_for[r["item_id"]].append(r)
+    updates = []
+    for item_id, amount in received.items():
+        rows = rows_for[item_id]
+        for n, r in enumerate(rows):
+            take = amount if n == len(rows) - 1 else min(amount, max(r["outstanding"], 0))
+            if take:
+                updates.append((take, r["id"]))
+                r["outstanding"] -= take
+                amount -= take
+            if not amount:
+                break
+    return updates
+
+
+def receive(order_id: int, lines: Sequence[ReceiptLine], operator: Optional[str] = None,
+            atomic: bool = True, allow_over: bool = True) -> Dict[str, Any]:
+    """Receive `lines` against order `order_id` in one transaction. See the module docstring."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # two receipts for one order queue here; apply_batch locks the items
+            db.lock_rows(conn, "orders", [order_id])
+            order = conn.execute("SELECT id, status FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if order is None:
+                raise OrderNotFound(f"Order {order_id} not found.")
+            if order["status"] not in RECEIVABLE:
+                raise OrderNotReceivable(f"Order {order_id} is {order['status']}; only placed or partial "
+                                         "orders can be received.")
+
+            order_lines = [
+                {"id": r["id"], "item_id": r["item_id"], "ordered": r["quantity_ordered"],
+                 "outstanding": r["quantity_ordered"] - r["quantity_received"]}
+                for r in conn.execute(
+                    "SELECT id, item_id, quantity_ordered, quantity_received FROM order_items "
+                    "WHERE order_id = ? ORDER BY id", (order_id,))
+            ]
+            outstanding: Dict[int, int] = defaultdict(int)
+            for r in order_lines:
+                outstanding[r["item_id"]] += r["outstanding"]
+            by_sku = _skus(conn, {l.sku for l in lines if l.item_id is None and l.sku})
+
+            results: List[Dict[str, Any]] = []
+            posted: List[movements.MovementLine] = []
+            posted_from: List[int] = []   # posted[k] came from results[posted_from[k]]
+            for n, line in enumerate(lines):
+                item_id = line.item_id if line.item_id is not None else by_sku.get(line.sku)
+                error = None
+                if item_id is None:
+                    error = f"Unknown sku {line.sku!r}." if line.sku else "Line needs item_id or sku."
+                elif item_id not in outstanding:
+                    error = "Item is not on this order."
+                elif line.quantity <= 0:
+                    error = "quantity must be positive."
+                elif line.quantity > outstanding[item_id] and not allow_over:
+                    error = f"Over-receipt: {max(outstanding[item_id], 0)} outstanding."
+                results.append({"line": n, "ok": error is None, "item_id": item_id,
+                                **({"error": error} if error else {})})
+                if error:
+                    continue
+                outstanding[item_id] -= line.quantity
+                posted_from.append(n)
+                posted.append(movements.MovementLine(
+                    item_id=item_id, movement_type="in", quantity=line.quantity,
+                    to_location_id=line.location_id, note=line.note or f"PO {order_id}",
+                ))
+
+            batch_id = None
+            if posted and not (atomic and len(posted) < len(lines)):
+                batch_id, moved, _, _ = movements.apply_batch(conn, posted, operator, atomic, True, started,
+                                                              order_id=order_id)
+                for k, res in enumerate(moved):
+                    out = results[posted_from[k]]
+                    out["ok"] = res["ok"]
+                    if res["ok"] and batch_id is not None:
+                        out["movement_id"] = res["movement_id"]
+                    elif not res["ok"]:
+                        out["error"] = res["error"]
+
+            if batch_id is None:
+                conn.execute("ROLLBACK")
+                return _summary(order_id, order["status"], None, results, [], started)
+
+            received: Dict[int, int] = defaultdict(int)
+            for k, res in enumerate(results[i] for i in posted_from):
+                if res["ok"]:
+                    received[posted[k].item_id] += posted[k].quantity
+            conn.executemany(
+                "UPDATE order_items SET quantity_received = quantity_received + ? WHERE id = ?",
+                _allocate(order_lines, received),
+            )
+            complete = all(r["outstanding"] <= 0 for r in order_lines)
+            status = "received" if complete else "partial"
+            conn.execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+    return _summary(order_id, status, batch_id, results, order_lines, started)
+
+
+def _summary(order_id, status, batch_id, results, order_lines, started) -> Dict[str, Any]:
+    by_item: Dict[int, Dict[str, int]] = {}
+    for r in order_lines:
+        t = by_item.setdefault(r["item_id"], {"item_id": r["item_id"], "ordered": 0, "outstanding": 0})
+        t["ordered"] += r["ordered"]
+        t["outstanding"] += r["outstanding"]
+    seconds = time.perf_counter() - started
+    return {
+        "order_id": order_id,
+        "status": status,
+        "batch_id": batch_id,
+        "written": batch_id is not None,
+        "lines": len(results),
+        "accepted": sum(1 for r in results if r["ok"]) if batch_id is not None else 0,
+        "rejected": sum(1 for r in results if not r["ok"]),
+        "over_received": [{"item_id": t["item_id"], "ordered": t["ordered"], "over_by": -t["outstanding"]}
+                          for t in by_item.values() if t["outstanding"] < 0],
+        "under_received": [{"item_id": t["item_id"], "ordered": t["ordered"], "outstanding": t["outstanding"]}
+                           for t in by_item.values() if t["outstanding"] > 0],
+        "duration_ms": round(seconds * 1000.0, 3),
+        "results": results,
+    }
+
+
+def get_order(order_id: int) -> Optional[Dict[str, Any]]:
+    rows = db.db_read("SELECT * FROM orders WHERE id = ?", (order_id,))
+    if not rows:
+        return None
+    out = dict(rows[0])
+    out["lines"] = [dict(r) for r in db.db_read(
+        "SELECT * FROM order_items WHERE order_id = ? ORDER BY id", (order_id,))]
+    out["receipts"] = [dict(r) for r in db.db_read(
+        "SELECT * FROM movement_batches WHERE order_id = ? ORDER BY id", (order_id,))]
+    return out
+
+
+# --------------------------------------------------------------------------
+# request bodies
+# --------------------------------------------------------------------------
+
+async def _spool(request: Request):
+    """Copy the request body into a spooled temp file as it arrives."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode="w+b")
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _csv_lines(spool) -> List[ReceiptLine]:
+    lines: List[ReceiptLine] = []
+    reader = csv.DictReader(codecs.getreader("utf-8-sig")(spool))
+    for rowno, row in enumerate(reader, start=2):   # row 1 is the header
+        if len(lines) >= MAX_RECEIPT_LINES:
+            raise ValueError(f"At most {MAX_RECEIPT_LINES} lines per receipt.")
+        rec = {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+        try:
+            lines.append(ReceiptLine(**rec))
+        except ValidationError as e:
+            raise ValueError(f"CSV row {rowno}: {e.errors()[0]['msg']}")
+    return lines
+
+
+def _json_lines(body: Any) -> List[ReceiptLine]:
+    raw = body.get("lines") if isinstance(body, dict) else None
+    if not isinstance(raw, list):
+        raise ValueError('Body must be {"lines": [...]}.')
+    if len(raw) > MAX_RECEIPT_LINES:
+        raise ValueError(f"At most {MAX_RECEIPT_LINES} lines per receipt.")
+    try:
+        return [ReceiptLine(**l) for l in raw]
+    except (TypeError, ValidationError) as e:
+        raise ValueError(f"Bad receipt line: {e}")
+
+
+@router.get("/{order_id}")
+def get_order_endpoint(order_id: int, request: Request):
+    require_admin(get_current_user(request))
+    order = get_order(order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found.")
+    return order
+
+
+@router.post("/{order_id}/receive")
+async def post_receive(
+    order_id: int,
+    request: Request,
+    atomic: bool = Query(True),
+    allow_over: bool = Query(True),
+):
+    user = get_current_user(request)
+    require_admin(user)
+    operator_name = (user.get("email") or "admin").strip()
+
+    try:
+        if "csv" in request.headers.get("content-type", ""):
+            spool = await _spool(request)
+            try:
+                lines = await run_in_threadpool(_csv_lines, spool)
+            finally:
+                spool.close()
+        else:
+            lines = _json_lines(await request.json())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not lines:
+        raise HTTPException(status_code=400, detail="No receipt lines.")
+
+    try:
+        result = await run_in_threadpool(receive, order_id, lines, operator_name, atomic, allow_over)
+    except OrderNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OrderNotReceivable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not result["written"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
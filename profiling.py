@@ -0,0 +1,331 @@
+# profiling.py
+"""
+Per-request profiling.
+
+Opt-in: an admin adds the header `X-FMS-Profile: 1` (or `?__profile=1`) to
+any request. That request is sampled by a background stack sampler, every
+statement it runs on an app connection (anything from db._connect or
+db.get_conn, not just db_read/db_write) is recorded, and the result is
+saved under an id returned in the `X-FMS-Profile-Id` response header.
+Profiles go to disk, so statement parameters and the query string keep
+their numbers only (advisor.redact_params).
+
+    GET /api/admin/profiles                 -> stored profiles, newest first
+    GET /api/admin/profiles/{id}            -> full profile (json)
+    GET /api/admin/profiles/{id}/folded     -> collapsed stacks, feed to flamegraph.pl / speedscope
+
+Always-on: with FMS_PROFILE_ALWAYS_ON=1 every request is captured at a low
+sampling rate and only the FMS_PROFILE_KEEP_SLOWEST slowest are kept.
+
+How the sampler finds "this request's" stacks: sync endpoints run on
+threadpool threads, and the request id travels there in a ContextVar. The
+db statement hook notes which thread ids did work for which request, and
+the sampler keeps a short ring buffer of (time, thread, stack) from every
+thread, so at the end of the request we keep the samples that fall inside
+its time window on its threads.
+"""
+import contextvars
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+from urllib.parse import parse_qsl
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+import db
+from advisor import REDACTED, normalize_sql, redact_params
+from auth import get_current_user, require_admin
+
+router = APIRouter(prefix="/api/admin/profiles", tags=["admin"])
+
+PROFILE_HEADER = "x-fms-profile"
+PROFILE_QUERY = "__profile"
+PROFILES_DIR = os.getenv("FMS_PROFILES_DIR", "Database/profiles")
+ALWAYS_ON = os.getenv("FMS_PROFILE_ALWAYS_ON", "0") == "1"
+KEEP_SLOWEST = int(os.getenv("FMS_PROFILE_KEEP_SLOWEST", "20"))
+KEEP_ON_DEMAND = 50
+
+ON_DEMAND_INTERVAL = 0.002   # 500 Hz while someone asked for a profile
+ALWAYS_ON_INTERVAL = 0.02    # 50 Hz background
+MAX_STATEMENTS = 2000
+
+
+class _Capture:
+    __slots__ = ("id", "method", "path", "query", "on_demand", "started", "ended",
+                 "threads", "statements", "by_shape", "dropped")
+
+    def __init__(self, request: Request, on_demand: bool):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = request.method
+        self.path = request.url.path
+        self.query = str(request.url.query)
+        self.on_demand = on_demand
+        self.started = time.perf_counter()
+        self.ended: Optional[float] = None
+        self.threads: Set[int] = set()
+        self.statements: List[Tuple[str, Sequence[Any], float, float]] = []
+        # every statement counts here, also past MAX_STATEMENTS
+        self.by_shape: Dict[str, Dict[str, Any]] = {}
+        self.dropped = 0
+
+
+_current: contextvars.ContextVar[Optional[_Capture]] = contextvars.ContextVar("fms_profile", default=None)
+
+_lock = threading.Lock()
+_active: Set[_Capture] = set()
+_on_demand_ids: Deque[str] = deque()
+_slowest: List[Tuple[float, str]] = []   # min-heap of (duration_ms, id)
+
+
+def _on_statement(sql: str, params: Sequence[Any], elapsed: float) -> None:
+    cap = _current.get()
+    if cap is None:
+        return
+    cap.threads.add(threading.get_ident())
+    shape = normalize_sql(sql)
+    b = cap.by_shape.get(shape)
+    if b is None:
+        b = cap.by_shape[shape] = {"sql": shape, "count": 0, "total_ms": 0.0}
+    b["count"] += 1
+    b["total_ms"] += elapsed * 1000.0
+    if len(cap.statements) < MAX_STATEMENTS:
+        cap.statements.append((shape, params, elapsed, time.perf_counter()))
+    else:
+        cap.dropped += 1
+
+
+db.add_statement_hook(_on_statement)
+
+
+# --------------------------------------------------------------------------
+# sampler
+# --------------------------------------------------------------------------
+
+class _Sampler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="fms-profiler", daemon=True)
+        self.samples: Deque[Tuple[float, int, Tuple[str, ...]]] = deque(maxlen=200_000)
+        self._labels: Dict[Any, str] = {}
+        self._wake = threading.Event()
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        out = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                self._labels[code] = label
+            out.append(label)
+            frame = frame.f_back
+        out.reverse()
+        return tuple(out)
+
+    def run(self):
+        me = threading.get_ident()
+        while True:
+            with _lock:
+                busy = bool(_active)
+                fast = any(c.on_demand for c in _active)
+            if not busy:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            now = time.perf_counter()
+            for tid, frame in sys._current_frames().items():
+                if tid != me:
+                    self.samples.append((now, tid, self._stack(frame)))
+            time.sleep(ON_DEMAND_INTERVAL if fast else ALWAYS_ON_INTERVAL)
+
+    def collect(self, cap: _Capture) -> Counter:
+        folded: Counter = Counter()
+        for t, tid, stack in list(self.samples):
+            if cap.started <= t <= cap.ended and tid in cap.threads:
+                folded[";".join(stack)] += 1
+        return folded
+
+
+_sampler: Optional[_Sampler] = None
+
+
+def _ensure_sampler() -> _Sampler:
+    global _sampler
+    if _sampler is None:
+        with _lock:
+            if _sampler is None:
+                _sampler = _Sampler()
+                _sampler.start()
+    return _sampler
+
+
+# --------------------------------------------------------------------------
+# storage
+# --------------------------------------------------------------------------
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILES_DIR, f"{profile_id}.json")
+
+
+def _redact_query(query: str) -> str:
+    # like statement params: numbers (page=2) stay, text (q=smith) doesn't
+    return "&".join(
+        f"{k}={v if v.lstrip('-').isdigit() else REDACTED}"
+        for k, v in parse_qsl(query, keep_blank_values=True)
+    )
+
+
+def _build_profile(cap: _Capture, status_code: int, folded: Counter) -> Dict[str, Any]:
+    duration_ms = (cap.ended - cap.started) * 1000.0
+    by_shape = {k: dict(v) for k, v in cap.by_shape.items()}
+    statements = []
+    for shape, params, elapsed, finished in cap.statements:
+        statements.append({
+            "at_ms": round((finished - elapsed - cap.started) * 1000.0, 3),
+            "ms": round(elapsed * 1000.0, 3),
+            "sql": shape,
+            "params": redact_params(list(params)[:20]),
+        })
+    db_ms = sum(b["total_ms"] for b in by_shape.values())
+    for b in by_shape.values():
+        b["total_ms"] = round(b["total_ms"], 3)
+
+    return {
+        "id": cap.id,
+        "mode": "on_demand" if cap.on_demand else "slowest",
+        "method": cap.method,
+        "path": cap.path,
+        "query": _redact_query(cap.query),
+        "status": status_code,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "duration_ms": round(duration_ms, 3),
+        "db_ms": round(db_ms, 3),
+        "non_db_ms": round(max(0.0, duration_ms - db_ms), 3),
+        "db_breakdown": sorted(by_shape.values(), key=lambda b: -b["total_ms"]),
+        "statements": statements,
+        "statements_dropped": cap.dropped,   # past MAX_STATEMENTS: in db_breakdown, not listed
+        "samples": sum(folded.values()),
+        "folded": "\n".join(f"{stack} {n}" for stack, n in folded.most_common()),
+    }
+
+
+def _save(profile: Dict[str, Any]) -> None:
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    tmp = _profile_path(profile["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(profile, fh)
+    os.replace(tmp, _profile_path(profile["id"]))
+
+
+def _discard(profile_id: str) -> None:
+    try:
+        os.remove(_profile_path(profile_id))
+    except FileNotFoundError:
+        pass
+
+
+def _finish(cap: _Capture, status_code: int) -> Optional[str]:
+    cap.ended = time.perf_counter()
+    with _lock:
+        _active.discard(cap)
+
+    duration_ms = (cap.ended - cap.started) * 1000.0
+    if not cap.on_demand:
+        # always-on: only worth building if it beats the current N-th slowest
+        with _lock:
+            if len(_slowest) >= KEEP_SLOWEST and duration_ms <= _slowest[0][0]:
+                return None
+
+    folded = _sampler.collect(cap) if _sampler else Counter()
+    _save(_build_profile(cap, status_code, folded))
+
+    with _lock:
+        if cap.on_demand:
+            _on_demand_ids.append(cap.id)
+            evicted = _on_demand_ids.popleft() if len(_on_demand_ids) > KEEP_ON_DEMAND else None
+        else:
+            heapq.heappush(_slowest, (duration_ms, cap.id))
+            evicted = heapq.heappop(_slowest)[1] if len(_slowest) > KEEP_SLOWEST else None
+    if evicted:
+        _discard(evicted)
+    return cap.id
+
+
+# --------------------------------------------------------------------------
+# middleware + endpoints
+# --------------------------------------------------------------------------
+
+def _wants_profile(request: Request) -> bool:
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY)
+    if flag not in ("1", "true", "yes"):
+        return False
+    user = get_current_user(request)
+    return bool(user and user.get("role") == "admin")
+
+
+async def profiling_middleware(request: Request, call_next):
+    on_demand = _wants_profile(request)
+    if not on_demand and not ALWAYS_ON:
+        return await call_next(request)
+
+    _ensure_sampler()
+    cap = _Capture(request, on_demand)
+    with _lock:
+        _active.add(cap)
+    _sampler._wake.set()
+    token = _current.set(cap)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        _current.reset(token)
+        profile_id = _finish(cap, status_code)
+    if on_demand and profile_id:
+        response.headers["X-FMS-Profile-Id"] = profile_id
+    return response
+
+
+@router.get("")
+def list_profiles(user=Depends(require_admin)):
+    out = []
+    if os.path.isdir(PROFILES_DIR):
+        for name in os.listdir(PROFILES_DIR):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(PROFILES_DIR, name), encoding="utf-8") as fh:
+                    p = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            out.append({k: p.get(k) for k in ("id", "mode", "method", "path", "status",
+                                             "created_at", "duration_ms", "db_ms", "samples")})
+    out.sort(key=lambda p: p["created_at"] or "", reverse=True)
+    return out
+
+
+def _load(profile_id: str) -> Dict[str, Any]:
+    if not profile_id.isalnum():
+        raise HTTPException(status_code=400, detail="Bad profile id.")
+    try:
+        with open(_profile_path(profile_id), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str, user=Depends(require_admin)):
+    return _load(profile_id)
+
+
+@router.get("/{profile_id}/folded", response_class=PlainTextResponse)
+def get_profile_folded(profile_id: str, user=Depends(require_admin)):
+    return _load(profile_id)["folded"] + "\n"
@@ -0,0 +1,251 @@
+# reconcile.py
+"""
+Reconciliation of items.quantity against the movements ledger.
+
+items.quantity is a cache kept by trg_movements_ai (and by the aggregated
+update in movements.post_batch). A direct UPDATE, a half-applied migration
+or a restore can make it drift from what the ledger says:
+
+    SUM(movements.quantity) for the item, transfers excluded
+
+Two ways to check:
+
+  incremental  only items that moved since the last run: movements with an id
+               above the `reconcile` high-water mark in job_watermarks, plus
+               items whose updated_at is newer than the last run. Cheap; the
+               worker runs it every FMS_RECONCILE_MINUTES (default 10).
+  full         every item, split into item-id ranges checked by
+               FMS_RECONCILE_WORKERS processes (default 4). Catches direct
+               writes that didn't touch updated_at. Weekly on the worker.
+
+Every mismatch lands in ledger_discrepancies. With fix=True (or
+FMS_RECONCILE_AUTOFIX=1 for the jobs) each one also gets a compensating
+`adjust` movement of (cached - ledger), so the ledger explains the number on
+the shelf. The adjust rows are posted as a movement batch, which the
+quantity trigger skips, so items.quantity itself is left alone.
+
+    python reconcile.py                 # incremental
+    python reconcile.py --full --workers 8 [--fix]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, Body, Depends
+
+import db
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/reconcile", tags=["admin"])
+
+WATERMARK = "reconcile"
+WORKERS = int(os.getenv("FMS_RECONCILE_WORKERS", "4"))
+INTERVAL_MINUTES = int(os.getenv("FMS_RECONCILE_MINUTES", "10"))
+AUTOFIX = os.getenv("FMS_RECONCILE_AUTOFIX", "0") == "1"
+ID_CHUNK = 500
+FIX_OPERATOR = "reconcile"
+
+_LEDGER_SQL = """
+    SELECT i.id AS item_id, i.quantity AS cached,
+           COALESCE((SELECT SUM(m.quantity) FROM movements m
+                     WHERE m.item_id = i.id AND m.movement_type <> 'transfer'), 0) AS ledger
+    FROM items i
+    WHERE {where}
+"""
+
+
+def _mismatches(conn, where: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+    rows = conn.execute(_LEDGER_SQL.format(where=where), params).fetchall()
+    return [{"item_id": r["item_id"], "cached": r["cached"], "ledger": r["ledger"]}
+            for r in rows if r["cached"] != r["ledger"]]
+
+
+def _check_ids(conn, ids: Iterable[int]) -> List[Dict[str, Any]]:
+    ids = list(ids)
+    out: List[Dict[str, Any]] = []
+    for i in range(0, len(ids), ID_CHUNK):
+        chunk = ids[i:i + ID_CHUNK]
+        out += _mismatches(conn, f"i.id IN ({', '.join('?' * len(chunk))})", chunk)
+    return out
+
+
+def check_range(lo: int, hi: int) -> List[Dict[str, Any]]:
+    """Mismatches for lo <= item id < hi. Runs in a sweep worker process."""
+    conn = db._connect()
+    try:
+        return _mismatches(conn, "i.id >= ? AND i.id < ?", (lo, hi))
+    finally:
+        conn.close()
+
+
+def _get_watermark(conn) -> Tuple[int, Optional[str]]:
+    r = conn.execute("SELECT last_id, last_ts FROM job_watermarks WHERE name = ?", (WATERMARK,)).fetchone()
+    return (r["last_id"], r["last_ts"]) if r else (0, None)
+
+
+def _record(conn, kind: str, found: List[Dict[str, Any]], fix: bool) -> int:
+    """Log mismatches and, with fix, post the compensating adjusts. Returns how many were fixed."""
+    if not found:
+        return 0
+    fixed = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if fix:
+            # the sweep read a snapshot; only fix what still disagrees under the write lock
+            current = {m["item_id"]: m for m in _check_ids(conn, [m["item_id"] for m in found])}
+            if current:
+                batch_id = conn.execute(
+                    "INSERT INTO movement_batches (posted_by, lines, accepted) VALUES (?, ?, ?)",
+                    (FIX_OPERATOR, len(current), len(current)),
+                ).lastrowid
+                for m in found:
+                    now = current.get(m["item_id"])
+                    if now is None:
+                        continue
+                    m.update(cached=now["cached"], ledger=now["ledger"])
+                    m["movement_id"] = conn.execute(
+                        """
+                        INSERT INTO movements (item_id, movement_type, quantity, operator_name, note, batch_id)
+                        VALUES (?, 'adjust', ?, ?, ?, ?)
+                        """,
+                        (m["item_id"], now["cached"] - now["ledger"], FIX_OPERATOR,
+                         f"reconcile: items.quantity {now['cached']}, ledger {now['ledger']}", batch_id),
+                    ).lastrowid
+                    fixed += 1
+        conn.executemany(
+            """
+            INSERT INTO ledger_discrepancies (run_kind, item_id, cached_quantity, ledger_quantity, movement_id)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(kind, m["item_id"], m["cached"], m["ledger"], m.get("movement_id")) for m in found],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return fixed
+
+
+def run_incremental(fix: bool = AUTOFIX) -> Dict[str, Any]:
+    """Re-check items touched since the last run and advance the watermark."""
+    started = time.perf_counter()
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        last_id, last_ts = _get_watermark(conn)
+        # one read transaction: the high-water mark and the sums come from the same snapshot
+        conn.execute("BEGIN")
+        high = conn.execute("SELECT COALESCE(MAX(id), 0) AS m FROM movements").fetchone()["m"]
+        now_ts = conn.execute("SELECT datetime('now') AS t").fetchone()["t"]
+        touched = {r["item_id"] for r in conn.execute(
+            "SELECT DISTINCT item_id FROM movements WHERE id > ? AND id <= ?", (last_id, high))}
+        if last_ts:
+            touched |= {r["id"] for r in conn.execute("SELECT id FROM items WHERE updated_at >= ?", (last_ts,))}
+        found = _check_ids(conn, sorted(touched))
+        conn.execute("COMMIT")
+
+        fixed = _record(conn, "incremental", found, fix)
+        conn.execute(
+            """
+            INSERT INTO job_watermarks (name, last_id, last_ts, updated_at) VALUES (?, ?, ?, datetime('now'))
+            ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, last_ts = excluded.last_ts,
+                                            updated_at = excluded.updated_at
+            """,
+            (WATERMARK, high, now_ts),
+        )
+    finally:
+        conn.close()
+    return {"kind": "incremental", "from_movement_id": last_id, "to_movement_id": high,
+            "items_checked": len(touched), "discrepancies": found, "fixed": fixed,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _ranges(workers: int) -> List[Tuple[int, int]]:
+    r = db.db_read("SELECT MIN(id) AS lo, MAX(id) AS hi FROM items")[0]
+    if r["lo"] is None:
+        return []
+    lo, hi = r["lo"], r["hi"] + 1
+    step = max(1, -(-(hi - lo) // max(1, workers)))
+    return [(a, min(a + step, hi)) for a in range(lo, hi, step)]
+
+
+def run_full(workers: int = WORKERS, fix: bool = AUTOFIX) -> Dict[str, Any]:
+    """Check every item, one id range per worker process."""
+    started = time.perf_counter()
+    ranges = _ranges(workers)
+    if workers > 1 and len(ranges) > 1:
+        # spawn: this is called from scheduler threads, which fork() doesn't mix with
+        with multiprocessing.get_context("spawn").Pool(len(ranges)) as pool:
+            parts = pool.starmap(check_range, ranges)
+    else:
+        parts = [check_range(lo, hi) for lo, hi in ranges]
+    found = [m for part in parts for m in part]
+
+    conn = db._connect()
+    conn.isolation_level = None
+    try:
+        fixed = _record(conn, "full", found, fix)
+    finally:
+        conn.close()
+    return {"kind": "full", "ranges": ranges, "discrepancies": found, "fixed": fixed,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def incremental_job():
+    try:
+        summary = run_incremental()
+        if summary["discrepancies"]:
+            print(f"[reconcile] {len(summary['discrepancies'])} item(s) off the ledger, "
+                  f"{summary['fixed']} fixed")
+    except Exception as e:
+        print("[reconcile] incremental run failed:", e)
+
+
+def full_job():
+    try:
+        summary = run_full()
+        print(f"[reconcile] full sweep: {len(summary['discrepancies'])} discrepancies, "
+              f"{summary['fixed']} fixed in {summary['seconds']}s")
+    except Exception as e:
+        print("[reconcile] full sweep failed:", e)
+
+
+def recent_discrepancies(limit: int = 100) -> List[Dict[str, Any]]:
+    return [dict(r) for r in db.db_read(
+        "SELECT * FROM ledger_discrepancies ORDER BY id DESC LIMIT ?", (limit,))]
+
+
+@router.get("")
+def get_reconcile_status(limit: int = 100, user=Depends(require_admin)):
+    rows = db.db_read("SELECT * FROM job_watermarks WHERE name = ?", (WATERMARK,))
+    return {"watermark": dict(rows[0]) if rows else None,
+            "discrepancies": recent_discrepancies(min(max(limit, 1), 1000))}
+
+
+@router.post("/run")
+def run_reconcile(
+    full: bool = Body(False, embed=True),
+    fix: bool = Body(False, embed=True),
+    user=Depends(require_admin),
+):
+    # in-request full sweeps stay in this process
+    return run_full(workers=1, fix=fix) if full else run_incremental(fix=fix)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Check items.quantity against the movements ledger.")
+    p.add_argument("--full", action="store_true", help="check every item instead of the touched ones")
+    p.add_argument("--workers", type=int, default=WORKERS)
+    p.add_argument("--fix", action="store_true", help="post compensating adjust movements")
+    args = p.parse_args(argv)
+    summary = run_full(args.workers, args.fix) if args.full else run_incremental(args.fix)
+    for m in summary["discrepancies"]:
+        print(m)
+    print({k: v for k, v in summary.items() if k != "discrepancies"},
+          f"{len(summary['discrepancies'])} discrepancies")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# replenishment.py
+"""
+Demand forecasts and reorder points for every item, in one vectorised pass.
+
+The job reads the last FMS_FORECAST_DAYS (default 90) of `out` movements
+already summed per item per day by SQLite, as columns (item, day, quantity)
+in NumPy arrays, and gets every item's numbers from a handful of
+np.bincount calls; days without demand count as zeros, and no per-item
+Python loop or dense item x day matrix is needed:
+
+    avg_daily_demand     mean daily demand over the window
+    recent_daily_demand  the same over the last FMS_FORECAST_RECENT_DAYS (28);
+                         this is the forecast
+    demand_std           standard deviation of daily demand over the window
+    lead_time_days       mean days from order to receipt for the item (orders
+                         received through orders.receive), else
+                         FMS_LEAD_TIME_DAYS (7)
+    safety_stock         z * demand_std * sqrt(lead_time_days), z from
+                         FMS_SERVICE_LEVEL (0.95)
+    reorder_point        recent_daily_demand * lead_time_days + safety_stock
+
+Results replace item_replenishment (migration 13) in one transaction; items
+with no demand in the window get no row. GET /api/items/low_stock lists the
+items whose stock on hand plus open purchase orders is at or below their
+reorder point.
+
+numpy is optional: without it the job says so and low_stock serves whatever
+was computed last.
+
+    python replenishment.py [--days 90]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional
+
+import db
+
+WINDOW_DAYS = int(os.getenv("FMS_FORECAST_DAYS", "90"))
+RECENT_DAYS = int(os.getenv("FMS_FORECAST_RECENT_DAYS", "28"))
+DEFAULT_LEAD_TIME_DAYS = float(os.getenv("FMS_LEAD_TIME_DAYS", "7"))
+SERVICE_LEVEL = float(os.getenv("FMS_SERVICE_LEVEL", "0.95"))
+
+_DAILY_OUT_SQL = """
+    SELECT item_id, substr(timestamp, 1, 10) AS day, -SUM(quantity) AS q
+    FROM movements
+    WHERE movement_type = 'out' AND timestamp >= ? AND timestamp < ?
+    GROUP BY item_id, substr(timestamp, 1, 10)
+"""
+
+_LEAD_TIMES_SQL = """
+    SELECT m.item_id, o.created_at, b.posted_at
+    FROM movement_batches b
+    JOIN orders o ON o.id = b.order_id
+    JOIN movements m ON m.batch_id = b.id
+    WHERE b.order_id IS NOT NULL AND b.posted_at >= ?
+"""
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Forecasting needs numpy (pip install numpy).")
+    return numpy
+
+
+def compute(days: int = WINDOW_DAYS, recent_days: int = RECENT_DAYS,
+            service_level: float = SERVICE_LEVEL) -> Dict[str, Any]:
+    """Recompute item_replenishment for every item with demand in the last `days` days."""
+    np = _numpy()
+    started = time.perf_counter()
+    recent_days = max(1, min(recent_days, days))
+    today = datetime.now(timezone.utc).date()
+    start = today - timedelta(days=days)
+    # the window is the `days` whole days before today; today is still filling up
+    rows = db.db_read(_DAILY_OUT_SQL, (start.isoformat(), today.isoformat()))
+    loaded = time.perf_counter()
+
+    written = 0
+    if rows:
+        item_col, day_col, q_col = zip(*rows)
+        item_ids, item_idx = np.unique(np.fromiter(item_col, dtype=np.int64, count=len(rows)),
+                                       return_inverse=True)
+        q = np.fromiter(q_col, dtype=np.float64, count=len(rows))
+        day = (np.array(day_col, dtype="datetime64[D]") - np.datetime64(start.isoformat(), "D")).astype(np.int64)
+        n = len(item_ids)
+
+        total = np.bincount(item_idx, weights=q, minlength=n)
+        total_sq = np.bincount(item_idx, weights=q * q, minlength=n)
+        recent = np.bincount(item_idx, weights=np.where(day >= days - recent_days, q, 0.0), minlength=n)
+
+        avg = total / days
+        std = np.sqrt(np.maximum(total_sq / days - avg * avg, 0.0))
+        forecast = recent / recent_days
+
+        lead = np.full(n, DEFAULT_LEAD_TIME_DAYS)
+        observed = _lead_times(np, start)
+        if observed:
+            obs_ids = np.fromiter(observed.keys(), dtype=np.int64)
+            pos = np.minimum(np.searchsorted(item_ids, obs_ids), n - 1)
+            hit = item_ids[pos] == obs_ids   # items with receipts but no demand drop out
+            lead[pos[hit]] = np.fromiter(observed.values(), dtype=np.float64)[hit]
+
+        z = NormalDist().inv_cdf(service_level)
+        safety = np.ceil(z * std * np.sqrt(lead))
+        reorder = np.ceil(forecast * lead + safety)
+
+        out = list(zip(
+            item_ids.tolist(), np.round(avg, 4).tolist(), np.round(forecast, 4).tolist(),
+            np.round(std, 4).tolist(), np.round(lead, 2).tolist(),
+            safety.astype(np.int64).tolist(), reorder.astype(np.int64).tolist(),
+        ))
+        written = _store(out, days, service_level)
+    else:
+        _store([], days, service_level)
+
+    return {"items": written, "movement_days": len(rows), "window_days": days,
+            "recent_days": recent_days, "service_level": service_level,
+            "load_seconds": round(loaded - started, 3),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _lead_times(np, since) -> Dict[int, float]:
+    """Mean order-to-receipt days per item over the window's receipts."""
+    rows = db.db_read(_LEAD_TIMES_SQL, (since.isoformat(),))
+    if not rows:
+        return {}
+    item_col, created_col, posted_col = zip(*rows)
+    ids = np.fromiter(item_col, dtype=np.int64, count=len(rows))
+    # the ledger's 'YYYY-MM-DD HH:MM:SS' text; NumPy wants the ISO 'T'
+    created = np.array([c.replace(" ", "T") for c in created_col], dtype="datetime64[s]")
+    posted = np.array([p.replace(" ", "T") for p in posted_col], dtype="datetime64[s]")
+    spans = np.maximum((posted - created).astype(np.float64) / 86400.0, 0.0)
+    uniq, idx = np.unique(ids, return_inverse=True)
+    means = np.bincount(idx, weights=spans) / np.bincount(idx)
+    return dict(zip(uniq.tolist(), means.tolist()))
+
+
+def _store(rows: List[tuple], days: int, service_level: float) -> int:
+    conn = db._connect()
+    conn.isolation_level = None   # we issue BEGIN/COMMIT ourselves
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # readers see the previous run until this commits
+            conn.execute("DELETE FROM item_replenishment")
+            conn.executemany(
+                """
+                INSERT INTO item_replenishment (
+                    item_id, avg_daily_demand, recent_daily_demand, demand_std, lead_time_days,
+                    safety_stock, reorder_point, window_days, service_level
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [r + (days, service_level) for r in rows],
+            )
+            written = conn.execute("SELECT COUNT(*) AS n FROM item_replenishment").fetchone()["n"]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return written
+
+
+def low_stock(limit: int = 100, category: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Items at or below their reorder point, counting open purchase orders, most short first."""
+    sql = f"""
+        SELECT i.id AS item_id, i.sku, i.name, i.category, i.quantity,
+               COALESCE(po.on_order, 0) AS on_order,
+               r.reorder_point, r.safety_stock, r.recent_daily_demand, r.demand_std,
+               r.lead_time_days, r.computed_at,
+               r.reorder_point - i.quantity - COALESCE(po.on_order, 0) AS shortfall
+        FROM item_replenishment r
+        JOIN items i ON i.id = r.item_id
+        LEFT JOIN (
+            SELECT oi.item_id, SUM(oi.quantity_ordered - oi.quantity_received) AS on_order
+            FROM order_items oi JOIN orders o ON o.id = oi.order_id
+            WHERE o.status IN ('placed', 'partial') AND oi.quantity_received < oi.quantity_ordered
+            GROUP BY oi.item_id
+        ) po ON po.item_id = r.item_id
+        WHERE i.is_deleted = 0 AND r.reorder_point > 0
+          AND i.quantity + COALESCE(po.on_order, 0) <= r.reorder_point
+          {"AND i.category = ?" if category else ""}
+        ORDER BY shortfall DESC, i.id
+        LIMIT ?
+    """
+    params = ([category] if category else []) + [limit]
+    out = []
+    for r in db.db_read(sql, params):
+        row = dict(r)
+        demand = row["recent_daily_demand"]
+        row["days_of_cover"] = round(max(row["quantity"], 0) / demand, 1) if demand else None
+        out.append(row)
+    return out
+
+
+def forecast_job():
+    try:
+        summary = compute()
+        print(f"[replenishment] {summary['items']} reorder points from "
+              f"{summary['movement_days']} item-days in {summary['seconds']}s")
+    except Exception as e:
+        print("[replenishment] forecast failed:", e)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Recompute demand forecasts and reorder points.")
+    p.add_argument("--days", type=int, default=WINDOW_DAYS)
+    p.add_argument("--recent-days", type=int, default=RECENT_DAYS)
+    p.add_argument("--service-level", type=float, default=SERVICE_LEVEL)
+    args = p.parse_args(argv)
+    print(compute(args.days, args.recent_days, args.service_level))
+
+
+if __name__ == "__main__":
+    main()
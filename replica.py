@@ -0,0 +1,246 @@
+# replica.py
+"""
+Read replica for exports, stats and reporting.
+
+A full export holds a WAL read snapshot for as long as it runs, and while it
+does no checkpoint can get past it, so Database.db-wal keeps growing. Those
+reads don't need up-to-the-second data, so they go to a copy instead:
+Replica.db next to the main database, refreshed with the sqlite3 online backup API.
+
+The refresh copies REPLICA_PAGES_PER_STEP pages at a time with a short pause
+between steps. Each step only holds a read snapshot on the primary for the
+pages it copies, so checkpoints and writers get in between. The copy goes to
+a temp file which is swapped in with os.replace, so readers always see a
+complete replica (connections already open keep the old file until they close).
+
+If the primary is written to mid-copy SQLite restarts the backup; after a few
+restarts we give up on stepping and copy the rest in one go.
+
+Callers use read(): it runs on the replica when the replica is younger than
+the staleness bound, and otherwise reads the primary and kicks off a refresh
+in the background. Those refreshes copy the whole file, so a process starts
+at most one every REFRESH_SECONDS; keeping the replica fresh is the worker's
+interval job, this only covers a worker that isn't running.
+
+    FMS_REPLICA_PATH            default Replica.db in the main database's directory
+    FMS_REPLICA_MAX_STALENESS   seconds, default 60; 0 disables the replica
+    FMS_REPLICA_REFRESH_SECONDS worker refresh interval, default 30
+
+    python replica.py               # refresh once
+    python replica.py --loop 30     # refresh every 30s
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from fastapi import APIRouter, Depends
+
+import archive
+import db
+from auth import require_admin
+
+router = APIRouter(prefix="/api/admin/replica", tags=["admin"])
+
+REPLICA_PATH = os.getenv("FMS_REPLICA_PATH", os.path.join(os.path.dirname(db.DB_PATH), "Replica.db"))
+MAX_STALENESS_SECONDS = float(os.getenv("FMS_REPLICA_MAX_STALENESS", "60"))
+REFRESH_SECONDS = int(os.getenv("FMS_REPLICA_REFRESH_SECONDS", "30"))
+REPLICA_PAGES_PER_STEP = 256
+REPLICA_STEP_PAUSE = 0.005
+MAX_RESTARTS = 3
+
+_refresh_lock = threading.Lock()
+_last_refresh: Dict[str, Any] = {}
+_read_refresh_lock = threading.Lock()
+_read_refresh: Dict[str, Optional[float]] = {"at": None}   # monotonic start of read()'s last refresh
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def enabled() -> bool:
+    # a Postgres primary doesn't have the WAL-pinning problem this solves
+    return MAX_STALENESS_SECONDS > 0 and db.is_sqlite()
+
+
+def age_seconds() -> Optional[float]:
+    """Seconds since the replica file was last swapped in, or None if there isn't one."""
+    try:
+        return max(0.0, time.time() - os.path.getmtime(REPLICA_PATH))
+    except OSError:
+        return None
+
+
+def is_fresh(max_staleness: Optional[float] = None) -> bool:
+    bound = MAX_STALENESS_SECONDS if max_staleness is None else max_staleness
+    age = age_seconds()
+    return enabled() and age is not None and age <= bound
+
+
+def _copy(src: sqlite3.Connection, dst: sqlite3.Connection, pages: int) -> int:
+    restarts = 0
+    last_remaining: List[Optional[int]] = [None]
+
+    def progress(status, remaining, total):
+        nonlocal restarts
+        # remaining jumps back up when a write on the primary restarted the copy
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+
+    try:
+        src.backup(dst, pages=pages, progress=progress, sleep=REPLICA_STEP_PAUSE)
+    except _TooManyRestarts:
+        # the primary is too busy to step through; take it in one snapshot
+        src.backup(dst, pages=-1)
+    return restarts
+
+
+def refresh(pages: int = REPLICA_PAGES_PER_STEP) -> Dict[str, Any]:
+    """Copy the primary into a fresh replica file. One refresh at a time per process."""
+    if not _refresh_lock.acquire(blocking=False):
+        return {"skipped": "refresh already running"}
+    try:
+        started = time.perf_counter()
+        tmp = REPLICA_PATH + ".tmp"
+        for leftover in (tmp, tmp + "-journal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+        src = db._connect()
+        dst = sqlite3.connect(tmp)
+        try:
+            restarts = _copy(src, dst, pages)
+            # the copy inherits WAL mode from the primary; a rollback-journal
+            # file can be opened immutable without -wal/-shm next to it
+            dst.execute("PRAGMA journal_mode = DELETE")
+            page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+
+        os.makedirs(os.path.dirname(REPLICA_PATH) or ".", exist_ok=True)
+        os.replace(tmp, REPLICA_PATH)
+
+        _last_refresh.update(
+            finished_at=time.time(),
+            seconds=round(time.perf_counter() - started, 3),
+            pages=page_count,
+            restarts=restarts,
+        )
+        return dict(_last_refresh)
+    finally:
+        _refresh_lock.release()
+
+
+def refresh_in_background() -> None:
+    if _refresh_lock.locked():
+        return
+
+    def run():
+        try:
+            refresh()
+        except Exception as e:
+            print("[replica] refresh failed:", e)
+
+    threading.Thread(target=run, name="fms-replica-refresh", daemon=True).start()
+
+
+def _refresh_for_read() -> None:
+    """read()'s refresh on a stale replica, at most one per REFRESH_SECONDS."""
+    now = time.monotonic()
+    with _read_refresh_lock:
+        at = _read_refresh["at"]
+        if _refresh_lock.locked() or (at is not None and now - at < REFRESH_SECONDS):
+            return
+        _read_refresh["at"] = now
+    refresh_in_background()
+
+
+def _connect_replica(with_archive: bool) -> sqlite3.Connection:
+    path = os.path.abspath(REPLICA_PATH)
+    # immutable: the file is never modified in place, only replaced
+    conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    conn.row_factory = sqlite3.Row
+    if with_archive and archive.ARCHIVE_PATH:
+        conn.execute("ATTACH DATABASE ? AS arch",
+                     (f"file:{os.path.abspath(archive.ARCHIVE_PATH)}?mode=ro",))
+    return conn
+
+
+def read(sql: str, params: Sequence[Any] = (), max_staleness: Optional[float] = None,
+         with_archive: bool = False, stream: bool = False) -> Iterable[sqlite3.Row]:
+    """
+    db_read against the replica if it's fresh enough, otherwise against the
+    primary (and refresh the replica for next time, see _refresh_for_read).
+    with_archive=True makes checkouts_archive visible the same way
+    archive.read_with_archive does.
+    stream=True lets a primary read come back as a db_stream iterator.
+    """
+    if is_fresh(max_staleness):
+        try:
+            conn = _connect_replica(with_archive)
+        except sqlite3.Error as e:
+            print("[replica] falling back to primary:", e)
+        else:
+            try:
+                t0 = time.perf_counter()
+                rows = conn.execute(sql, params).fetchall()
+                if db._statement_hooks:
+                    db._notify(sql, params, time.perf_counter() - t0)
+                return rows
+            finally:
+                conn.close()
+    elif enabled():
+        _refresh_for_read()
+
+    if with_archive:
+        return archive.read_with_archive(sql, params)
+    if stream:
+        return db.db_stream(sql, params)
+    return db.db_read(sql, params)
+
+
+def replica_status() -> Dict[str, Any]:
+    age = age_seconds()
+    return {
+        "enabled": enabled(),
+        "path": REPLICA_PATH,
+        "age_seconds": None if age is None else round(age, 1),
+        "max_staleness_seconds": MAX_STALENESS_SECONDS,
+        "fresh": is_fresh(),
+        "refreshing": _refresh_lock.locked(),
+        "last_refresh": dict(_last_refresh) or None,
+    }
+
+
+@router.get("")
+def get_replica_status(user=Depends(require_admin)):
+    return replica_status()
+
+
+@router.post("/refresh")
+def refresh_replica(user=Depends(require_admin)):
+    return refresh()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Refresh the FMS read replica.")
+    p.add_argument("--loop", type=int, default=None, metavar="SECONDS",
+                   help="keep refreshing every SECONDS instead of once")
+    p.add_argument("--pages", type=int, default=REPLICA_PAGES_PER_STEP)
+    args = p.parse_args(argv)
+    while True:
+        print(refresh(args.pages))
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+# storage.py
+"""
+Storage backends behind db.py.
+
+db.py picks one at import time from FMS_DB_URL:
+
+    (unset)                          SQLite at FMS_DB_PATH, as before
+    sqlite:///Database/Database.db   SQLite at that path
+    postgresql://user:pw@host/fms    PostgreSQL, pooled (needs psycopg[pool])
+
+Both hand out connections with the sqlite3 surface the code already uses:
+conn.execute(sql, params) with `?` placeholders, cursor.lastrowid, rows that
+index by name or position, `with conn:` committing, conn.close() (which for
+Postgres returns the connection to the pool).
+
+The Postgres side translates the SQLite dialect our queries use (`?`,
+datetime('now'), CURRENT_TIMESTAMP, INSERT OR IGNORE, IFNULL, LIKE, `IS ?`)
+and nothing more: SQLite-only statements (PRAGMA other than the connection
+setup ones, ATTACH, sqlite_master, the backup API) are not translated, and
+the modules built on them (replica, archive, backup, housekeeping, advisor)
+switch themselves off when db.is_sqlite() is False.
+
+Every statement run on a connection from connect()/get_conn() is timed and
+passed to backend.on_statement(sql, params, seconds) when that is set (db.py
+points it at its statement hooks; executemany reports no params). The time
+is the statement's execute, which for a SELECT covers finding the first row,
+not fetching the rest. stream() is left untimed: db.db_stream times it whole.
+
+On top of that each backend offers:
+    stream(sql, params)            rows one batch at a time (server-side cursor on Postgres)
+    copy_rows(table, cols, rows)   bulk load (COPY on Postgres, executemany on SQLite)
+    migrate(steps)                 Postgres only: apply the Postgres bodies of migrations.MIGRATIONS
+"""
+import os
+import re
+import sqlite3
+import time
+import uuid
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+PG_POOL_MIN = int(os.getenv("FMS_PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.getenv("FMS_PG_POOL_MAX", "10"))
+STREAM_BATCH = 2000
+
+
+StatementHook = Callable[[str, Sequence[Any], float], None]
+
+
+class Backend:
+    name = "base"
+    bulk_copy = False
+    IntegrityError: type = Exception
+    on_statement: Optional[StatementHook] = None
+
+    def connect(self):
+        """Connection with name-addressable rows, ready for reads and writes."""
+        raise NotImplementedError
+
+    def get_conn(self):
+        """Plain connection (what db.get_conn() always returned)."""
+        return self.connect()
+
+    def stream(self, sql: str, params: Sequence[Any] = (), size: int = STREAM_BATCH) -> Iterator[Any]:
+        raise NotImplementedError
+
+    def copy_rows(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+        raise NotImplementedError
+
+    def after_bulk_load(self, table: str) -> None:
+        """Called after rows were inserted with explicit ids."""
+
+    def migrate(self, steps: Sequence[Tuple[int, str, Optional[str]]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """Postgres: apply the (version, name, script) steps not yet in schema_version.
+        Returns (version before, what was applied)."""
+        raise NotImplementedError
+
+
+# --------------------------------------------------------------------------
+# SQLite
+# --------------------------------------------------------------------------
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        hook = self.connection.on_statement
+        if hook is None:
+            return super().execute(sql, parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            hook(sql, parameters, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        hook = self.connection.on_statement
+        if hook is None:
+            return super().executemany(sql, seq_of_parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            hook(sql, (), time.perf_counter() - t0)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose statements go through on_statement (set after the setup PRAGMAs)."""
+    on_statement: Optional[StatementHook] = None
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        hook = self.on_statement
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            if hook is not None:
+                hook(script, (), time.perf_counter() - t0)
+
+
+class SQLiteBackend(Backend):
+    name = "sqlite"
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, factory=_TimedConnection)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.row_factory = sqlite3.Row
+        conn.on_statement = self.on_statement
+        return conn
+
+    def get_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=_TimedConnection)
+        conn.on_statement = self.on_statement
+        return conn
+
+    def stream(self, sql, params=(), size=STREAM_BATCH):
+        conn = self.connect()
+        conn.on_statement = None
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                batch = cur.fetchmany(size)
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            conn.close()
+
+    def copy_rows(self, table, columns, rows):
+        marks = ", ".join("?" for _ in columns)
+        conn = self.connect()
+        try:
+            with conn:
+                cur = conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({marks})", rows
+                )
+            return cur.rowcount
+        finally:
+            conn.close()
+
+
+# --------------------------------------------------------------------------
+# PostgreSQL
+# --------------------------------------------------------------------------
+
+# our timestamps are TEXT 'YYYY-MM-DD HH:MM:SS' (UTC) everywhere, and code
+# compares them as strings, so Postgres stores the same text
+_PG_NOW = "to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS')"
+_PG_NOW_PLUS = "to_char((now() AT TIME ZONE 'utc') + CAST(? AS interval), 'YYYY-MM-DD HH24:MI:SS')"
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_NOOP_PRAGMAS = ("foreign_keys", "journal_mode", "synchronous", "busy_timeout")
+_TXN_STATEMENT = re.compile(r"^\s*(BEGIN|COMMIT|END|ROLLBACK)\b(?!\s+TO)", re.I)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str, has_params: bool = True) -> str:
+    """SQLite-dialect statement -> Postgres. Only covers what this codebase uses."""
+    s = re.sub(r"datetime\(\s*'now'\s*,\s*\?\s*\)", _PG_NOW_PLUS, sql, flags=re.I)
+    s = re.sub(r"datetime\(\s*'now'\s*\)", _PG_NOW, s, flags=re.I)
+    s = re.sub(r"\bCURRENT_TIMESTAMP\b", _PG_NOW, s, flags=re.I)
+
+    ignore = re.search(r"\bINSERT\s+OR\s+IGNORE\s+INTO\b", s, re.I) is not None
+    if re.search(r"\bINSERT\s+OR\s+REPLACE\b", s, re.I):
+        raise NotImplementedError("INSERT OR REPLACE has no direct Postgres equivalent; use ON CONFLICT.")
+
+    parts = _STRING_LITERAL.split(s)
+    for i in range(0, len(parts), 2):          # even indexes are outside quotes
+        p = parts[i]
+        p = re.sub(r"\bINSERT\s+OR\s+IGNORE\s+INTO\b", "INSERT INTO", p, flags=re.I)
+        p = re.sub(r"\bIFNULL\s*\(", "COALESCE(", p, flags=re.I)
+        p = re.sub(r"(?<!I)\bLIKE\b", "ILIKE", p, flags=re.I)   # SQLite LIKE is case-insensitive
+        p = re.sub(r"\bCOLLATE\s+NOCASE\b", "", p, flags=re.I)
+        p = re.sub(r"\bIS\s+NOT\s+\?", "IS DISTINCT FROM ?", p, flags=re.I)
+        p = re.sub(r"\bIS\s+\?", "IS NOT DISTINCT FROM ?", p, flags=re.I)
+        if has_params:
+            p = p.replace("%", "%%").replace("?", "%s")
+        parts[i] = p
+    if has_params:
+        for i in range(1, len(parts), 2):      # a literal '%' must be doubled too
+            parts[i] = parts[i].replace("%", "%%")
+    s = "".join(parts).strip().rstrip(";")
+
+    if ignore:
+        m = re.search(r"\bRETURNING\b", s, re.I)
+        s = (s[:m.start()] + "ON CONFLICT DO NOTHING " + s[m.start():]) if m else s + " ON CONFLICT DO NOTHING"
+    return s
+
+
+class _PgRow(dict):
+    """Row addressable as row["col"] and row[0], like sqlite3.Row."""
+    __slots__ = ("_values",)
+
+    def __init__(self, names: Sequence[str], values: Sequence[Any]):
+        super().__init__(zip(names, values))
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return dict.__getitem__(self, key)
+
+
+def _pg_row_factory(cursor):
+    names = [c.name for c in cursor.description] if cursor.description else []
+    return lambda values: _PgRow(names, values)
+
+
+class _PgCursor:
+    def __init__(self, owner: "_PgConnection"):
+        self._owner = owner
+        self._cur = owner.raw.cursor()
+        self._pending: Optional[List[Any]] = None
+        self.lastrowid: Optional[int] = None
+
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def execute(self, sql: str, params: Sequence[Any] = ()):
+        self._pending = None
+        self.lastrowid = None
+        head = sql.lstrip()[:8].upper()
+
+        if head.startswith("PRAGMA"):
+            if any(p in sql.lower() for p in _NOOP_PRAGMAS):
+                self._pending = []
+                return self
+            raise NotImplementedError(f"SQLite-only statement: {sql.strip()[:60]}")
+
+        m = _TXN_STATEMENT.match(sql)
+        if m:
+            verb = m.group(1).upper()
+            if verb in ("COMMIT", "END"):
+                self._owner.commit()
+            elif verb == "ROLLBACK":
+                self._owner.rollback()
+            # BEGIN [IMMEDIATE]: psycopg opens the transaction with the next statement
+            self._pending = []
+            return self
+
+        q = translate(sql, bool(params))
+        wants_id = head.startswith("INSERT") and not re.search(r"\bRETURNING\b", q, re.I)
+        if wants_id:
+            q += " RETURNING *"
+        self._owner._timed(sql, params, lambda: self._owner._guarded(
+            lambda: self._cur.execute(q, tuple(params) if params else None)))
+        if wants_id:
+            row = self._cur.fetchone()
+            self.lastrowid = row.get("id") if row else None
+            self._pending = []
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]):
+        q = translate(sql, True)
+        self._owner._timed(sql, (), lambda: self._owner._guarded(
+            lambda: self._cur.executemany(q, [tuple(p) for p in seq_of_params])))
+        self._pending = []
+        return self
+
+    def fetchone(self):
+        if self._pending is not None:
+            return self._pending.pop(0) if self._pending else None
+        return self._cur.fetchone() if self._cur.description else None
+
+    def fetchmany(self, size: int = 1):
+        if self._pending is not None:
+            out, self._pending = self._pending[:size], self._pending[size:]
+            return out
+        return self._cur.fetchmany(size) if self._cur.description else []
+
+    def fetchall(self):
+        if self._pending is not None:
+            out, self._pending = self._pending, []
+            return out
+        return self._cur.fetchall() if self._cur.description else []
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._cur.close()
+
+
+class _PgConnection:
+    """
+    psycopg connection dressed as sqlite3.Connection.
+
+    One difference we paper over: in Postgres a failed statement poisons the
+    whole transaction, while SQLite just fails that statement. Code here
+    relies on the SQLite behaviour (per-row try/except in imports), so once a
+    transaction has done some work each further statement runs inside a
+    savepoint and a failure only rolls that statement back.
+    """
+
+    def __init__(self, backend: "PostgresBackend", raw):
+        self._backend = backend
+        self.raw = raw
+        self._dirty = False
+        self.row_factory = None      # accepted and ignored; rows are always _PgRow
+        self.isolation_level = ""
+
+    def _guarded(self, fn):
+        if not self._dirty:
+            try:
+                result = fn()
+            except Exception:
+                self.raw.rollback()
+                raise
+            self._dirty = True
+            return result
+
+        self.raw.execute("SAVEPOINT fms_stmt")
+        try:
+            result = fn()
+        except Exception:
+            self.raw.execute("ROLLBACK TO SAVEPOINT fms_stmt")
+            raise
+        self.raw.execute("RELEASE SAVEPOINT fms_stmt")
+        return result
+
+    def _timed(self, sql: str, params: Sequence[Any], fn):
+        hook = self._backend.on_statement
+        if hook is None:
+            return fn()
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            hook(sql, params, time.perf_counter() - t0)
+
+    def cursor(self) -> _PgCursor:
+        return _PgCursor(self)
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> _PgCursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params) -> _PgCursor:
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script: str) -> None:
+        self._timed(script, (), lambda: self.raw.execute(translate(script, False)))
+        self.commit()
+
+    def commit(self) -> None:
+        self.raw.commit()
+        self._dirty = False
+
+    def rollback(self) -> None:
+        self.raw.rollback()
+        self._dirty = False
+
+    def close(self) -> None:
+        if self.raw is not None:
+            self._backend.pool.putconn(self.raw)   # the pool rolls back anything left open
+            self.raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # same as sqlite3: commit or roll back, but don't close
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class PostgresBackend(Backend):
+    name = "postgres"
+    bulk_copy = True
+
+    def __init__(self, url: str):
+        try:
+            import psycopg
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise RuntimeError("FMS_DB_URL points at Postgres but psycopg[pool] is not installed.")
+        self.IntegrityError = psycopg.IntegrityError
+        self.pool = ConnectionPool(
+            url,
+            min_size=PG_POOL_MIN,
+            max_size=PG_POOL_MAX,
+            kwargs={"row_factory": _pg_row_factory},
+            open=True,
+        )
+
+    def connect(self) -> _PgConnection:
+        return _PgConnection(self, self.pool.getconn())
+
+    def stream(self, sql, params=(), size=STREAM_BATCH):
+        raw = self.pool.getconn()
+        try:
+            # named cursor = server-side: rows arrive `size` at a time
+            with raw.cursor(name=f"fms_stream_{uuid.uuid4().hex[:8]}") as cur:
+                cur.itersize = size
+                cur.execute(translate(sql, bool(params)), tuple(params) if params else None)
+                yield from cur
+            raw.commit()
+        finally:
+            self.pool.putconn(raw)
+
+    def copy_rows(self, table, columns, rows):
+        n = 0
+        raw = self.pool.getconn()
+        try:
+            with raw.cursor() as cur:
+                with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as cp:
+                    for row in rows:
+                        cp.write_row(row)
+                        n += 1
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            self.pool.putconn(raw)
+        if "id" in columns:
+            self.after_bulk_load(table)
+        return n
+
+    def after_bulk_load(self, table):
+        # identity columns don't move when ids are supplied explicitly
+        with self.pool.connection() as raw:
+            raw.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            )
+
+    def migrate(self, steps):
+        applied: List[Dict[str, Any]] = []
+        with self.pool.connection() as raw:   # one transaction: commits at the end, or rolls back
+            # one migrator at a time; the lock goes with the transaction
+            raw.execute("SELECT pg_advisory_xact_lock(hashtext('fms_migrations'))")
+            raw.execute(f"""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                  version     INTEGER PRIMARY KEY,
+                  name        TEXT NOT NULL,
+                  applied_at  TEXT NOT NULL DEFAULT ({_PG_NOW}),
+                  duration_ms DOUBLE PRECISION NOT NULL
+                )
+            """)
+            started_before = raw.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            for version, name, script in steps:
+                if version <= started_before:
+                    continue
+                t0 = time.perf_counter()
+                if script:
+                    raw.execute(script)   # no parameters: sent as one multi-statement query
+                ms = round((time.perf_counter() - t0) * 1000.0, 3)
+                raw.execute("INSERT INTO schema_version (version, name, duration_ms) VALUES (%s, %s, %s)",
+                            (version, name, ms))
+                applied.append({"version": version, "name": name, "ms": ms})
+        return started_before, applied
+
+
+def from_env(default_sqlite_path: str) -> Backend:
+    url = os.getenv("FMS_DB_URL", "").strip()
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    return SQLiteBackend(default_sqlite_path)
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import admission
+from admission import Gate, Rejected
+
+
+def _late_wakeups(loop, delay):
+    """Deliver _pass_on's wake-ups `delay` seconds late, as a busy loop or another thread can."""
+    call_soon_threadsafe = loop.call_soon_threadsafe
+    loop.call_soon_threadsafe = lambda cb, *args: call_soon_threadsafe(loop.call_later, delay, cb, *args)
+
+
+def test_timeout_after_handover_keeps_the_slot():
+    async def run():
+        gate = Gate("t", 1, 5, 0.05)
+        await gate.enter()
+        waiter = asyncio.create_task(gate.enter())
+        await asyncio.sleep(0)
+        _late_wakeups(asyncio.get_running_loop(), 0.2)
+        gate.leave(0.0)   # dequeues the waiter; its wake-up lands after its timeout
+        await waiter      # no ValueError, no 429: the slot is the waiter's
+        assert (gate.in_flight, len(gate._waiters)) == (1, 0)
+        gate.leave(0.0)
+        assert gate.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_cancel_after_handover_passes_the_slot_on():
+    async def run():
+        gate = Gate("t", 1, 5, 5)
+        await gate.enter()
+        waiter = asyncio.create_task(gate.enter())
+        await asyncio.sleep(0)
+        _late_wakeups(asyncio.get_running_loop(), 0.2)
+        gate.leave(0.0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert (gate.in_flight, len(gate._waiters)) == (0, 0)
+
+    asyncio.run(run())
+
+
+def test_full_queue_and_timeout_are_rejected():
+    async def run():
+        gate = Gate("t", 1, 1, 0.05)
+        await gate.enter()
+        waiter = asyncio.create_task(gate.enter())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected):
+            await gate.enter()
+        with pytest.raises(Rejected) as err:
+            await waiter
+        assert err.value.retry_after >= 1
+        assert (gate.in_flight, gate.rejected_full, gate.rejected_timeout) == (1, 1, 1)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("method, path, kind", [
+    ("GET", "/api/files", "read"),
+    ("POST", "/api/add_file", "write"),
+    ("POST", "/api/checkouts/batch", "write"),
+    ("GET", "/api/export", "bulk"),
+    ("POST", "/api/orders/42/receive", "bulk"),
+    ("GET", "/api/orders/42", "read"),
+    ("POST", "/api/admin/backup", "bulk"),
+    ("GET", "/", None),
+])
+def test_classify(method, path, kind):
+    assert admission.classify(method, path) == kind
@@ -0,0 +1,109 @@
+"""
+The Postgres backend, end to end. Needs a scratch database, which it wipes:
+
+    FMS_TEST_PG_URL=postgresql://user@host/fms_test python -m pytest tests/test_postgres.py
+
+db.py picks its backend at import, so the checks run in a child interpreter
+with FMS_DB_URL set.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+PG_URL = os.getenv("FMS_TEST_PG_URL", "").strip()
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not PG_URL, reason="FMS_TEST_PG_URL is not set")
+
+CHECKS = r"""
+import json
+import threading
+
+import checkouts
+import db
+import migrations
+import movements
+
+out = {"first": migrations.migrate(), "again": migrations.migrate()}
+
+
+def race(n, fn):
+    # n threads released together; returns their results (or the exception text)
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def run(k):
+        barrier.wait()
+        try:
+            results[k] = fn()
+        except Exception as e:
+            results[k] = repr(e)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+file_id = db.db_write_returning(
+    "INSERT INTO files (name, system_number, shelf, clearance_level) VALUES ('pg race', 'S1', 'A1', 1) RETURNING id"
+)["id"]
+got = race(8, lambda: checkouts.checkout_batch([file_id], "holder", "test")["written"])
+out["checkouts"] = {
+    "results": got,
+    "open": db.db_read("SELECT COUNT(*) AS n FROM checkouts WHERE file_id = ? AND return_at IS NULL",
+                       (file_id,))[0]["n"],
+}
+
+item_id = db.insert_item("pg race", None, None, 1, None, None, None, None, "test", sku="PG-RACE")
+movements.post_batch([movements.MovementLine(item_id=item_id, movement_type="in", quantity=10)], "test")
+take = [movements.MovementLine(item_id=item_id, movement_type="out", quantity=5)]
+got = race(8, lambda: movements.post_batch(take, "test")["written"])
+out["movements"] = {
+    "results": got,
+    "quantity": db.db_read("SELECT quantity FROM items WHERE id = ?", (item_id,))[0]["quantity"],
+}
+
+print(json.dumps(out))
+"""
+
+
+@pytest.fixture(scope="module")
+def checks():
+    import psycopg
+
+    with psycopg.connect(PG_URL, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA public CASCADE")
+        conn.execute("CREATE SCHEMA public")
+
+    env = dict(os.environ, FMS_DB_URL=PG_URL)
+    proc = subprocess.run([sys.executable, "-c", CHECKS], cwd=REPO, env=env,
+                          capture_output=True, text=True, timeout=300)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_migrations_apply_once(checks):
+    import migrations
+
+    assert checks["first"]["from_version"] == 0
+    assert [a["version"] for a in checks["first"]["applied"]] == [m[0] for m in migrations.MIGRATIONS]
+    assert checks["again"]["applied"] == []
+    assert checks["again"]["from_version"] == migrations.LATEST
+
+
+def test_concurrent_checkouts_of_one_file(checks):
+    # one cart wins; the others see its checkout and are refused, nobody errors
+    assert sorted(checks["checkouts"]["results"], key=str) == [False] * 7 + [True]
+    assert checks["checkouts"]["open"] == 1
+
+
+def test_concurrent_takes_never_go_negative(checks):
+    # 10 on hand, eight takes of 5: exactly two fit
+    assert sorted(checks["movements"]["results"], key=str) == [False] * 6 + [True] * 2
+    assert checks["movements"]["quantity"] == 0